@@ -0,0 +1,67 @@
+import json
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def latency_summary(latencies):
+    """Latency percentiles in milliseconds."""
+    return dict((name, round(percentile(latencies, p) * 1000, 2)) for name, p in
+                (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_report(report, output=None):
+    report.setdefault('meta', {}).update(
+        created_at=datetime.utcnow().isoformat(),
+        revision=git_revision(),
+        python=platform.python_version(),
+    )
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+class QueryCounter(object):
+    """Counts SQL statements executed by the current thread."""
+
+    def __init__(self, engine):
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args, **kwargs):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+class Timer(object):
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.time() - self.started
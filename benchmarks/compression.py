@@ -0,0 +1,114 @@
+"""Bytes saved against CPU spent by the compression middleware on HTML pages.
+
+A topic with --comments comments (the page of a topic shows 20) is created in the database from DATABASE_URL (use
+a scratch database), the topic page and the latest comments page are rendered once, then their HTML is sent
+through CompressionMiddleware with every encoding and level, whole and streamed in --chunk-size chunks. For every
+page and setting the report has compressed bytes, saved percent and CPU milliseconds per response:
+
+    $ export DATABASE_URL=sqlite:////tmp/compression.db
+    $ python -m benchmarks.compression --repeat 200 --output compression.json
+"""
+import argparse
+import time
+import uuid
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse, Response
+
+from benchmarks.common import save_report
+from forum import compression
+from forum.app import create_app, db
+from forum.compression import CompressionMiddleware
+from forum.models import Comment, Role, Topic, TopicGroup, User
+
+process_time = getattr(time, 'process_time', time.clock)
+
+BODY = u'''Lorem ipsum dolor sit amet, **consectetur** adipiscing elit, sed do eiusmod tempor incididunt ut labore.
+
+* Ut enim ad minim veniam, quis nostrud [exercitation](https://example.com/exercitation) ullamco laboris.
+* Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur.
+
+> Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.
+'''
+
+
+def create_topic(comments_count):
+    """Creates users, a topic and its comments, returns the topic and the first user."""
+    prefix = uuid.uuid4().hex[:8]
+    users = [User(email='{}_{}@example.com'.format(prefix, i), username='{}_{}'.format(prefix, i),
+                  username_normalized='{}_{}'.format(prefix, i), password='password', confirmed=True)
+             for i in range(5)]
+    topic = Topic(title='Compression ' + prefix, body=BODY, group_id=0, author=users[0])
+    db.session.add_all(users + [topic])
+    db.session.commit()
+    db.session.add_all([Comment(body=BODY, topic=topic, author=users[i % len(users)]) for i in range(comments_count)])
+    db.session.commit()
+    return topic, users[0]
+
+
+def settings():
+    yield 'gzip', 'COMPRESSION_GZIP_LEVEL', 1
+    yield 'gzip', 'COMPRESSION_GZIP_LEVEL', 6
+    yield 'gzip', 'COMPRESSION_GZIP_LEVEL', 9
+    if compression.brotli is not None:
+        for quality in (1, 4, 11):
+            yield 'br', 'COMPRESSION_BROTLI_QUALITY', quality
+
+
+def measure(html, config, encoding, chunk_size, repeat):
+    """Compressed bytes and CPU milliseconds per response of the HTML through the middleware."""
+    def application(environ, start_response):
+        if chunk_size:
+            chunks = (html[i:i + chunk_size] for i in range(0, len(html), chunk_size))
+            return Response(chunks, mimetype='text/html')(environ, start_response)
+        return Response(html, mimetype='text/html')(environ, start_response)
+
+    client = Client(CompressionMiddleware(application, config), BaseResponse)
+    size = 0
+    started = process_time()
+    for _ in range(repeat):
+        size = len(client.get('/', headers={'Accept-Encoding': encoding}).data)
+    elapsed = process_time() - started
+    return size, elapsed / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--chunk-size', type=int, default=4096, help='bytes of chunks of streamed responses')
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        topic, user = create_topic(args.comments)
+        topic_id, email = topic.id, user.email
+    client = app.test_client()
+    client.post('/auth/login', data=dict(email=email, password='password'))
+    pages = dict(topic=client.get('/topic/{}'.format(topic_id)).data,
+                 latest_comments=client.get('/latest?target=comments').data)
+
+    results = {}
+    for page, html in pages.items():
+        identity, identity_cpu = measure(html, app.config, 'identity', 0, args.repeat)
+        results[page] = dict(identity=dict(bytes=identity, cpu_ms=round(identity_cpu, 3)))
+        for encoding, setting, level in settings():
+            config = dict(app.config, **{setting: level})
+            for mode, chunk_size in (('whole', 0), ('streamed', args.chunk_size)):
+                size, cpu = measure(html, config, encoding, chunk_size, args.repeat)
+                results[page]['{}_{}_{}'.format(encoding, level, mode)] = dict(
+                    bytes=size, saved_percent=round(100.0 * (identity - size) / identity, 1),
+                    cpu_ms=round(cpu - identity_cpu, 3))
+
+    report = dict(meta=dict(comments=args.comments, repeat=args.repeat, chunk_size=args.chunk_size,
+                            brotli=compression.brotli is not None), pages=results)
+    save_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
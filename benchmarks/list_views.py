@@ -0,0 +1,223 @@
+"""Bytes read from the database, loaded objects, time and memory of requests of lists of topics.
+
+Topics with long bodies by users with long profiles are created in the database from DATABASE_URL (use
+a scratch database), then every list view is requested by a logged in user. For every view the report has:
+
+- result_bytes: size of values of rows returned by the queries of the request, measured by running the same
+  statements again through a raw connection;
+- loaded_objects: ORM instances built for the request;
+- peak_memory_kb: peak memory of one request, measured in a child process;
+- elapsed_ms: the best time of --repeat requests.
+
+Run it on two revisions to compare them:
+
+    $ export DATABASE_URL=sqlite:////tmp/list_views.db
+    $ python -m benchmarks.list_views --topics 2000 --body-size 20000 --output after.json
+"""
+import argparse
+import os
+import resource
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import six
+from sqlalchemy import event
+
+from benchmarks.common import save_report
+from forum.app import create_app, db
+from forum.models import Comment, Favorite, Role, Topic, TopicGroup, User
+from utils.bulk import bulk_insert, next_id, reset_sequence
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+PASSWORD = 'password'
+VIEWS = [
+    ('index', '/'),
+    ('topic_group', '/topic_group/{group_id}'),
+    ('latest', '/latest'),
+    ('latest_comments', '/latest?target=comments'),
+    ('hot', '/hot?period=year'),
+    ('user', '/user/{username}'),
+    ('participation', '/participation'),
+    ('favorites', '/favorites'),
+]
+
+
+def create_dataset(topics_count, users_count, body_size):
+    """Creates users, a group of topics with comments and favorites, returns the first user and the group."""
+    prefix = uuid.uuid4().hex[:8]
+    user = User(email='{}@example.com'.format(prefix), username=prefix, username_normalized=prefix,
+                password=PASSWORD, confirmed=True)
+    group = TopicGroup(title='List ' + prefix, group_id=0)
+    db.session.add_all([user, group])
+    db.session.commit()
+    role_id = Role.query.filter_by(default=True).first().id
+    first_user_id = next_id(User.__table__)
+    user_ids = [user.id] + list(range(first_user_id, first_user_id + users_count - 1))
+    about = ('About me. ' * body_size)[:body_size // 4]
+    bulk_insert(User.__table__, (dict(id=user_id, email='{}_{}@example.com'.format(prefix, user_id),
+                                      username='{}_{}'.format(prefix, user_id),
+                                      username_normalized='{}_{}'.format(prefix, user_id), role_id=role_id,
+                                      password_hash=user.password_hash, confirmed=True, about=about,
+                                      avatar='https://example.com/avatar/{}'.format(user_id))
+                                 for user_id in user_ids[1:]))
+    reset_sequence(User.__table__)
+
+    now = datetime.utcnow()
+    body = ('Lorem ipsum dolor sit amet. ' * body_size)[:body_size]
+    first_topic_id = next_id(Topic.__table__)
+    topic_ids = list(range(first_topic_id, first_topic_id + topics_count))
+    bulk_insert(Topic.__table__, (dict(id=topic_id, title='Topic {}'.format(topic_id), body=body,
+                                       body_html='<p>{}</p>'.format(body), group_id=group.id,
+                                       author_id=user_ids[i % len(user_ids)], created_at=now - timedelta(hours=i),
+                                       updated_at=now - timedelta(hours=i), deleted=False, interest=i % 7,
+                                       last_comment_seq=2)
+                                  for i, topic_id in enumerate(topic_ids)))
+    reset_sequence(Topic.__table__)
+    first_comment_id = next_id(Comment.__table__)
+    bulk_insert(Comment.__table__, (dict(id=first_comment_id + 2 * i + seq - 1, body=body[:1000],
+                                         body_html='<p>{}</p>'.format(body[:1000]), topic_id=topic_id,
+                                         author_id=user_ids[(i + seq) % len(user_ids)], seq=seq,
+                                         created_at=now - timedelta(hours=i) + timedelta(minutes=seq),
+                                         updated_at=now - timedelta(hours=i) + timedelta(minutes=seq), deleted=False)
+                                    for i, topic_id in enumerate(topic_ids) for seq in (1, 2)))
+    reset_sequence(Comment.__table__)
+    bulk_insert(Favorite.__table__, (dict(user_id=user.id, topic_id=topic_id) for topic_id in topic_ids[::2]))
+    db.session.commit()
+    return user, group
+
+
+def value_size(value):
+    if isinstance(value, (six.binary_type, six.text_type)):
+        return len(value)
+    return 8
+
+
+class StatementRecorder(object):
+    """Statements executed by the application while it is recording."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.recording = False
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.recording and statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def result_bytes(self):
+        size = 0
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for statement, parameters in self.statements:
+                cursor.execute(statement, parameters)
+                size += sum(value_size(value) for row in cursor.fetchall() for value in row)
+        finally:
+            connection.close()
+        return size
+
+
+def in_child(function):
+    """Result of the function (a string) called in a child process, so memory it allocates is not kept here."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        os.write(write_fd, function().encode())
+        os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd) as f:
+        return f.read()
+
+
+def peak_memory_kb(request):
+    """Peak memory allocated by the request, by tracemalloc if it is available, otherwise by growth of the peak
+    resident memory, which shows memory of the request only if freed memory of previous requests isn't reused.
+    """
+    def measure():
+        if tracemalloc:
+            tracemalloc.start()
+            request()
+            return str(tracemalloc.get_traced_memory()[1] // 1024)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        request()
+        return str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+
+    return int(in_child(measure) or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topics', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--body-size', type=int, default=20000, help='Characters of bodies of topics')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = {}
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        db.session.remove()
+
+    def create():
+        with app.app_context():
+            user, group = create_dataset(args.topics, args.users, args.body_size)
+            return '{} {} {}'.format(user.email, user.username, group.id)
+
+    # Rows of the dataset are created in a child process to keep memory of this process small for peak_memory_kb.
+    email, username, group_id = in_child(create).split()
+    with app.app_context():
+        recorder = StatementRecorder(db.engine)
+    loaded = [0]
+    event.listen(db.Model, 'load', lambda target, context: loaded.__setitem__(0, loaded[0] + 1), propagate=True)
+
+    client = app.test_client()
+    client.post('/auth/login', data=dict(email=email, password=PASSWORD))
+    requests = []
+    for name, url in VIEWS:
+        url = url.format(group_id=group_id, username=username)
+
+        def request(url=url):
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+            return response
+
+        requests.append((name, request))
+        results[name] = dict(peak_memory_kb=peak_memory_kb(request))
+
+    for name, request in requests:
+        request()
+        recorder.statements, recorder.recording, loaded[0] = [], True, 0
+        request()
+        recorder.recording = False
+        objects = loaded[0]
+        timings = []
+        for _ in range(args.repeat):
+            started = time.time()
+            request()
+            timings.append(time.time() - started)
+        with app.app_context():
+            size = recorder.result_bytes()
+        results[name].update(result_bytes=size, queries=len(recorder.statements), loaded_objects=objects,
+                             elapsed_ms=round(min(timings) * 1000, 2))
+
+    report = dict(meta=dict(topics=args.topics, users=args.users, body_size=args.body_size,
+                            database=app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]),
+                  views=results)
+    save_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Throughput of the mail delivery against a local stand-in SMTP server.
+
+Compares a new SMTP session per email (what mail.send does) with email tasks sharing the pooled session of the
+worker process. --latency adds a delay to every SMTP command to model the round trips to a remote server:
+
+    $ python -m benchmarks.mail --emails 500 --latency 5 --output mail.json
+"""
+import argparse
+
+from benchmarks.common import Timer, save_report
+from forum.app import create_app, mail
+from forum.celery_tasks import _build_message, send_email, smtp_connection
+from utils.smtp_server import LocalSMTPServer
+
+EMAIL = dict(recipients=['john@example.com'], subject='Confirm Your Account', body='Hello, John!' * 20,
+             html='<p>Hello, John!</p>' * 20)
+
+
+def session_per_email(count):
+    for _ in range(count):
+        mail.send(_build_message(**EMAIL))
+
+
+def pooled_tasks(count):
+    for _ in range(count):
+        send_email.apply(kwargs=EMAIL)
+
+
+MODES = [
+    ('session_per_email', session_per_email),
+    ('pooled_tasks', pooled_tasks),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emails', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=5, help='delay of every SMTP command in ms')
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    app = create_app()
+    results = {}
+    with app.app_context():
+        state = app.extensions['mail']
+        for name, run in MODES:
+            with LocalSMTPServer(latency=args.latency / 1000.0) as server:
+                state.server, state.port, state.use_tls, state.use_ssl, state.suppress = (
+                    server.host, server.port, False, False, False)
+                state.username = state.password = None
+                with Timer() as timer:
+                    run(args.emails)
+                    server.wait_for(args.emails)
+                smtp_connection.close()
+                results[name] = dict(elapsed=round(timer.elapsed, 3), sessions=server.sessions,
+                                     delivered=len(server.messages),
+                                     emails_per_second=round(len(server.messages) / timer.elapsed, 1))
+
+    report = dict(meta=dict(emails=args.emails, latency_ms=args.latency), modes=results)
+    save_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
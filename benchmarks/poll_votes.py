@@ -0,0 +1,113 @@
+"""Load test of the poll vote write path.
+
+Many voters vote for one poll concurrently and every voter sends its vote several times, so the test shows
+sustained votes per second and checks that only one vote per voter is stored.
+It writes to the database from DATABASE_URL, so point it to a scratch database:
+
+    $ DATABASE_URL=sqlite:////tmp/votes.db python -m benchmarks.poll_votes --voters 2000 --threads 16
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from benchmarks.common import latency_summary, save_report
+from forum.app import create_app, db
+from forum.models import Role, User, Topic, PollAnswer, PollVote
+
+Voter = namedtuple('Voter', 'id')
+
+
+def prepare_poll(voters_count, answers_count):
+    run_id = uuid.uuid4().hex[:8]
+    Role.insert_roles()
+    role = Role.query.filter_by(default=True).first()
+    db.session.execute(User.__table__.insert(), [
+        dict(email='voter_{}_{}@example.com'.format(run_id, i), username='voter_{}_{}'.format(run_id, i),
+             username_normalized='voter_{}_{}'.format(run_id, i), role_id=role.id, confirmed=True)
+        for i in range(voters_count)])
+    voter_ids = [u.id for u in User.query.with_entities(User.id).filter(
+        User.username_normalized.like('voter_{}_%'.format(run_id)))]
+    topic = Topic(title='Poll load test {}'.format(run_id), body='Poll load test', poll='Load test?',
+                  author_id=voter_ids[0])
+    db.session.add(topic)
+    db.session.commit()
+    db.session.add_all([PollAnswer(topic_id=topic.id, body='Answer {}'.format(i)) for i in range(answers_count)])
+    db.session.commit()
+    answer_ids = [a.id for a in topic.poll_answers]
+    return topic.id, voter_ids, answer_ids
+
+
+def vote_worker(app, topic_id, answer_ids, work, work_lock, latencies, results):
+    with app.app_context():
+        topic = Topic.query.get(topic_id)
+        answers = PollAnswer.query.filter(PollAnswer.id.in_(answer_ids)).all()
+        db.session.commit()
+        while True:
+            with work_lock:
+                if not work:
+                    break
+                voter_id = work.pop()
+            started = time.time()
+            taken = topic.add_vote(Voter(voter_id), random.choice(answers))
+            db.session.commit()
+            latencies.append(time.time() - started)
+            results.append(taken)
+        db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--voters', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=2, help='votes sent by every voter')
+    parser.add_argument('--answers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        topic_id, voter_ids, answer_ids = prepare_poll(args.voters, args.answers)
+
+    work = voter_ids * args.repeat
+    random.shuffle(work)
+    work_lock = threading.Lock()
+    latencies, results = [], []
+    threads = [threading.Thread(target=vote_worker, args=(app, topic_id, answer_ids, work, work_lock, latencies,
+                                                          results))
+               for _ in range(args.threads)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    with app.app_context():
+        Topic.refresh_interest([topic_id])
+        db.session.commit()
+        stored = PollVote.query.filter_by(topic_id=topic_id).count()
+        interest = Topic.query.get(topic_id).interest
+
+    report = dict(
+        database=app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        threads=args.threads,
+        attempts=len(results),
+        taken=sum(1 for r in results if r),
+        rejected=sum(1 for r in results if not r),
+        stored=stored,
+        interest=interest,
+        elapsed=round(elapsed, 3),
+        votes_per_second=round(len(results) / elapsed, 1),
+        latency_ms=latency_summary(latencies),
+    )
+    save_report(report, args.output)
+    if stored != len(voter_ids):
+        raise SystemExit('Expected {} votes, {} stored'.format(len(voter_ids), stored))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Latency of transactional mail while a large bulk job drains.
+
+Tasks run in the in-process executor (TASK_DISPATCH=local) which has the topology of the workers in Procfile:
+every queue is served by its own threads. A bulk job of --digests favorites digests is queued at once, then a
+password reset email is sent every --interval ms and the time from the dispatch to the delivery to a local SMTP
+stand-in is measured. The same traffic with all tasks in one queue served by the same number of threads shows
+what the routing buys, the run without the bulk job is the baseline:
+
+    $ export DATABASE_URL=sqlite:////tmp/forum_bench.db
+    $ python -m benchmarks.queues --digests 500 --probes 20 --latency 5 --output queues.json
+"""
+import argparse
+import time
+import uuid
+
+from benchmarks.common import Timer, latency_summary, save_report
+from forum.app import create_app, db
+from forum.celery_tasks import send_favorites_digest, send_user_email, smtp_connection
+from forum.dispatch import dispatch, shutdown_executors
+from forum.models import Role, Topic, TopicGroup, User
+from utils.smtp_server import LocalSMTPServer
+
+
+def create_users(prefix, count):
+    users = [User(email='{}_{}@example.com'.format(prefix, i), username='{}_{}'.format(prefix, i),
+                  username_normalized='{}_{}'.format(prefix, i), password='cat', confirmed=True)
+             for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [(u.id, u.email) for u in users]
+
+
+def run(app, server, digest_users, probes, topic_id, interval):
+    """Queues digests and then probes, returns latencies of probes in seconds and the time of the bulk job."""
+    started = time.time()
+    batch_size = app.config['MAIL_BATCH_SIZE']
+    for start in range(0, len(digest_users), batch_size):
+        dispatch(send_favorites_digest, [[[user_id, [[topic_id, 3]]]
+                                          for user_id, _ in digest_users[start:start + batch_size]]])
+    sent_at = {}
+    for user_id, email in probes:
+        sent_at[email] = time.time()
+        dispatch(send_user_email, ['reset_password', user_id], dict(token='token'))
+        time.sleep(interval)
+    server.wait_for(len(digest_users) + len(probes), timeout=600)
+    elapsed = time.time() - started
+    shutdown_executors()
+    latencies = [received_at - sent_at[recipients[0]]
+                 for (_, recipients, _), received_at in zip(server.messages, server.received_at)
+                 if recipients[0] in sent_at]
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--digests', type=int, default=500, help='emails of the bulk job')
+    parser.add_argument('--probes', type=int, default=20, help='password reset emails')
+    parser.add_argument('--interval', type=float, default=50, help='ms between password reset emails')
+    parser.add_argument('--latency', type=float, default=5, help='delay of every SMTP command in ms')
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    app = create_app()
+    routed_threads = dict(app.config['TASK_EXECUTOR_THREADS'])
+    modes = [
+        ('idle', False, app.config['CELERY_ROUTES'], routed_threads),
+        ('one_queue', True, {}, {app.config['CELERY_DEFAULT_QUEUE']: sum(routed_threads.values())}),
+        ('routed', True, app.config['CELERY_ROUTES'], routed_threads),
+    ]
+    results = {}
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        prefix = uuid.uuid4().hex[:8]
+        with Timer() as timer:
+            digest_users = create_users(prefix + '_bulk', args.digests)
+            probes = create_users(prefix + '_probe', args.probes)
+            topic = Topic(title='Digest topic', body='body', group_id=app.config['ROOT_TOPIC_GROUP'],
+                          author_id=probes[0][0])
+            db.session.add(topic)
+            db.session.commit()
+        print('{} users created in {:.1f} s'.format(args.digests + args.probes, timer.elapsed))
+
+        state = app.extensions['mail']
+        for name, bulk, routes, threads in modes:
+            app.config.update(TASK_DISPATCH='local', CELERY_ROUTES=routes, TASK_EXECUTOR_THREADS=threads,
+                              TASK_QUEUE_SIZE=args.digests + args.probes)
+            with LocalSMTPServer(latency=args.latency / 1000.0) as server:
+                state.server, state.port, state.use_tls, state.use_ssl, state.suppress = (
+                    server.host, server.port, False, False, False)
+                state.username = state.password = None
+                latencies, elapsed = run(app, server, digest_users if bulk else [], probes, topic.id,
+                                         args.interval / 1000.0)
+                smtp_connection.close()
+            results[name] = dict(probe_latency_ms=latency_summary(latencies), delivered=len(server.messages),
+                                 elapsed=round(elapsed, 3), threads=threads)
+
+    report = dict(meta=dict(digests=args.digests, probes=args.probes, interval_ms=args.interval,
+                            latency_ms=args.latency), modes=results)
+    save_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Microbenchmarks of the content rendering pipeline: Markdown -> bleach.clean -> bleach.linkify.
+
+Every body of the corpus is rendered at several sizes, each stage is timed separately and peak memory of the
+whole pipeline is measured in a forked process. The scaling exponent of time over input size is estimated
+for every family of bodies and families growing faster than --max-exponent are reported as over budget:
+
+    $ python -m benchmarks.rendering --sizes 100 200 400 800 --output rendering.json
+"""
+import argparse
+import math
+import os
+import resource
+import sys
+import time
+
+import bleach
+from markdown import markdown
+
+from benchmarks.common import save_report
+from forum.config import config
+from forum.models import MARKDOWN_EXTENSIONS
+
+STAGES = [
+    ('markdown', lambda text: markdown(text, extensions=MARKDOWN_EXTENSIONS, output_format='html')),
+    ('clean', lambda html: bleach.clean(html, tags=config.ALLOWED_TAGS, attributes=config.ALLOWED_ATTRIBUTES,
+                                        strip=True)),
+    ('linkify', lambda html: bleach.linkify(html)),
+]
+
+SENTENCE = 'Lorem ipsum dolor sit amet, *consectetur* adipiscing elit, sed do `eiusmod` tempor incididunt. '
+
+# Family name -> function building a body of the given size.
+CORPUS = {
+    # representative bodies
+    'paragraphs': lambda n: '\n\n'.join(SENTENCE * 3 for _ in range(n // 10 + 1)),
+    'mixed': lambda n: '\n\n'.join(
+        '### Header {0}\n\n{1}\n\n* item [link](http://example.com/{0})\n* item\n\n'
+        '    code = {0}\n\n> quote {1}'.format(i, SENTENCE) for i in range(n // 20 + 1)),
+    # adversarial bodies
+    'huge_table': lambda n: '| a | b | c |\n|---|---|---|\n' + '\n'.join(
+        '| {0} | *{0}* | http://example.com/{0} |'.format(i) for i in range(n)),
+    'many_urls': lambda n: ' '.join('http://example{0}.com/path?q={0}'.format(i) for i in range(n)),
+    'deep_quotes': lambda n: '\n'.join('>' * i + ' level {}'.format(i) for i in range(1, n // 4 + 2)),
+    'deep_lists': lambda n: '\n'.join('    ' * min(i, 50) + '* item {}'.format(i) for i in range(n // 2)),
+    'long_line': lambda n: 'word ' * (n * 20),
+    'html_tags': lambda n: ''.join('<div onclick="x()"><span style="y">{0}</span><script>z()</script></div>'.format(
+        i) for i in range(n)),
+    'emphasis': lambda n: '*_' * (n * 5) + 'text' + '_*' * (n * 5),
+}
+
+
+def run_stages(text, repeat):
+    """Returns the best time of every stage and the output size."""
+    timings = dict((name, []) for name, _ in STAGES)
+    for _ in range(repeat):
+        value = text
+        for name, stage in STAGES:
+            started = time.time()
+            value = stage(value)
+            timings[name].append(time.time() - started)
+    return dict((name, min(times)) for name, times in timings.items()), dict(
+        (name, max(times)) for name, times in timings.items()), len(value)
+
+
+def peak_memory_kb(text):
+    """Growth of the peak resident memory while the pipeline renders the text, measured in a child process."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        value = text
+        for _, stage in STAGES:
+            value = stage(value)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write_fd, str(after - before).encode())
+        os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 64)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return int(result)
+
+
+def scaling_exponent(points):
+    """Slope of log(time) over log(size) by least squares."""
+    points = [(math.log(size), math.log(max(elapsed, 1e-7))) for size, elapsed in points]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    denominator = sum((x - mean_x) ** 2 for x, _ in points)
+    if not denominator:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / denominator
+
+
+def benchmark_family(name, make_text, sizes, repeat):
+    results = []
+    for size in sizes:
+        text = make_text(size)
+        best, worst, output_size = run_stages(text, repeat)
+        total = sum(best.values())
+        results.append(dict(
+            size=size,
+            input_bytes=len(text),
+            output_bytes=output_size,
+            stages_ms=dict((stage, round(elapsed * 1000, 3)) for stage, elapsed in best.items()),
+            worst_ms=round(sum(worst.values()) * 1000, 3),
+            throughput_kb_per_s=round(len(text) / 1024.0 / total, 1) if total else None,
+            peak_memory_kb=peak_memory_kb(text),
+        ))
+    exponents = dict(
+        (stage, round(scaling_exponent([(r['input_bytes'], r['stages_ms'][stage]) for r in results]), 2))
+        for stage, _ in STAGES)
+    return dict(sizes=results, exponents=exponents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 400])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--family', nargs='*', choices=sorted(CORPUS), default=sorted(CORPUS))
+    parser.add_argument('--max-exponent', type=float, default=1.3,
+                        help='budget of the scaling exponent, 1 is linear')
+    parser.add_argument('--output', help='file to save results as JSON')
+    args = parser.parse_args()
+
+    families = {}
+    over_budget = []
+    for name in args.family:
+        families[name] = benchmark_family(name, CORPUS[name], args.sizes, args.repeat)
+        for stage, exponent in families[name]['exponents'].items():
+            if exponent > args.max_exponent:
+                over_budget.append('{}/{}: {}'.format(name, stage, exponent))
+    report = dict(meta=dict(sizes=args.sizes, repeat=args.repeat, max_exponent=args.max_exponent),
+                  families=families, over_budget=over_budget)
+    save_report(report, args.output)
+    if over_budget:
+        sys.exit('Super-linear rendering: ' + ', '.join(over_budget))
+
+
+if __name__ == '__main__':
+    main()
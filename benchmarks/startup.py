@@ -0,0 +1,132 @@
+"""Startup time and memory of a web worker and its first requests with and without compiled templates.
+
+Every mode runs --runs times in a new Python process, which imports the app, creates it and requests pages
+rendering the most used templates. Modes:
+
+- no_cache: templates are compiled on first requests, as before TEMPLATE_CACHE_DIR;
+- bytecode_cache: compiled templates are read from TEMPLATE_CACHE_DIR filled by compile_templates;
+- preloaded: the bytecode cache and forum.startup.preload like gunicorn.conf.py, requests are made in a forked
+  child like a worker of gunicorn --preload, so create_app and preloading are paid once by the master;
+- worker: the app of Celery workers and commands, create_app(web=False) without requests.
+
+The report has medians in milliseconds of the import, of create_app and its phases and of first requests, and
+kilobytes of resident and private memory of the process making requests (on Linux), private memory of a forked
+child is what it doesn't share with the master:
+
+    $ export DATABASE_URL=sqlite:////tmp/startup.db
+    $ python -m benchmarks.startup --runs 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import percentile, save_report
+
+PAGES = ['/auth/login', '/auth/register', '/auth/reset', '/missing']
+
+
+def memory():
+    """Resident and private kilobytes of the current process, empty without /proc."""
+    sizes = dict(rss_kb=0, private_kb=0)
+    try:
+        with open('/proc/self/smaps') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    sizes['rss_kb'] += int(line.split()[1])
+                elif line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    sizes['private_kb'] += int(line.split()[1])
+    except IOError:
+        return {}
+    return sizes
+
+
+def child(mode):
+    """Timings of one start, printed as JSON."""
+    started = time.time()
+    from forum.app import create_app, db
+    from forum import startup
+    imported = time.time()
+    app = create_app(web=mode != 'worker')
+    created = time.time()
+    result = dict(import_ms=(imported - started) * 1000, create_app_ms=(created - imported) * 1000)
+    for phase, elapsed in app.extensions['startup'].items():
+        result['create_app.{}_ms'.format(phase)] = elapsed
+    if mode == 'worker':
+        result.update(memory())
+        print(json.dumps(result))
+        return
+    with app.app_context():
+        db.create_all()
+
+    def requests():
+        timings = {}
+        client = app.test_client()
+        for page in PAGES:
+            page_started = time.time()
+            client.get(page)
+            timings['first ' + page] = (time.time() - page_started) * 1000
+        page_started = time.time()
+        client.get(PAGES[0])
+        timings['second ' + PAGES[0]] = (time.time() - page_started) * 1000
+        timings.update(memory())
+        return timings
+
+    if mode == 'preloaded':
+        preload_started = time.time()
+        startup.preload(app)
+        result['preload_ms'] = (time.time() - preload_started) * 1000
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            startup.dispose_engine(app)
+            os.write(write_fd, json.dumps(requests()).encode())
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as f:
+            result.update(json.loads(f.read()))
+    else:
+        result.update(requests())
+    result['first_requests_ms'] = sum(value for key, value in result.items() if key.startswith('first '))
+    print(json.dumps(result))
+
+
+def run(mode, env):
+    command = [sys.executable, '-m', 'benchmarks.startup', '--child', mode]
+    return json.loads(subprocess.check_output(command, env=dict(os.environ, **env)).decode().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='file to save results as JSON')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    directory = tempfile.mkdtemp()
+    try:
+        subprocess.check_call([sys.executable, 'manage.py', 'compile_templates'],
+                              env=dict(os.environ, TEMPLATE_CACHE_DIR=directory))
+        modes = [('no_cache', dict(TEMPLATE_CACHE_DIR='')),
+                 ('bytecode_cache', dict(TEMPLATE_CACHE_DIR=directory)),
+                 ('preloaded', dict(TEMPLATE_CACHE_DIR=directory)),
+                 ('worker', dict(TEMPLATE_CACHE_DIR=directory))]
+        results = {}
+        for name, env in modes:
+            runs = [run(name, env) for _ in range(args.runs)]
+            results[name] = dict((key, round(percentile([r[key] for r in runs], 50), 2)) for key in runs[0])
+    finally:
+        shutil.rmtree(directory)
+    save_report(dict(meta=dict(runs=args.runs, pages=PAGES), modes=results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+from flask import jsonify
+
+from . import api
+
+
+def error_response(status, error, message=None):
+    response = jsonify(error=error, message=message)
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(400)
+def bad_request(e):
+    return error_response(400, 'bad request', getattr(e, 'description', None))
+
+
+@api.errorhandler(403)
+def forbidden(e):
+    return error_response(403, 'forbidden')
+
+
+@api.errorhandler(404)
+def not_found(e):
+    return error_response(404, 'not found')
+
+
+@api.errorhandler(500)
+def internal_server_error(e):
+    return error_response(500, 'internal server error')
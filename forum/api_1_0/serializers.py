@@ -0,0 +1,98 @@
+"""Serializers of API resources.
+
+Every field knows the columns it is made of, so a query selects only columns of the requested fields instead of
+whole rows of models. Columns and positions of fields in rows are computed once per set of requested fields.
+"""
+from flask import url_for
+from sqlalchemy import and_, func, select
+
+from ..models import Comment, Topic, TopicGroup, User
+
+
+def _iso(value):
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+class Field(object):
+    def __init__(self, *columns, **kwargs):
+        self.columns = columns
+        self.convert = kwargs.get('convert', lambda value: value)
+
+
+class Serializer(object):
+    def __init__(self, fields, default=None):
+        self.fields = fields
+        self.default = tuple(default or sorted(fields))
+        self.plans = {}
+
+    def parse(self, value):
+        """Names of fields of the ?fields= argument, raises ValueError on unknown fields."""
+        if not value:
+            return self.default
+        names = tuple(name.strip() for name in value.split(',') if name.strip())
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError('Unknown fields: {}'.format(', '.join(unknown)))
+        return names or self.default
+
+    def plan(self, names):
+        """Columns to select for the fields and positions of values of every field in a row."""
+        plan = self.plans.get(names)
+        if plan is None:
+            columns, positions, fields = [], {}, []
+            for name in names:
+                field = self.fields[name]
+                for column in field.columns:
+                    if id(column) not in positions:
+                        positions[id(column)] = len(columns)
+                        columns.append(column)
+                fields.append((name, [positions[id(column)] for column in field.columns], field.convert))
+            plan = self.plans[names] = (columns, fields)
+        return plan
+
+    def dump(self, row, fields, offset=0):
+        return dict((name, convert(*[row[offset + i] for i in indexes])) for name, indexes, convert in fields)
+
+
+_comments_count = select([func.count(Comment.id)]).where(
+    and_(Comment.topic_id == Topic.id, Comment.deleted == False)).as_scalar().label('comments_count')
+_topics_count = select([func.count(Topic.id)]).where(
+    and_(Topic.group_id == TopicGroup.id, Topic.deleted == False)).as_scalar().label('topics_count')
+
+topic_group_serializer = Serializer(dict(
+    id=Field(TopicGroup.id),
+    title=Field(TopicGroup.title),
+    priority=Field(TopicGroup.priority),
+    protected=Field(TopicGroup.protected),
+    group_id=Field(TopicGroup.group_id),
+    created_at=Field(TopicGroup.created_at, convert=_iso),
+    topics_count=Field(_topics_count),
+    url=Field(TopicGroup.id, convert=lambda group_id: url_for('api.get_topic_group', topic_group_id=group_id)),
+))
+
+topic_serializer = Serializer(dict(
+    id=Field(Topic.id),
+    title=Field(Topic.title),
+    body_html=Field(Topic.body_html),
+    created_at=Field(Topic.created_at, convert=_iso),
+    updated_at=Field(Topic.updated_at, convert=_iso),
+    group_id=Field(Topic.group_id),
+    poll=Field(Topic.poll),
+    interest=Field(Topic.interest),
+    author=Field(User.username),
+    author_avatar=Field(User.avatar),
+    comments_count=Field(_comments_count),
+    url=Field(Topic.id, convert=lambda topic_id: url_for('api.get_topic', topic_id=topic_id)),
+), default=('id', 'title', 'created_at', 'group_id', 'poll', 'author', 'author_avatar', 'url'))
+
+comment_serializer = Serializer(dict(
+    id=Field(Comment.id),
+    topic_id=Field(Comment.topic_id),
+    seq=Field(Comment.seq),
+    topic_title=Field(Topic.title),
+    body_html=Field(Comment.body_html),
+    created_at=Field(Comment.created_at, convert=_iso),
+    updated_at=Field(Comment.updated_at, convert=_iso),
+    author=Field(User.username),
+    author_avatar=Field(User.avatar),
+), default=('id', 'topic_id', 'seq', 'body_html', 'created_at', 'author', 'author_avatar'))
@@ -0,0 +1,181 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import six
+from flask import abort, current_app, jsonify, request, url_for
+from flask_login import current_user
+from sqlalchemy import and_, between, or_
+
+from . import api
+from .serializers import comment_serializer, topic_group_serializer, topic_serializer
+from ..app import db
+from ..models import Comment, PollAnswer, Topic, TopicGroup, User
+
+HOT_PERIODS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def cursor_value(column, value):
+    """The value of the cursor as a value of the column, raises ValueError if it doesn't fit the column."""
+    python_type = column.type.python_type
+    if python_type is datetime and isinstance(value, six.string_types):
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+    if python_type is int and isinstance(value, six.integer_types) and not isinstance(value, bool):
+        return value
+    raise ValueError('{!r} is not a value of {}'.format(value, column))
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('Wrong number of values')
+        return [cursor_value(column, value) for column, value in zip(columns, values)]
+    except (TypeError, ValueError, UnicodeError):
+        abort(400, 'Invalid cursor')
+
+
+def fields_of(serializer):
+    try:
+        return serializer.parse(request.args.get('fields'))
+    except ValueError as e:
+        abort(400, str(e))
+
+
+def api_response(data):
+    """JSON response which is cached by clients and proxies for anonymous users and revalidated by ETag."""
+    response = jsonify(data)
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.max_age = 0
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['API_CACHE_MAX_AGE']
+    response.vary.add('Cookie')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def paginate(query, keys, serializer):
+    """Page of items of the query after ?cursor= with the cursor of the next page.
+
+    Pages are read by keys, a list of (column, descending) pairs which order items uniquely, so a page costs
+    the same at any depth and items don't shift between pages when new ones are added.
+    """
+    limit = min(max(request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int), 1),
+                current_app.config['API_PAGE_SIZE_MAX'])
+    cursor = request.args.get('cursor')
+    if cursor:
+        values = decode_cursor(cursor, [column for column, _ in keys])
+        # Rows after the cursor in the order of keys: (a, b) < (x, y) is a < x or a = x and b < y.
+        clauses, equal = [], []
+        for (column, descending), value in zip(keys, values):
+            clauses.append(and_(*equal + [column < value if descending else column > value]))
+            equal.append(column == value)
+        query = query.filter(or_(*clauses))
+    columns, fields = serializer.plan(fields_of(serializer))
+    rows = query.with_entities(*([column for column, _ in keys] + columns)).order_by(
+        *[column.desc() if descending else column for column, descending in keys]).limit(limit + 1).all()
+    next_cursor = encode_cursor(list(rows[limit - 1][:len(keys)])) if len(rows) > limit else None
+    args = dict(request.view_args, **request.args.to_dict())
+    args['cursor'] = next_cursor
+    return dict(items=[serializer.dump(row, fields, len(keys)) for row in rows[:limit]], next_cursor=next_cursor,
+                next=url_for(request.endpoint, **args) if next_cursor else None)
+
+
+def get_one(query, serializer):
+    columns, fields = serializer.plan(fields_of(serializer))
+    row = query.with_entities(*columns).first()
+    if row is None:
+        abort(404)
+    return serializer.dump(row, fields)
+
+
+def topics_query():
+    return db.session.query(Topic).join(User, Topic.author_id == User.id).filter(Topic.deleted == False)
+
+
+def comments_query():
+    return db.session.query(Comment).join(User, Comment.author_id == User.id).join(
+        Topic, Comment.topic_id == Topic.id).filter(Comment.deleted == False)
+
+
+def check_topic(topic_id):
+    if not db.session.query(Topic.query.filter_by(id=topic_id, deleted=False).exists()).scalar():
+        abort(404)
+
+
+@api.route('/topic_groups/<int:topic_group_id>')
+def get_topic_group(topic_group_id):
+    topic_group = get_one(db.session.query(TopicGroup).filter(
+        and_(TopicGroup.id == topic_group_id, TopicGroup.deleted == False)), topic_group_serializer)
+    columns, fields = topic_group_serializer.plan(fields_of(topic_group_serializer))
+    rows = db.session.query(TopicGroup).with_entities(*columns).filter(
+        and_(TopicGroup.group_id == topic_group_id, TopicGroup.deleted == False,
+             TopicGroup.id != topic_group_id)).order_by(TopicGroup.priority, TopicGroup.created_at.desc()).all()
+    topic_group['topic_groups'] = [topic_group_serializer.dump(row, fields) for row in rows]
+    return api_response(topic_group)
+
+
+@api.route('/topic_groups/<int:topic_group_id>/topics')
+def get_topic_group_topics(topic_group_id):
+    if not db.session.query(TopicGroup.query.filter_by(id=topic_group_id, deleted=False).exists()).scalar():
+        abort(404)
+    query = topics_query().filter(Topic.group_id == topic_group_id)
+    return api_response(paginate(query, [(Topic.id, True)], topic_serializer))
+
+
+@api.route('/topics')
+def get_topics():
+    """Latest topics or, with ?order=hot, the most interesting topics created within ?period=."""
+    order = request.args.get('order', 'latest')
+    if order == 'latest':
+        return api_response(paginate(topics_query(), [(Topic.id, True)], topic_serializer))
+    if order != 'hot':
+        abort(400, 'Unknown order')
+    period = request.args.get('period', 'week')
+    if period not in HOT_PERIODS:
+        abort(400, 'Unknown period')
+    now = datetime.utcnow()
+    query = topics_query().filter(between(Topic.created_at, now - timedelta(days=HOT_PERIODS[period]), now))
+    return api_response(paginate(query, [(Topic.interest, True), (Topic.id, True)], topic_serializer))
+
+
+@api.route('/topics/<int:topic_id>')
+def get_topic(topic_id):
+    return api_response(get_one(topics_query().filter(Topic.id == topic_id), topic_serializer))
+
+
+@api.route('/topics/<int:topic_id>/comments')
+def get_topic_comments(topic_id):
+    check_topic(topic_id)
+    query = comments_query().filter(Comment.topic_id == topic_id)
+    return api_response(paginate(query, [(Comment.id, False)], comment_serializer))
+
+
+@api.route('/comments')
+def get_comments():
+    """Latest comments of all topics."""
+    return api_response(paginate(comments_query(), [(Comment.id, True)], comment_serializer))
+
+
+@api.route('/topics/<int:topic_id>/poll')
+def get_poll(topic_id):
+    """Answers of the poll, with results once the user has voted like on the topic page."""
+    topic = Topic.query.filter_by(id=topic_id, deleted=False).first_or_404()
+    if not topic.poll:
+        abort(404)
+    vote = current_user.get_vote(topic)
+    poll = dict(topic_id=topic.id, question=topic.poll, vote=vote[0] if vote else None)
+    if vote:
+        poll['results'] = [dict(answer=answer, votes=votes, percent=percent)
+                           for answer, votes, percent in topic.get_poll_results()]
+    else:
+        poll['answers'] = [dict(id=answer.id, answer=answer.body)
+                           for answer in topic.poll_answers.filter_by(deleted=False).order_by(PollAnswer.id)]
+    return api_response(poll)
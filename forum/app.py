@@ -9,6 +9,7 @@ from flask_sqlalchemy import SQLAlchemy
 from werkzeug.contrib.fixers import ProxyFix
 
 from .config import config
+from .startup import PhaseTimer
 
 bootstrap = Bootstrap()
 mail = Mail()
@@ -18,12 +19,21 @@ login_manager = LoginManager()
 login_manager.localize_callback = lazy_gettext
 login_manager.login_view = 'auth.login'
 celery = Celery(__name__, broker=config.CELERY_BROKER_URL)
+# Celery reads old-style setting names only from the configuration it is finalized with,
+# updates of the configuration after that don't change values of new-style names.
+celery.config_from_object(config)
 
 
-def create_app():
+def create_app(web=True):
+    """Creates the app, web=False leaves out parts serving only HTTP requests for Celery workers and commands.
+
+    Durations of startup phases in milliseconds are in app.extensions['startup'].
+    """
+    phases = PhaseTimer()
     app = Flask(__name__)
     app.config.from_object(config)
     config.init_app(app)
+    phases('config')
 
     bootstrap.init_app(app)
     mail.init_app(app)
@@ -31,17 +41,29 @@ def create_app():
     login_manager.init_app(app)
     babel.init_app(app)
     celery.conf.update(app.config)
+    phases('extensions')
+
+    if web:
+        if app.config['SSL_REDIRECT']:
+            from flask_sslify import SSLify
+            SSLify(app)
+
+        app.wsgi_app = ProxyFix(app.wsgi_app)
+        if app.config['COMPRESSION']:
+            from .compression import CompressionMiddleware
+            app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config)
 
-    if app.config['SSL_REDIRECT']:
-        from flask_sslify import SSLify
-        SSLify(app)
+        from . import assets
+        assets.init_app(app)
 
-    app.wsgi_app = ProxyFix(app.wsgi_app)
+        from . import transactions
+        transactions.init_app(app)
 
-    if app.debug:
-        from flask_debugtoolbar import DebugToolbarExtension
-        debug_toolbar = DebugToolbarExtension()
-        debug_toolbar.init_app(app)
+        if app.debug:
+            from flask_debugtoolbar import DebugToolbarExtension
+            debug_toolbar = DebugToolbarExtension()
+            debug_toolbar.init_app(app)
+        phases('web')
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -49,4 +71,13 @@ def create_app():
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
+    from .api_1_0 import api as api_1_0_blueprint
+    app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1.0')
+    phases('blueprints')
+
+    from . import templating
+    templating.init_app(app, preload=web)
+    phases('templates')
+
+    app.extensions['startup'] = phases.phases
     return app
@@ -0,0 +1,166 @@
+"""Fingerprinted and precompressed static files.
+
+`python manage.py collect_static` copies the static files of the theme and the files shared by the themes to
+ASSETS_DIR under names with hashes of their content (CSS minified, url() references to the new names), writes
+.gz (and .br if the brotli module is installed) variants next to the compressible ones and a manifest
+manifest.<theme>.json of the original names to the new ones.
+
+If the manifest of THEME exists, url_for('static', filename=...) links files of the manifest, which are served with
+the precompressed variant the browser accepts and cached by browsers for a year as they never change. The manifest
+isn't used in debug mode, so edits of static files show up at once.
+"""
+import gzip
+import io
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Only gzip variants are written without brotli.
+    brotli = None
+
+URL_PREFIX = 'build/'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.eot', '.ico', '.json', '.txt')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION_SPACE = re.compile(r'\s*([{};,])\s*')
+
+
+def theme_names(static_folder):
+    """Themes are directories of css/ with styles.css."""
+    css = os.path.join(static_folder, 'css')
+    return sorted(name for name in os.listdir(css) if os.path.isfile(os.path.join(css, name, 'styles.css')))
+
+
+def theme_files(static_folder, theme):
+    """Paths (relative, with /) of the static files of the theme and of the files of no theme."""
+    other_themes = set(theme_names(static_folder)) - {theme}
+    build = os.path.normpath(os.path.join(static_folder, URL_PREFIX))
+    for root, directories, names in os.walk(static_folder):
+        directories[:] = sorted(d for d in directories
+                                if d not in other_themes and os.path.join(root, d) != build)
+        for name in sorted(names):
+            yield posixpath.relpath(os.path.join(root, name).replace(os.sep, '/'), static_folder.replace(os.sep, '/'))
+
+
+def minify_css(text):
+    text = CSS_COMMENT.sub('', text)
+    text = CSS_SPACE.sub(' ', text)
+    return CSS_PUNCTUATION_SPACE.sub(r'\1', text).replace(';}', '}').strip()
+
+
+def rewrite_css_urls(text, path, manifest):
+    """CSS with relative url() of collected files replaced with their fingerprinted names."""
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', '/', 'http:', 'https:')):
+            return match.group(0)
+        target, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(directory, target))
+        if target not in manifest:
+            return match.group(0)
+        return 'url({}{})'.format(posixpath.relpath(manifest[target], directory), suffix)
+
+    return CSS_URL.sub(replace, text)
+
+
+def fingerprinted(path, data):
+    stem, extension = posixpath.splitext(path)
+    return '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:12], extension)
+
+
+def compressed_variants(data):
+    buf = io.BytesIO()
+    # mtime=0 keeps .gz files of the same content identical between builds.
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    variants = [('.gz', buf.getvalue())]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, compressed) for suffix, compressed in variants if len(compressed) < len(data) * 0.9]
+
+
+def _write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.rename(path + '.tmp', path)
+
+
+def collect(static_folder, output, theme):
+    """Writes fingerprinted files of the theme to output, returns the manifest and sizes of files."""
+    paths = list(theme_files(static_folder, theme))
+    manifest, sizes = {}, {}
+    # CSS goes last as it links fonts and images by their new names.
+    for path in sorted(paths, key=lambda p: (p.endswith('.css'), p)):
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            data = f.read()
+        if path.endswith('.css'):
+            data = minify_css(rewrite_css_urls(data.decode('utf-8'), path, manifest)).encode('utf-8')
+        manifest[path] = fingerprinted(path, data)
+        variants = [('', data)]
+        if path.endswith(COMPRESSIBLE):
+            variants += compressed_variants(data)
+        for suffix, content in variants:
+            target = os.path.join(output, manifest[path] + suffix)
+            if not os.path.exists(target):
+                _write(target, content)
+        sizes[path] = [(suffix or 'identity', len(content)) for suffix, content in variants]
+    _write(os.path.join(output, 'manifest.{}.json'.format(theme)),
+           json.dumps(manifest, indent=2, separators=(',', ': '), sort_keys=True).encode('utf-8'))
+    return manifest, sizes
+
+
+def load_manifest(app):
+    path = os.path.join(app.config['ASSETS_DIR'], 'manifest.{}.json'.format(app.config['THEME']))
+    manifest = {}
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def static_url_defaults(endpoint, values):
+    if endpoint == 'static':
+        manifest = current_app.extensions['assets']
+        if values.get('filename') in manifest:
+            values['filename'] = URL_PREFIX + manifest[values['filename']]
+
+
+def send_static_file(filename):
+    """Files of the build with the precompressed variant the browser accepts, other static files as usual."""
+    if not filename.startswith(URL_PREFIX) or not current_app.extensions['assets']:
+        return current_app.send_static_file(filename)
+    directory, filename = current_app.config['ASSETS_DIR'], filename[len(URL_PREFIX):]
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(current_app.config['ASSETS_MAX_AGE'])
+    response.expires = None
+    return response
+
+
+def init_app(app):
+    if app.debug:
+        app.extensions['assets'] = {}
+    else:
+        load_manifest(app)
+    app.url_defaults(static_url_defaults)
+    app.view_functions['static'] = send_static_file
@@ -1,13 +1,15 @@
-from flask import render_template, redirect, request, url_for, flash, current_app
-from flask_babel import lazy_gettext, gettext
+from flask import render_template, redirect, request, url_for, flash, abort
+from flask_babel import lazy_gettext, get_locale
 from flask_login import login_user, logout_user, login_required, current_user
 
 from . import auth
 from .forms import (LoginForm, RegistrationForm, ChangePasswordForm, ChangeEmailForm, ResetPasswordRequestForm,
                     ResetPasswordForm)
 from ..app import db
-from ..celery_tasks import send_email
+from ..celery_tasks import send_user_email, notify_admin_about_new_user
+from ..dispatch import dispatch
 from ..models import User
+from ..transactions import defer_write, read_write
 
 
 def is_endpoint_always_accessible():
@@ -21,11 +23,20 @@ def is_endpoint_always_accessible():
     )
 
 
+def send_email_to_user(template, user, **kwargs):
+    # Emails are translated to the locale of the request.
+    dispatch(send_user_email, [template, user.id], dict(kwargs, locale=str(get_locale())))
+
+
 @auth.before_app_request
 def before_app_request():
     if current_user.is_authenticated:
-        current_user.ping()
+        # Polls of new comments come every few seconds and don't write.
+        if request.endpoint not in ('main.new_comments', 'main.new_comments_stream'):
+            defer_write(current_user.ping)
         if not (current_user.confirmed or is_endpoint_always_accessible()):
+            if request.blueprint == 'api':
+                abort(403)
             return redirect(url_for('auth.unconfirmed'))
 
 
@@ -76,25 +87,15 @@ def register():
         )
         db.session.add(user)
         db.session.commit()
-        token = user.generate_token()
-        send_email.delay(
-            recipients=[user.email],
-            subject=gettext('Confirm your account'),
-            body=render_template('auth/email/confirm.txt', user=user, token=token),
-            html=render_template('auth/email/confirm.html', user=user, token=token)
-        )
-        send_email.delay(
-            recipients=[current_app.config['APP_ADMIN']],
-            subject='New user',
-            body=render_template('email/new_user.txt', user=user),
-            html=render_template('email/new_user.html', user=user)
-        )
+        send_email_to_user('confirm', user, token=user.generate_token())
+        notify_admin_about_new_user(user.id)
         flash(lazy_gettext('A confirmation email has been sent to you by email.'))
         return redirect(url_for('auth.login'))
     return render_template('auth/register.html', form=form)
 
 
 @auth.route('/confirm/<token>')
+@read_write
 @login_required
 def confirm(token):
     if current_user.confirmed:
@@ -111,13 +112,7 @@ def confirm(token):
 def resend_confirmation():
     if current_user.confirmed:
         return redirect(url_for('main.index'))
-    token = current_user.generate_token()
-    send_email.delay(
-        recipients=[current_user.email],
-        subject=gettext('Confirm your account'),
-        body=render_template('auth/email/confirm.txt', user=current_user, token=token),
-        html=render_template('auth/email/confirm.html', user=current_user, token=token)
-    )
+    send_email_to_user('confirm', current_user, token=current_user.generate_token())
     flash(lazy_gettext('A new confirmation email has been sent to you by email.'))
     return redirect(url_for('main.index'))
 
@@ -141,18 +136,14 @@ def change_email():
     if form.validate_on_submit():
         new_email = form.new_email.data.lower()
         token = current_user.generate_token(new_email=new_email)
-        send_email.delay(
-            recipients=[new_email],
-            subject=gettext('Confirm your new email'),
-            body=render_template('auth/email/confirm_new_email.txt', user=current_user, token=token),
-            html=render_template('auth/email/confirm_new_email.html', user=current_user, token=token)
-        )
+        send_email_to_user('confirm_new_email', current_user, token=token, recipient=new_email)
         flash(lazy_gettext('A confirmation email has been sent to your new email.'))
         return redirect(request.args.get('next') or url_for('main.index'))
     return render_template('auth/change_email.html', form=form)
 
 
 @auth.route('/change_email/<token>')
+@read_write
 @login_required
 def confirm_new_email(token):
     if current_user.confirm_new_email(token):
@@ -169,13 +160,7 @@ def reset_password_request():
     form = ResetPasswordRequestForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data.lower()).first()
-        token = user.generate_token()
-        send_email.delay(
-            recipients=[user.email],
-            subject=gettext('Instructions to reset your password'),
-            body=render_template('auth/email/reset_password.txt', user=user, token=token),
-            html=render_template('auth/email/reset_password.html', user=user, token=token)
-        )
+        send_email_to_user('reset_password', user, token=user.generate_token())
         flash(lazy_gettext('An email with instructions to reset password has been sent to you by email.'))
         return redirect(request.args.get('next') or url_for('auth.login'))
     return render_template('auth/reset_password.html', form=form)
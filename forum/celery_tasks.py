@@ -1,13 +1,205 @@
-from flask import current_app
+import time
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+
+import six
+from flask import current_app, render_template
+from flask_babel import lazy_gettext
 from flask_mail import Message
+from sqlalchemy import and_, func
 
-from .app import mail, celery
+from .app import db, mail, celery
+from .dispatch import dispatch
+from .mailer import PooledConnection, is_transient_error, retry_countdown
+from .models import Comment, DeletionJob, Favorite, PollAnswer, PollVote, Topic, User, Watermark
 
+_interest_refresh_lock = Lock()
+_interest_refresh_scheduled = {}
+smtp_connection = PooledConnection(mail)
 
-@celery.task()
-def send_email(recipients, subject, body, html):
+# Template name -> subject and path of the .txt and .html templates of emails to users.
+USER_EMAILS = {
+    'confirm': (lazy_gettext('Confirm your account'), 'auth/email/confirm'),
+    'confirm_new_email': (lazy_gettext('Confirm your new email'), 'auth/email/confirm_new_email'),
+    'reset_password': (lazy_gettext('Instructions to reset your password'), 'auth/email/reset_password'),
+    'new_user': ('New user', 'email/new_user'),
+}
+
+
+def _build_message(recipients, subject, body, html):
     full_subject = ' '.join((current_app.config['APP_MAIL_SUBJECT_PREFIX'], subject))
     msg = Message(full_subject, sender=current_app.config['APP_MAIL_SENDER'], recipients=recipients)
     msg.body = body
     msg.html = html
-    mail.send(msg)
+    return msg
+
+
+def _render_email(recipients, subject, path, locale=None, **context):
+    # Templates build external URLs and are translated to the locale of the request which has sent the email.
+    with current_app.test_request_context(base_url=current_app.config['APP_BASE_URL'],
+                                          headers={'Accept-Language': locale} if locale else None):
+        return dict(recipients=recipients, subject=six.text_type(subject),
+                    body=render_template(path + '.txt', **context), html=render_template(path + '.html', **context))
+
+
+def _deliver(task, emails, retry_args=None):
+    """Sends emails (dicts of send_email arguments) over the SMTP session of the worker process.
+
+    On a transient failure the task is retried with backoff, retry_args builds its arguments from the emails
+    which are not delivered yet, by default the task is retried with the same arguments.
+    """
+    for i, email in enumerate(emails):
+        try:
+            smtp_connection.send(_build_message(**email))
+        except Exception as e:
+            if not is_transient_error(e) or task.request.retries >= current_app.config['MAIL_MAX_RETRIES']:
+                raise
+            countdown = retry_countdown(task.request.retries)
+            if retry_args is None:
+                raise task.retry(exc=e, countdown=countdown)
+            raise task.retry(args=retry_args(emails[i:]), kwargs={}, exc=e, countdown=countdown)
+
+
+@celery.task(bind=True, max_retries=None)
+def send_email(self, recipients, subject, body, html):
+    _deliver(self, [dict(recipients=recipients, subject=subject, body=body, html=html)])
+
+
+@celery.task(bind=True, max_retries=None)
+def send_user_email(self, template, user_id, token=None, recipient=None, locale=None):
+    """Renders the email of one of USER_EMAILS about the user and sends it to the user or to the recipient."""
+    user = User.query.get(user_id)
+    if user is None:
+        return
+    subject, path = USER_EMAILS[template]
+    _deliver(self, [_render_email([recipient or user.email], subject, path, locale, user=user, token=token)])
+
+
+@celery.task(bind=True, max_retries=None)
+def send_new_users_notice(self):
+    """Periodic task which tells the admin about all users registered since the previous notice in one email."""
+    watermark = Watermark.query.filter_by(name='new_users').with_for_update().first()
+    if watermark is None:  # no user has registered since notices are sent by this task
+        return
+    users = User.query.filter(User.id > watermark.value).order_by(User.id).limit(
+        current_app.config['NEW_USERS_NOTICE_LIMIT']).all()
+    if users:
+        _deliver(self, [_render_email([current_app.config['APP_ADMIN']], 'New users', 'email/new_users',
+                                      users=users)])
+        watermark.value = users[-1].id
+    db.session.commit()
+
+
+@celery.task()
+def send_favorites_digests():
+    """Periodic task which queues digests of new comments in favorite topics, one per user, in batches.
+
+    Only comments after the watermark of the previous run are joined to favorites, so a run costs O(new comments)
+    instead of O(users x favorites).
+    """
+    last_comment_id = db.session.query(func.max(Comment.id)).scalar() or 0
+    watermark = Watermark.acquire('favorites_digest', default=last_comment_id)
+    upper_id = min(last_comment_id, watermark.value + current_app.config['FAVORITES_DIGEST_LIMIT'])
+    rows = db.session.query(Favorite.user_id, Comment.topic_id, func.count(Comment.id)).select_from(Comment).join(
+        Favorite, Favorite.topic_id == Comment.topic_id).filter(
+        and_(Comment.id > watermark.value, Comment.id <= upper_id, Comment.deleted == False,
+             Comment.author_id != Favorite.user_id)).group_by(Favorite.user_id, Comment.topic_id).all()
+    digests = defaultdict(list)
+    for user_id, topic_id, comments_count in rows:
+        digests[user_id].append([topic_id, comments_count])
+    watermark.value = max(watermark.value, upper_id)
+    # The watermark is moved before digests are queued: a failure loses a digest rather than sends it twice.
+    db.session.commit()
+    items, batch_size = sorted(digests.items()), current_app.config['MAIL_BATCH_SIZE']
+    for start in range(0, len(items), batch_size):
+        dispatch(send_favorites_digest, [items[start:start + batch_size]])
+    return len(digests)
+
+
+@celery.task(bind=True, max_retries=None)
+def send_favorites_digest(self, digests):
+    """Sends a batch of digests of numbers of new comments in favorite topics over one SMTP session.
+
+    digests is a list of [user_id, topics], topics is a list of [topic_id, count]. Users and topics of the batch
+    are read by two queries, a retry sends only the digests which are not delivered yet.
+    """
+    users = dict((u.id, u) for u in User.query.filter(
+        and_(User.id.in_([user_id for user_id, _ in digests]), User.confirmed == True)))
+    titles = dict(Topic.query.with_entities(Topic.id, Topic.title).filter(and_(
+        Topic.id.in_(set(topic_id for _, topics in digests for topic_id, _ in topics)), Topic.deleted == False)))
+    rendered, emails = [], []
+    for user_id, topics in digests:
+        found = sorted((topic_id, titles[topic_id], count) for topic_id, count in topics if topic_id in titles)
+        if user_id not in users or not found:
+            continue
+        rendered.append([user_id, topics])
+        emails.append(_render_email([users[user_id].email], lazy_gettext('New comments in favorite topics'),
+                                    'email/favorites_digest', user=users[user_id], topics=found))
+    _deliver(self, emails, lambda remaining: [rendered[len(rendered) - len(remaining):]])
+
+
+def notify_admin_about_new_user(user_id):
+    if not current_app.config['NEW_USERS_NOTICE_INTERVAL']:
+        dispatch(send_user_email, ['new_user', user_id], dict(recipient=current_app.config['APP_ADMIN']))
+        return
+    # Otherwise the user is included into the next notice of send_new_users_notice. The first user registered
+    # after notices were switched on starts the watermark, users before got emails of their own.
+    Watermark.create('new_users', user_id - 1)
+
+
+@celery.task()
+def cascade_topic_deletion(job_id):
+    """Soft deletes comments, poll answers and poll votes of a deleted topic in batches by id range.
+
+    Every batch is updated in its own short transaction together with the progress of the job, so locks are held
+    only for one batch and the task can be restarted.
+    """
+    job = DeletionJob.query.get(job_id)
+    if job is None or job.finished_at:
+        return
+    topic_id, models = job.target_id, (Comment, PollAnswer, PollVote)
+    if job.total is None:
+        job.total = sum(model.query.with_entities(func.count(model.id)).filter(
+            and_(model.topic_id == topic_id, model.deleted == False)).scalar() for model in models)
+        db.session.commit()
+
+    batch_size = current_app.config['DELETION_BATCH_SIZE']
+    for model in models:
+        last_id = 0
+        while True:
+            query = model.query.filter(and_(model.topic_id == topic_id, model.deleted == False, model.id > last_id))
+            upper_id = query.with_entities(model.id).order_by(model.id).offset(batch_size - 1).limit(1).scalar()
+            if upper_id is not None:
+                query = query.filter(model.id <= upper_id)
+            count = query.update({model.deleted: True}, synchronize_session=False)
+            DeletionJob.query.filter_by(id=job_id).update({DeletionJob.processed: DeletionJob.processed + count},
+                                                          synchronize_session=False)
+            db.session.commit()
+            if upper_id is None:
+                break
+            last_id = upper_id
+
+    DeletionJob.query.filter_by(id=job_id).update({DeletionJob.finished_at: datetime.utcnow()},
+                                                  synchronize_session=False)
+    db.session.commit()
+
+
+@celery.task()
+def refresh_topics_interest(topic_ids):
+    Topic.refresh_interest(topic_ids)
+    db.session.commit()
+
+
+def schedule_interest_refresh(topic_id):
+    # All votes and comments which come within the delay are counted by one delayed task,
+    # so a burst of votes for one topic produces at most one task per delay per process.
+    delay = current_app.config['INTEREST_REFRESH_DELAY']
+    now = time.time()
+    with _interest_refresh_lock:
+        if _interest_refresh_scheduled.get(topic_id, 0) > now:
+            return
+        _interest_refresh_scheduled[topic_id] = now + delay
+        for t_id in [t for t, deadline in _interest_refresh_scheduled.items() if deadline <= now]:
+            del _interest_refresh_scheduled[t_id]
+    dispatch(refresh_topics_interest, [[topic_id]], countdown=delay)
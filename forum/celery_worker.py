@@ -1,4 +1,17 @@
-from .app import celery, create_app
+from celery.signals import task_postrun, worker_process_shutdown
 
-app = create_app()
+from .app import celery, create_app, db
+from .celery_tasks import smtp_connection
+
+app = create_app(web=False)
 app.app_context().push()
+
+
+@task_postrun.connect
+def remove_db_session(*args, **kwargs):
+    db.session.remove()
+
+
+@worker_process_shutdown.connect
+def close_smtp_connection(*args, **kwargs):
+    smtp_connection.close()
@@ -0,0 +1,157 @@
+"""Compression of responses negotiated by Accept-Encoding.
+
+Responses of COMPRESSION_MIMETYPES are compressed with brotli (if the brotli module is installed) or gzip when the
+client accepts them. Responses with Content-Length below COMPRESSION_MIN_SIZE are sent as they are. Responses
+without Content-Length are streamed: the first COMPRESSION_MIN_SIZE bytes decide, then every chunk of the
+application is compressed and flushed as soon as it is produced, so streamed pages and downloads stay streamed.
+
+Compressed responses get Vary: Accept-Encoding and a weak ETag, the identity and compressed representations
+have different bytes and If-None-Match uses the weak comparison, so conditional requests keep working.
+"""
+import itertools
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # Only gzip is offered without brotli.
+    brotli = None
+
+
+class _GzipCompressor(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class _BrotliCompressor(object):
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def _write_not_supported(data):
+    raise NotImplementedError('write() of start_response is not supported by CompressionMiddleware')
+
+
+class CompressionMiddleware(object):
+    def __init__(self, app, config):
+        self.app = app
+        self.min_size = config['COMPRESSION_MIN_SIZE']
+        self.gzip_level = config['COMPRESSION_GZIP_LEVEL']
+        self.brotli_quality = config['COMPRESSION_BROTLI_QUALITY']
+        self.mimetypes = frozenset(config['COMPRESSION_MIMETYPES'])
+
+    def negotiate(self, accept_encoding):
+        """Name of the accepted encoding, brotli if it is preferred at least as much as gzip, or None."""
+        accepted = parse_accept_header(accept_encoding)
+        br, gzip = accepted['br'] if brotli is not None else 0, accepted['gzip']
+        if br and br >= gzip:
+            return 'br'
+        return 'gzip' if gzip else None
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+    def __call__(self, environ, start_response):
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return _write_not_supported
+
+        app_iter = self.app(environ, capture)
+        if captured and not self.compressible(*captured[:2]):
+            # Files keep wsgi.file_wrapper of the server.
+            start_response(*captured)
+            return app_iter
+        return ClosingIterator(self.respond(environ, app_iter, captured, start_response),
+                               getattr(app_iter, 'close', None))
+
+    def compressible(self, status, headers):
+        headers = Headers(headers)
+        mimetype = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        code = int(status.split(None, 1)[0])
+        return (mimetype in self.mimetypes and code >= 200 and code not in (204, 206, 304) and
+                'Content-Encoding' not in headers and 'no-transform' not in headers.get('Cache-Control', ''))
+
+    def respond(self, environ, app_iter, captured, start_response):
+        chunks = iter(app_iter)
+        buffered = []
+        if not captured:  # applications may call start_response on the first iteration
+            for chunk in chunks:
+                buffered.append(chunk)
+                if captured:
+                    break
+        status, headers, exc_info = captured
+        headers = Headers(headers)
+        encoding = None
+        if self.compressible(status, headers):
+            self.add_vary(headers)
+            if environ['REQUEST_METHOD'] != 'HEAD':
+                encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        length = headers.get('Content-Length', type=int)
+        streamed = length is None
+        if encoding and streamed:
+            # Small responses are sent as they are, only the first min_size bytes are waited for.
+            size = sum(len(chunk) for chunk in buffered)
+            for chunk in chunks:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                encoding = None
+                headers['Content-Length'] = str(size)
+        elif length is not None and length < self.min_size:
+            encoding = None
+
+        if not encoding:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            # Even an empty body yields once, some servers wait for the first item to send headers.
+            yield b''.join(buffered)
+            for chunk in chunks:
+                yield chunk
+            return
+
+        headers.pop('Content-Length', None)
+        headers['Content-Encoding'] = encoding
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        compressor = self.compressor(encoding)
+        for chunk in itertools.chain([b''.join(buffered)], chunks):
+            data = compressor.compress(chunk)
+            if streamed:
+                data += compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    def add_vary(headers):
+        vary = [value.strip() for value in headers.get('Vary', '').split(',') if value.strip()]
+        if '*' not in vary and 'accept-encoding' not in [value.lower() for value in vary]:
+            headers['Vary'] = ', '.join(vary + ['Accept-Encoding'])
@@ -6,13 +6,33 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', '<hard-to-guess-string>')
     SESSION_PROTECTION = 'basic'
     THEME = os.environ.get('THEME', 'gray')
+    # Fingerprinted static files written by python manage.py collect_static, see forum/assets.py.
+    ASSETS_DIR = os.environ.get('ASSETS_DIR', os.path.join(basedir, 'static', 'build'))
+    ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+    # Compiled templates, see forum/templating.py, an empty TEMPLATE_CACHE_DIR disables the bytecode cache.
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, os.pardir, 'template_cache'))
+    PRELOAD_TEMPLATES = bool(os.environ.get('PRELOAD_TEMPLATES', ''))
 
     DEBUG = bool(os.environ.get('DEBUG', ''))
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     TESTING = bool(os.environ.get('TESTING', ''))
     SSL_REDIRECT = bool(os.environ.get('SSL_REDIRECT', ''))
 
+    # Responses are compressed by forum/compression.py, COMPRESSION_DISABLED=1 leaves it to a proxy.
+    COMPRESSION = not os.environ.get('COMPRESSION_DISABLED', '')
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+    # No text/event-stream: events are tiny and are flushed one by one, and no NDJSON exports: rows are chunks.
+    COMPRESSION_MIMETYPES = ['text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                             'application/json', 'application/xml', 'text/xml', 'image/svg+xml']
+
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
+    # GET, HEAD and OPTIONS requests run in read-only transactions, see forum/transactions.py.
+    READ_ONLY_SAFE_REQUESTS = not os.environ.get('READ_ONLY_SAFE_REQUESTS_DISABLED', '')
+    # Writes in read-only transactions raise ReadOnlyError in tests and with READ_ONLY_STRICT, otherwise they are
+    # logged and rolled back.
+    READ_ONLY_STRICT = bool(os.environ.get('READ_ONLY_STRICT', ''))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DB_USER = os.environ.get('DB_USER', 'postgres')
     DB_PASSWORD = os.environ.get('DB_PASSWORD', 'password')
@@ -34,19 +54,63 @@ class Config:
     )
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL',
                                        os.environ.get('CLOUDAMQP_URL', AMQP_URL))
+    CELERY_ALWAYS_EAGER = TESTING
+    # Publishing to an unreachable broker fails after a few connection attempts instead of blocking the request.
+    BROKER_CONNECTION_TIMEOUT = 2
+    BROKER_TRANSPORT_OPTIONS = {'max_retries': 2, 'interval_start': 0, 'interval_step': 0.2, 'interval_max': 0.5}
+    # Transactional mail doesn't wait behind bulk work: every queue is consumed by its own workers, see Procfile.
+    CELERY_DEFAULT_QUEUE = 'default'
+    CELERY_ROUTES = dict(
+        ('forum.celery_tasks.' + task, {'queue': queue})
+        for queue, tasks in (('mail', ('send_email', 'send_user_email')),
+                             ('bulk', ('send_new_users_notice', 'send_favorites_digests', 'send_favorites_digest',
+                                       'cascade_topic_deletion')))
+        for task in tasks
+    )
+    # Results of tasks are never read.
+    CELERY_IGNORE_RESULT = True
+    # Where background tasks run: celery, fallback (in process while the broker is down) or local (in process).
+    TASK_DISPATCH = os.environ.get('TASK_DISPATCH', 'fallback')
+    # Threads of the in-process executor per queue.
+    TASK_EXECUTOR_THREADS = {'mail': 2, 'default': 2, 'bulk': 1}
+    TASK_QUEUE_SIZE = int(os.environ.get('TASK_QUEUE_SIZE', 1000))
+    TASK_QUEUE_TIMEOUT = 1
+    TASK_DRAIN_TIMEOUT = 10
+    TASK_SPOOL_DIR = os.environ.get('TASK_SPOOL_DIR', os.path.join(basedir, os.pardir, 'spool'))
 
-    MAIL_SERVER = 'smtp.googlemail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.googlemail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = not os.environ.get('MAIL_NO_TLS', '')
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME', '4rum@example.com')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'password')
+    MAIL_POOL_MAX_IDLE = int(os.environ.get('MAIL_POOL_MAX_IDLE', 30))
+    MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 8))
+    MAIL_RETRY_BACKOFF = 5
+    MAIL_RETRY_BACKOFF_MAX = 600
+    # Digests of favorites are rendered and sent by tasks of this many emails over one SMTP session.
+    MAIL_BATCH_SIZE = 50
 
     APP_MAIL_SUBJECT_PREFIX = '[4RUM]'
     APP_MAIL_SENDER = '4RUM Admin <name@example.com>'
     APP_ADMIN = os.environ.get('ADMIN_MAIL_USERNAME', '4rum_admin@example.com')
+    APP_BASE_URL = os.environ.get('APP_BASE_URL', 'http://localhost:5000')
+    # Seconds between notices about new users to the admin, 0 to send a notice about every user at once.
+    NEW_USERS_NOTICE_INTERVAL = int(os.environ.get('NEW_USERS_NOTICE_INTERVAL', 0))
+    NEW_USERS_NOTICE_LIMIT = 100
+    # Seconds between digests of new comments in favorite topics, 0 to disable digests.
+    FAVORITES_DIGEST_INTERVAL = int(os.environ.get('FAVORITES_DIGEST_INTERVAL', 24 * 60 * 60))
+    FAVORITES_DIGEST_LIMIT = 100000
+    CELERYBEAT_SCHEDULE = dict(
+        (task.replace('_', '-'), {'task': 'forum.celery_tasks.' + task, 'schedule': interval})
+        for task, interval in (('send_new_users_notice', NEW_USERS_NOTICE_INTERVAL),
+                               ('send_favorites_digests', FAVORITES_DIGEST_INTERVAL)) if interval
+    )
 
     BASE_GRAVATAR_URL = 'https://secure.gravatar.com/avatar'
     TOPIC_GROUP_PRIORITY = range(1, 11)
+    # Pages of topics, latest and messages are sent in chunks while they are rendered.
+    STREAM_TEMPLATES = bool(os.environ.get('STREAM_TEMPLATES', ''))
+    STREAM_TEMPLATES_CHUNK_SIZE = 4096
     TOPICS_PER_PAGE = 20
     COMMENTS_PER_PAGE = 20
     MESSAGES_PER_PAGE = 20
@@ -54,6 +118,36 @@ class Config:
     ROOT_TOPIC_GROUP = 0
     IS_PROTECTED_ROOT_TOPIC_GROUP = True
     TOPIC_GROUPS_ONLY_ON_1ST_PAGE = True
+    INTEREST_REFRESH_DELAY = int(os.environ.get('INTEREST_REFRESH_DELAY', 10))
+    DELETION_BATCH_SIZE = 1000
+    DELETION_JOBS_PER_PAGE = 20
+    # New comments of a topic are read from DB at most once per interval per process however many watchers it has.
+    LIVE_POLL_INTERVAL = 2
+    LIVE_POLL_TIMEOUT = 25
+    LIVE_STREAM_LIFETIME = 300
+    LIVE_COMMENTS_LIMIT = 100
+    # Waiting long polls and streams hold a thread of sync and threaded workers, so they are served only by async
+    # workers (WEB_WORKER_CLASS=gevent or eventlet, see gunicorn.conf.py); otherwise pages poll for new comments
+    # every LIVE_CLIENT_POLL_INTERVAL seconds without waiting.
+    LIVE_ASYNC = os.environ.get('WEB_WORKER_CLASS', '') in ('gevent', 'eventlet')
+    LIVE_CLIENT_POLL_INTERVAL = 15
+    API_PAGE_SIZE = 20
+    API_PAGE_SIZE_MAX = 100
+    # Seconds for which clients and proxies may reuse API responses to anonymous users.
+    API_CACHE_MAX_AGE = 30
+    # Avatars and images of bodies are shown through the proxy, resized to twice the sizes of templates.
+    IMAGE_PROXY = not os.environ.get('IMAGE_PROXY_DISABLED', '')
+    IMAGE_PROXY_SIZES = [36, 64, 80, 512]
+    IMAGE_PROXY_MAX_WIDTH = 1024
+    IMAGE_PROXY_MAX_BYTES = 10 * 1024 * 1024
+    IMAGE_PROXY_MAX_PIXELS = 50 * 1000 * 1000
+    IMAGE_PROXY_TIMEOUT = 5
+    IMAGE_PROXY_MAX_AGE = 30 * 24 * 60 * 60
+    IMAGE_PROXY_ERROR_MAX_AGE = 5 * 60
+    IMAGE_PROXY_USER_AGENT = '4RUM image proxy'
+    IMAGE_PROXY_ALLOW_PRIVATE = bool(os.environ.get('IMAGE_PROXY_ALLOW_PRIVATE', ''))
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(basedir, os.pardir, 'image_cache'))
+    IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
 
     ALLOWED_TAGS = [
         'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'details', 'dl', 'dt', 'em', 'h1', 'h2',
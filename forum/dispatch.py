@@ -0,0 +1,211 @@
+"""Dispatch of background tasks to the Celery broker or to the in-process executor.
+
+TASK_DISPATCH selects where tasks run:
+
+* celery - workers of the broker, errors of the broker are raised to the caller;
+* fallback - workers of the broker, the in-process executor while the broker is unreachable, so registration and
+  password resets don't fail when the broker is down;
+* local - always the in-process executor, for single-node and test deployments without a broker.
+
+The executor runs tasks of every queue in its own threads from a queue of TASK_QUEUE_SIZE tasks. A caller waits at
+most TASK_QUEUE_TIMEOUT seconds for a free slot, tasks which don't fit, fail or are left when the process exits
+after TASK_DRAIN_TIMEOUT seconds of draining are spooled to TASK_SPOOL_DIR and run again by replay_spool.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from kombu.exceptions import OperationalError
+from six.moves import queue
+
+from .app import celery, db
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_pid = None
+_executors_lock = threading.Lock()
+
+
+def dispatch(task, args=(), kwargs=None, countdown=None):
+    """Runs the task in the background like task.apply_async."""
+    mode = current_app.config['TASK_DISPATCH']
+    if mode != 'local':
+        try:
+            # Without retries an unreachable broker fails at once instead of holding the request.
+            return task.apply_async(args, kwargs, countdown=countdown, retry=mode != 'fallback')
+        except (OperationalError, IOError) as e:
+            if mode != 'fallback':
+                raise
+            logger.warning('Broker is unreachable, %s runs in process: %s', task.name, e)
+    executor = get_executor(current_app._get_current_object(), queue_of(task.name))
+    executor.submit(task.name, list(args), kwargs or {}, countdown)
+
+
+def queue_of(task_name):
+    """Queue of the task by CELERY_ROUTES."""
+    config = current_app.config
+    return config['CELERY_ROUTES'].get(task_name, {}).get('queue', config['CELERY_DEFAULT_QUEUE'])
+
+
+def get_executor(app, queue_name):
+    """The executor of the queue in the current process, a forked process starts its own executors."""
+    global _executors_pid
+    with _executors_lock:
+        if _executors_pid != os.getpid():
+            _executors.clear()
+            _executors_pid = os.getpid()
+        if queue_name not in _executors:
+            _executors[queue_name] = LocalExecutor(app, queue_name)
+        return _executors[queue_name]
+
+
+def shutdown_executors(timeout=None):
+    """Drains and stops executors of the current process."""
+    with _executors_lock:
+        executors = list(_executors.values()) if _executors_pid == os.getpid() else []
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(timeout)
+
+
+atexit.register(shutdown_executors)
+
+
+def spool(directory, name, args, kwargs, error):
+    """Saves the task to a file of the spool directory."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename = '{:%Y%m%d%H%M%S%f}-{}.json'.format(datetime.utcnow(), uuid.uuid4().hex[:8])
+    path = os.path.join(directory, filename)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(task=name, args=args, kwargs=kwargs, error=error), f)
+    os.rename(path + '.tmp', path)
+    logger.error('Task %s is spooled to %s: %s', name, path, error)
+    return path
+
+
+def replay_spool(limit=None):
+    """Dispatches spooled tasks in order of spooling, returns the number of dispatched tasks."""
+    directory = current_app.config['TASK_SPOOL_DIR']
+    if not os.path.isdir(directory):
+        return 0
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith('.json'))[:limit]
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        with open(path) as f:
+            spooled = json.load(f)
+        dispatch(celery.tasks[spooled['task']], spooled['args'], spooled['kwargs'])
+        os.remove(path)
+    return len(filenames)
+
+
+class LocalExecutor(object):
+    """Bounded pool of threads which run tasks of one queue in the application context of the process.
+
+    Like workers of the broker every queue has its own threads, TASK_EXECUTOR_THREADS of them.
+    """
+
+    def __init__(self, app, queue_name='default'):
+        self.app = app
+        self.queue_name = queue_name
+        self.queue = queue.Queue(app.config['TASK_QUEUE_SIZE'])
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.threads = [threading.Thread(target=self._work, name='task-executor-{}-{}'.format(queue_name, i))
+                        for i in range(app.config['TASK_EXECUTOR_THREADS'].get(queue_name, 1))]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, name, args, kwargs, countdown=None):
+        item = (name, args, kwargs)
+        with self.lock:
+            if self.closed:
+                return self._spool(item, 'executor is shut down')
+            if countdown:
+                timer = threading.Timer(countdown, self._fire, args=[item])
+                timer.daemon = True
+                self.timers[timer] = item
+                timer.start()
+                return
+        self._put(item)
+
+    def _fire(self, item):
+        with self.lock:
+            timer = threading.current_thread()
+            if self.timers.pop(timer, None) is None:
+                # The executor has been shut down and has taken the task.
+                return
+        self._put(item)
+
+    def _put(self, item):
+        # Backpressure: the caller waits for a free slot, a task which doesn't get one is not lost but spooled.
+        try:
+            self.queue.put(item, timeout=self.app.config['TASK_QUEUE_TIMEOUT'])
+        except queue.Full:
+            self._spool(item, 'executor queue is full')
+
+    def _spool(self, item, error):
+        name, args, kwargs = item
+        spool(self.app.config['TASK_SPOOL_DIR'], name, args, kwargs, error)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._run(item)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, item):
+        name, args, kwargs = item
+        with self.app.app_context():
+            try:
+                result = celery.tasks[name].apply(args, kwargs)
+                if result.failed():
+                    self._spool(item, repr(result.result))
+            except Exception as e:
+                self._spool(item, repr(e))
+            finally:
+                db.session.remove()
+
+    def shutdown(self, timeout=None):
+        """Stops taking tasks, runs queued and delayed tasks for at most timeout seconds and spools the rest."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            delayed, self.timers = self.timers, {}
+        if timeout is None:
+            timeout = self.app.config['TASK_DRAIN_TIMEOUT']
+        for timer, item in delayed.items():
+            timer.cancel()
+            self._put(item)
+        deadline = time.time() + timeout
+        for _ in self.threads:
+            try:
+                self.queue.put(None, timeout=max(deadline - time.time(), 0))
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(max(deadline - time.time(), 0))
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._spool(item, 'executor is shut down')
+        running = sum(thread.is_alive() for thread in self.threads)
+        if running:
+            logger.error('%d tasks are still running after %s seconds of draining', running, timeout)
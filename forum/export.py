@@ -0,0 +1,95 @@
+"""Export of a topic group subtree as NDJSON.
+
+Every line is a JSON object of one row with the "type" of the row: users who wrote anything in the subtree, then
+topic groups, topics, poll answers, poll votes and comments, every type in order of ids. Rows are read by server-side
+cursors in batches, so memory doesn't depend on the size of the subtree. An interrupted export continues after
+the last written row given as "<type>:<id>".
+"""
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import and_, select, union
+
+from .app import db
+from .models import Comment, PollAnswer, PollVote, Topic, TopicGroup, User
+
+TYPES = ('user', 'topic_group', 'topic', 'poll_answer', 'poll_vote', 'comment')
+USER_COLUMNS = ('id', 'username', 'email', 'name', 'created_at')
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def parse_position(position):
+    """The "<type>:<id>" position of the last exported row, raises ValueError if it is not valid."""
+    row_type, _, row_id = position.partition(':')
+    if row_type not in TYPES or not row_id.isdigit():
+        raise ValueError('Position should be <type>:<id>, where type is one of ' + ', '.join(TYPES))
+    return row_type, int(row_id)
+
+
+def subtree_group_ids(topic_group_id):
+    """Ids of the topic group and all its descendants."""
+    children = {}
+    for group_id, parent_id in db.session.query(TopicGroup.id, TopicGroup.group_id):
+        if group_id != parent_id:
+            children.setdefault(parent_id, []).append(group_id)
+    ids, pending = [], [topic_group_id]
+    while pending:
+        group_id = pending.pop()
+        ids.append(group_id)
+        pending.extend(children.get(group_id, []))
+    return ids
+
+
+def _queries(group_ids):
+    topic_ids = select([Topic.id]).where(Topic.group_id.in_(group_ids))
+    author_ids = union(
+        select([TopicGroup.author_id]).where(TopicGroup.id.in_(group_ids)),
+        select([Topic.author_id]).where(Topic.group_id.in_(group_ids)),
+        select([PollVote.author_id]).where(PollVote.topic_id.in_(topic_ids)),
+        select([Comment.author_id]).where(Comment.topic_id.in_(topic_ids)),
+    )
+    users = User.__table__
+    return [
+        ('user', users, [users.c[name] for name in USER_COLUMNS], users.c.id.in_(author_ids)),
+        ('topic_group', TopicGroup.__table__, None, TopicGroup.id.in_(group_ids)),
+        ('topic', Topic.__table__, None, Topic.group_id.in_(group_ids)),
+        ('poll_answer', PollAnswer.__table__, None, PollAnswer.topic_id.in_(topic_ids)),
+        ('poll_vote', PollVote.__table__, None, PollVote.topic_id.in_(topic_ids)),
+        ('comment', Comment.__table__, None, Comment.topic_id.in_(topic_ids)),
+    ]
+
+
+def export_topic_group(topic_group_id, after=None, batch_size=1000):
+    """Yields NDJSON lines of the subtree of the topic group after the position "<type>:<id>"."""
+    after_type, after_id = parse_position(after) if after else (TYPES[0], 0)
+    connection = db.session.connection().execution_options(stream_results=True)
+    for row_type, table, columns, condition in _queries(subtree_group_ids(topic_group_id)):
+        if TYPES.index(row_type) < TYPES.index(after_type):
+            continue
+        if row_type == after_type:
+            condition = and_(condition, table.c.id > after_id)
+        result = connection.execute(select(columns or list(table.c)).where(condition).order_by(table.c.id))
+        keys = ['type'] + list(result.keys())
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield json.dumps(dict(zip(keys, [row_type] + list(row))), default=_default,
+                                 separators=(',', ':'), sort_keys=True) + '\n'
+
+
+def gzipped(lines, level=6):
+    """Gzip stream of the lines in chunks of the size of batches of the compressor."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for line in lines:
+        chunk = compressor.compress(line.encode('utf-8'))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
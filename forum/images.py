@@ -0,0 +1,289 @@
+"""Proxy of remote images: avatars and images embedded into bodies.
+
+Templates link images to the proxy with a signed URL (the proxy fetches only URLs the forum has shown). A remote
+image is fetched once, resized to the size of the link if Pillow is installed and kept in an on-disk cache:
+
+    <IMAGE_CACHE_DIR>/objects/<sha256 of the image>  images, identical images of different URLs are stored once
+    <IMAGE_CACHE_DIR>/refs/<sha1 of the URL and size>  JSON with the hash and the type of the image of the URL
+
+Modification times of files are times of the last use, the least recently used files are evicted when the cache
+grows over IMAGE_CACHE_MAX_BYTES.
+"""
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+
+import six
+from flask import current_app, url_for
+from six.moves import http_client
+from six.moves.urllib.parse import quote, urlparse
+from six.moves.urllib.request import (HTTPHandler, HTTPRedirectHandler, HTTPSHandler, ProxyHandler, Request,
+                                      build_opener)
+
+try:
+    from PIL import Image
+except ImportError:  # Images are served as they are without Pillow.
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMG_SRC = re.compile(r'(<img\b[^>]*?\bsrc=")([^"]+)(")', re.IGNORECASE)
+IMAGE_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+_PRIVATE_IPV4 = [(struct.unpack('!I', socket.inet_aton(network))[0], bits) for network, bits in (
+    ('0.0.0.0', 8), ('10.0.0.0', 8), ('100.64.0.0', 10), ('127.0.0.0', 8), ('169.254.0.0', 16),
+    ('172.16.0.0', 12), ('192.168.0.0', 16), ('224.0.0.0', 4), ('240.0.0.0', 4))]
+
+
+class ImageError(Exception):
+    pass
+
+
+def signature(url, size):
+    message = u'{}|{}'.format(size, url).encode('utf-8')
+    return hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'), message, hashlib.sha1).hexdigest()[:20]
+
+
+def proxied_url(url, size):
+    """URL of the image resized to size (0 keeps the size up to IMAGE_PROXY_MAX_WIDTH) through the proxy."""
+    if not url or not current_app.config['IMAGE_PROXY'] or urlparse(url).scheme not in ('http', 'https'):
+        return url
+    return url_for('main.image', url=url, size=size, sig=signature(url, size))
+
+
+def proxy_images(html):
+    """HTML with images of bodies linked through the proxy."""
+    if not html or '<img' not in html or not current_app.config['IMAGE_PROXY']:
+        return html
+    return IMG_SRC.sub(lambda m: m.group(1) + proxied_url(m.group(2).replace('&amp;', '&'), 0).replace(
+        '&', '&amp;') + m.group(3), html)
+
+
+def is_private_address(address):
+    if ':' in address:
+        packed = socket.inet_pton(socket.AF_INET6, address.split('%')[0])
+        if packed[:12] == b'\0' * 10 + b'\xff\xff':  # IPv4-mapped
+            return is_private_address(socket.inet_ntoa(packed[12:]))
+        first = six.indexbytes(packed, 0)
+        return (packed in (b'\0' * 16, b'\0' * 15 + b'\1') or first & 0xfe == 0xfc or
+                (first == 0xfe and six.indexbytes(packed, 1) & 0xc0 == 0x80) or first == 0xff)
+    value = struct.unpack('!I', socket.inet_aton(address))[0]
+    return any(value >> (32 - bits) == network >> (32 - bits) for network, bits in _PRIVATE_IPV4)
+
+
+def check_url(url):
+    """Raises ImageError if the URL is not http(s)."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ImageError(u'Not an http(s) URL: {}'.format(url))
+
+
+def resolve_host(host, port):
+    """The address of the host to connect to, raises ImageError if the host resolves to a private address."""
+    try:
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    except socket.error as e:
+        raise ImageError(u'Host {} is not resolved: {}'.format(host, e))
+    if not current_app.config['IMAGE_PROXY_ALLOW_PRIVATE'] and any(
+            is_private_address(address[4][0]) for address in addresses):
+        raise ImageError(u'Host {} is a private address'.format(host))
+    return addresses[0][4][0]
+
+
+class _CheckedHTTPConnection(http_client.HTTPConnection):
+    # Connects to the address which has been checked instead of resolving the host again, so the host can't
+    # resolve to a public address for the check and to a private one for the connection. Requests keep the host
+    # in the Host header and HTTPS checks the certificate of the host.
+    def connect(self):
+        self.sock = socket.create_connection((resolve_host(self.host, self.port), self.port), self.timeout)
+
+
+class _CheckedHTTPSConnection(http_client.HTTPSConnection):
+    def connect(self):
+        sock = socket.create_connection((resolve_host(self.host, self.port), self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+class _CheckedHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_CheckedHTTPConnection, req)
+
+
+class _CheckedHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_CheckedHTTPSConnection, req, context=self._context)
+
+
+class _CheckedRedirectHandler(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return HTTPRedirectHandler.redirect_request(self, req, fp, code, msg, headers, newurl)
+
+
+def fetch(url):
+    """Bytes and the content type of the remote image."""
+    check_url(url)
+    config = current_app.config
+    # Non-ASCII characters of IRIs are percent-encoded, as browsers do.
+    request = Request(quote(url.encode('utf-8'), safe="/%:@&=+$,!~*'()?#;[]"),
+                      headers={'User-Agent': config['IMAGE_PROXY_USER_AGENT'], 'Accept': 'image/*'})
+    opener = build_opener(ProxyHandler({}), _CheckedHTTPHandler, _CheckedHTTPSHandler, _CheckedRedirectHandler)
+    try:
+        response = opener.open(request, timeout=config['IMAGE_PROXY_TIMEOUT'])
+        try:
+            content_type = response.info().get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type not in IMAGE_FORMATS.values():  # no SVG, it may have scripts
+                raise ImageError(u'Not an image: {} of {}'.format(content_type, url))
+            data = response.read(config['IMAGE_PROXY_MAX_BYTES'] + 1)
+        finally:
+            response.close()
+    except (IOError, socket.error) as e:  # URLError and HTTPError are IOError
+        raise ImageError(u'{} is not fetched: {}'.format(url, e))
+    if len(data) > config['IMAGE_PROXY_MAX_BYTES']:
+        raise ImageError(u'{} is larger than {} bytes'.format(url, config['IMAGE_PROXY_MAX_BYTES']))
+    return data, content_type
+
+
+def resize(data, content_type, size):
+    """The image fitted into a size x size square (or into the maximal width for size 0), never enlarged."""
+    if Image is None:
+        return data, content_type
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format not in IMAGE_FORMATS:
+            raise ImageError('Unsupported format: {}'.format(image.format))
+        if image.size[0] * image.size[1] > current_app.config['IMAGE_PROXY_MAX_PIXELS']:
+            raise ImageError('Image of {}x{} pixels is too large'.format(*image.size))
+        max_width = current_app.config['IMAGE_PROXY_MAX_WIDTH']
+        box = (size, size) if size else (max_width, max_width * 4)
+        if image.size[0] <= box[0] and image.size[1] <= box[1]:
+            return data, IMAGE_FORMATS[image.format]
+        image.thumbnail(box, Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.ANTIALIAS)
+        output = io.BytesIO()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image.save(output, 'PNG', optimize=True)
+            return output.getvalue(), 'image/png'
+        image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+        return output.getvalue(), 'image/jpeg'
+    except (IOError, SyntaxError, ValueError) as e:  # broken images
+        raise ImageError('Image is not decoded: {}'.format(e))
+
+
+class ImageCache(object):
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None  # bytes of files, counted on the first write
+        self.lock = threading.Lock()
+
+    def _path(self, kind, name):
+        return os.path.join(self.directory, kind, name[:2], name)
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                pass
+        temporary = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.rename(temporary, path)
+
+    def get(self, key):
+        """(data, content type, hash) of the key or None, the files become the most recently used."""
+        ref_path = self._path('refs', key)
+        try:
+            with open(ref_path, 'rb') as f:
+                ref = json.loads(f.read().decode('utf-8'))
+            object_path = self._path('objects', ref['object'])
+            with open(object_path, 'rb') as f:
+                data = f.read()
+            os.utime(ref_path, None)
+            os.utime(object_path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return data, ref['type'], ref['object']
+
+    def put(self, key, data, content_type):
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._path('objects', digest)
+        ref = json.dumps(dict(object=digest, type=content_type)).encode('utf-8')
+        added = len(ref)
+        if os.path.exists(object_path):
+            os.utime(object_path, None)
+        else:
+            self._write(object_path, data)
+            added += len(data)
+        self._write(self._path('refs', key), ref)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._files())
+            else:
+                self.size += added
+            if self.size > self.max_bytes:
+                self.evict()
+        return digest
+
+    def _files(self):
+        for kind in ('refs', 'objects'):
+            for root, _, names in os.walk(os.path.join(self.directory, kind)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Deletes the least recently used files until the cache takes 90% of the maximal size."""
+        files = sorted(self._files())
+        self.size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+_caches = {}
+_fetch_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_cache():
+    directory = current_app.config['IMAGE_CACHE_DIR']
+    if directory not in _caches:
+        _caches[directory] = ImageCache(directory, current_app.config['IMAGE_CACHE_MAX_BYTES'])
+    return _caches[directory]
+
+
+def get_image(url, size):
+    """(data, content type, hash) of the image of the URL resized to size, fetched only if it is not cached."""
+    cache = get_cache()
+    key = hashlib.sha1(u'{}|{}'.format(size, url).encode('utf-8')).hexdigest()
+    image = cache.get(key)
+    if image:
+        return image
+    # Concurrent requests of an image in a process fetch it once.
+    with _fetch_locks[int(key[:8], 16) % len(_fetch_locks)]:
+        image = cache.get(key)
+        if image:
+            return image
+        started = time.time()
+        data, content_type = resize(*fetch(url), size=size)
+        digest = cache.put(key, data, content_type)
+        logger.info('Image %s of size %s is fetched in %.3f s', url, size, time.time() - started)
+        return data, content_type, digest
@@ -0,0 +1,115 @@
+"""New comments of topics for long polls and Server-Sent Events.
+
+Watchers of one topic in a process share one DB poll: the watcher whose poll is due reads comments newer than the
+last seen one by the (topic_id, id) index and wakes up the others, which take new comments from the buffer of the
+topic. At most one poll per topic per LIVE_POLL_INTERVAL seconds is made however many watchers there are.
+"""
+import threading
+import time
+
+from flask import current_app, url_for
+from sqlalchemy import and_
+
+from .app import db
+from .images import proxied_url, proxy_images
+from .models import Comment, User
+
+
+def serialize(comment_id, body_html, created_at, username, avatar):
+    return dict(id=comment_id, body_html=proxy_images(body_html), created_at=created_at.isoformat() + 'Z',
+                author=username, author_url=url_for('main.user', username=username), avatar=proxied_url(avatar, 80))
+
+
+def comments_newer_than(topic_id, since_id, limit):
+    """Comments of the topic newer than since_id in order of id, read by the (topic_id, id) index."""
+    rows = Comment.query.with_entities(
+        Comment.id, Comment.body_html, Comment.created_at, User.username, User.avatar).join(
+        User, Comment.author_id == User.id).filter(
+        and_(Comment.topic_id == topic_id, Comment.id > since_id, Comment.deleted == False)).order_by(
+        Comment.id).limit(limit).all()
+    return [serialize(*row) for row in rows]
+
+
+class _TopicWatch(object):
+    def __init__(self, since_id):
+        self.condition = threading.Condition()
+        self.watchers = 0
+        self.polling = False
+        self.polled_at = 0
+        # The buffer has all comments after base_id.
+        self.base_id = since_id
+        self.comments = []
+
+    @property
+    def last_id(self):
+        return self.comments[-1]['id'] if self.comments else self.base_id
+
+    def newer_than(self, since_id, limit):
+        return [c for c in self.comments if c['id'] > since_id][:limit]
+
+    def extend(self, comments, size):
+        self.comments.extend(comments)
+        if len(self.comments) > size:
+            self.base_id = self.comments[-size - 1]['id']
+            del self.comments[:-size]
+
+
+class CommentsFeed(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watches = {}
+        self.polls = 0
+
+    def wait(self, topic_id, since_id, timeout):
+        """Comments of the topic newer than since_id, waits for them at most timeout seconds."""
+        limit = current_app.config['LIVE_COMMENTS_LIMIT']
+        with self.lock:
+            watch = self.watches.get(topic_id)
+            if watch is None:
+                watch = self.watches[topic_id] = _TopicWatch(since_id)
+            watch.watchers += 1
+        try:
+            if since_id < watch.base_id:
+                # Older than the buffer, the watcher has come from a stale page.
+                comments = comments_newer_than(topic_id, since_id, limit)
+                if comments or not timeout:
+                    return comments
+                since_id = watch.base_id
+            return self._wait(watch, topic_id, since_id, limit, time.time() + timeout)
+        finally:
+            with self.lock:
+                watch.watchers -= 1
+                if not watch.watchers:
+                    del self.watches[topic_id]
+
+    def _wait(self, watch, topic_id, since_id, limit, deadline):
+        interval = current_app.config['LIVE_POLL_INTERVAL']
+        while True:
+            with watch.condition:
+                comments = watch.newer_than(since_id, limit)
+                if comments:
+                    return comments
+                now = time.time()
+                if watch.polling or now < watch.polled_at + interval:
+                    if now >= deadline:
+                        return []
+                    # The polling watcher notifies when it is done.
+                    wake_at = deadline if watch.polling else min(deadline, watch.polled_at + interval)
+                    watch.condition.wait(max(wake_at - now, 0.01))
+                    continue
+                # This watcher polls for all watchers of the topic.
+                watch.polling, last_id = True, watch.last_id
+            new_comments = []
+            try:
+                new_comments = comments_newer_than(topic_id, last_id, limit)
+                self.polls += 1
+            finally:
+                # The connection is not held while the watcher waits.
+                db.session.close()
+                with watch.condition:
+                    watch.extend(new_comments, limit)
+                    watch.polling, watch.polled_at = False, time.time()
+                    watch.condition.notify_all()
+
+
+feed = CommentsFeed()
@@ -0,0 +1,87 @@
+import os
+import random
+import smtplib
+import socket
+import time
+from threading import Lock
+
+from flask import current_app
+
+
+def is_transient_error(error):
+    """Whether delivery may succeed later: the connection is lost or the server replies with a 4xx code."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, socket.error)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+def retry_countdown(retries):
+    """Exponential backoff with full jitter."""
+    backoff = current_app.config['MAIL_RETRY_BACKOFF'] * 2 ** retries
+    return random.uniform(0, min(backoff, current_app.config['MAIL_RETRY_BACKOFF_MAX']))
+
+
+class PooledConnection(object):
+    """SMTP session kept open between emails sent by one process.
+
+    The session is opened on the first email, checked with NOOP after MAIL_POOL_MAX_IDLE seconds of idleness,
+    reopened once if the server has dropped it and never shared with a forked child process.
+    """
+
+    def __init__(self, mail):
+        self.mail = mail
+        self.connection = None
+        self.pid = None
+        self.last_used = 0
+        self.sessions = 0
+        self.lock = Lock()
+
+    def _is_alive(self):
+        if time.time() - self.last_used < current_app.config['MAIL_POOL_MAX_IDLE']:
+            return True
+        try:
+            return self.connection.host.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def _connect(self):
+        if self.pid != os.getpid():
+            # The socket belongs to the parent process.
+            self.connection, self.pid = None, os.getpid()
+        if self.connection is not None and self.connection.host is not None and not self._is_alive():
+            self._close()
+        if self.connection is None:
+            self.connection = self.mail.connect().__enter__()
+            self.sessions += 1
+        return self.connection
+
+    def _close(self):
+        connection, self.connection = self.connection, None
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, socket.error):
+                connection.host.close()
+
+    def send(self, message):
+        with self.lock:
+            try:
+                self._connect().send(message)
+            except smtplib.SMTPServerDisconnected:
+                self._close()
+                try:
+                    self._connect().send(message)
+                except Exception:
+                    self._close()
+                    raise
+            except Exception as e:
+                if is_transient_error(e):
+                    self._close()
+                raise
+            self.last_used = time.time()
+
+    def close(self):
+        with self.lock:
+            self._close()
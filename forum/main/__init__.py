@@ -6,6 +6,7 @@ from flask_wtf.csrf import generate_csrf  # noqa: E402
 from flask_babel import format_datetime, format_timedelta  # noqa: E402
 
 from . import views, errors  # noqa: E402, F401
+from ..images import proxied_url, proxy_images  # noqa: E402
 from ..models import Permission  # noqa: E402
 
 
@@ -17,4 +18,7 @@ def inject_variables_for_jinja():
         format_timedelta=format_timedelta,
         get_locale=views.get_locale,
         generate_csrf=generate_csrf,
+        unread_messages=views.lazy_unread_messages_count(),
+        thumbnail=proxied_url,
+        proxy_images=proxy_images,
     )
@@ -1,17 +1,100 @@
+import hmac
+import json
+import time
 from datetime import datetime, timedelta
 
-from flask import render_template, redirect, url_for, abort, flash, request, current_app, session
+from flask import (render_template, redirect, url_for, abort, flash, request, current_app, session, jsonify, Response,
+                   stream_with_context, get_flashed_messages, has_request_context)
 from flask_babel import lazy_gettext
 from flask_login import login_required, current_user
+from flask_sqlalchemy import Pagination
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
 from sqlalchemy import func, case, between, and_, or_
+from sqlalchemy.orm import Bundle, Load, joinedload
+from werkzeug.local import LocalProxy
 
 from . import main
 from .forms import (EditProfileForm, EditProfileAdminForm, TopicForm, TopicGroupForm, TopicWithPollForm,
                     CommentForm, CommentEditForm, MessageReplyForm, MessageSendForm, SearchForm)
 from ..app import babel, db
+from ..celery_tasks import cascade_topic_deletion, schedule_interest_refresh
+from .. import export, images
+from ..dispatch import dispatch
 from ..decorators import admin_required, permission_required
-from ..models import Permission, Role, User, Topic, TopicGroup, Comment, PollAnswer, Message, Favorite
+from ..live import feed
+from ..models import (Permission, Role, User, Topic, TopicGroup, Comment, PollAnswer, Message, Favorite, Conversation,
+                      ConversationMember, DeletionJob)
+from ..transactions import defer_write
+
+# Rows of lists have only the columns shown by _topics.html and _topic_groups.html as plain tuples
+# instead of entities with bodies of topics and profiles of users.
+topic_columns = Bundle('topic', Topic.id, Topic.title, Topic.created_at, Topic.updated_at)
+author_columns = Bundle('author', User.username, User.avatar)
+topic_group_columns = Bundle('topic_group', TopicGroup.id, TopicGroup.title)
+
+
+def comment_list_options():
+    """Options of queries of (Comment, User, ...) rows for _comments.html, comment.author is one of the users."""
+    return [Load(Comment).defer('body'), Load(User).load_only('id', 'username', 'avatar', 'name')]
+
+
+def unread_messages_count():
+    """Unread messages of the current user for the navbar."""
+    if not has_request_context() or not current_user.is_authenticated:
+        return 0
+    return current_user.get_unread_messages_count()
+
+
+def lazy_unread_messages_count():
+    """unread_messages_count computed once when a template uses it first, other templates don't query it."""
+    counts = []
+
+    def count():
+        if not counts:
+            counts.append(unread_messages_count())
+        return counts[0]
+    return LocalProxy(count)
+
+
+def chunked(pieces, size):
+    """Pieces of text joined into chunks of at least size characters."""
+    buffered, length = [], 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield u''.join(buffered)
+            buffered, length = [], 0
+    if buffered:
+        yield u''.join(buffered)
+
+
+def render_page(template_name, **context):
+    """render_template, or if STREAM_TEMPLATES is set the page streamed while it is rendered, so the head and
+    the navbar are sent before the body is rendered. The view has read everything from DB and decided the
+    status by then: the transaction is committed before the first chunk and the template must not load more.
+    """
+    if not current_app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+    app = current_app._get_current_object()
+    # The count of unread messages queries DB, the session cookie is sent with the headers, so the CSRF token and
+    # flashed messages are taken from the session now.
+    app.update_template_context(context)
+    context['unread_messages'] = int(context['unread_messages'])
+    generate_csrf()
+    get_flashed_messages()
+    if current_user.is_authenticated:
+        current_user.role  # permissions checked by templates
+    template = app.jinja_env.get_or_select_template(template_name)
+    session = db.session()
+    expire_on_commit, session.expire_on_commit = session.expire_on_commit, False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+    chunks = chunked(template.generate(context), current_app.config['STREAM_TEMPLATES_CHUNK_SIZE'])
+    return Response(stream_with_context(chunks), mimetype='text/html')
 
 
 def get_topic_group(topic_group_id):
@@ -20,7 +103,7 @@ def get_topic_group(topic_group_id):
 
     if page == 1 or not current_app.config['TOPIC_GROUPS_ONLY_ON_1ST_PAGE']:
         t_groups = TopicGroup.query.with_entities(
-            TopicGroup, func.sum(case([(Topic.deleted == False, 1)], else_=0))).outerjoin(
+            topic_group_columns, func.sum(case([(Topic.deleted == False, 1)], else_=0))).outerjoin(
             Topic, TopicGroup.id == Topic.group_id).filter(
             and_(TopicGroup.deleted == False, TopicGroup.group_id == t_group.id)).group_by(
             TopicGroup.id).order_by(TopicGroup.priority, TopicGroup.created_at.desc()).all()
@@ -28,7 +111,7 @@ def get_topic_group(topic_group_id):
         t_groups = []
 
     pagination = Topic.query.with_entities(
-        Topic, User,
+        topic_columns, author_columns,
         func.sum(case([(Comment.deleted == False, 1)], else_=0)),
         func.max(case([(Comment.deleted == False, Comment.created_at)], else_=None))
         ).join(User, Topic.author_id == User.id).outerjoin(
@@ -48,32 +131,110 @@ def index():
 
 @main.route('/topic/<int:topic_id>', methods=['GET', 'POST'])
 def topic(topic_id):
-    tpc = Topic.query.filter_by(id=topic_id, deleted=False).first_or_404()
-    tpc_in_favorites = Favorite.query.filter_by(topic_id=tpc.id, user_id=current_user.id).first()
+    tpc = Topic.query.options(joinedload('author')).filter_by(id=topic_id, deleted=False).first_or_404()
+    if current_user.is_authenticated:
+        tpc_in_favorites = Favorite.query.filter_by(topic_id=tpc.id, user_id=current_user.id).first()
+    else:
+        tpc_in_favorites = None
 
     form = CommentForm(current_user) if current_user.can(Permission.PARTICIPATE) else None
     if form and form.validate_on_submit():
         tpc.add_comment(current_user, form.body.data)
+        db.session.commit()
+        schedule_interest_refresh(topic_id)
         flash(lazy_gettext('Your comment has been published.'))
         return redirect(url_for('main.topic', topic_id=topic_id, page=-1, _anchor='comment-last'))
 
+    # A page is a range of sequence numbers of comments read by the (topic_id, seq) index, deleted comments
+    # leave gaps in pages instead of shifting all following comments to other pages.
+    per_page = current_app.config['COMMENTS_PER_PAGE']
     page = request.args.get('page', 1, type=int)
     if page == -1:
-        page = max((tpc.comments_count - 1) // current_app.config['COMMENTS_PER_PAGE'] + 1, 1)
-
-    pagination = Comment.query.with_entities(
-        Comment, User).join(User, Comment.author_id == User.id).filter(
-        and_(Comment.topic_id == tpc.id, Comment.deleted == False)).order_by(
-        Comment.created_at.asc()).paginate(page, per_page=current_app.config['COMMENTS_PER_PAGE'], error_out=True)
+        page = tpc.last_comments_page
+    if page < 1 or page > tpc.last_comments_page:
+        abort(404)
+    comments = Comment.query.with_entities(
+        Comment, User).options(*comment_list_options()).join(User, Comment.author_id == User.id).filter(
+        and_(Comment.topic_id == tpc.id, between(Comment.seq, (page - 1) * per_page + 1, page * per_page),
+             Comment.deleted == False)).order_by(Comment.seq).all()
+    pagination = Pagination(None, page, per_page, tpc.last_comment_seq or 0, comments)
 
     user_vote = current_user.get_vote(tpc)
     if tpc.poll and user_vote:
         poll_data = tpc.get_poll_results()
     else:
         poll_data = [(a.id, a.body) for a in tpc.poll_answers.filter_by(deleted=False).all()]
-
-    return render_template('topic.html', topic=tpc, topic_in_favorites=tpc_in_favorites, form=form, user_vote=user_vote,
-                           poll_data=poll_data, comments=pagination.items, pagination=pagination)
+    # New comments are watched on the last page, from the last comment of the topic, the page may show none.
+    last_comment_id = None if pagination.has_next else db.session.query(
+        func.coalesce(func.max(Comment.id), 0)).filter(Comment.topic_id == tpc.id).scalar()
+
+    return render_page('topic.html', topic=tpc, topic_in_favorites=tpc_in_favorites, form=form, user_vote=user_vote,
+                           poll_data=poll_data, comments=pagination.items, pagination=pagination,
+                           last_comment_id=last_comment_id)
+
+
+@main.route('/comment/<int:comment_id>')
+def comment(comment_id):
+    """Permalink of a comment, redirects to the page of the comment in the topic."""
+    cmnt = Comment.query.filter_by(id=comment_id, deleted=False).first_or_404()
+    return redirect(url_for('main.topic', topic_id=cmnt.topic_id, page=Topic.comments_page(cmnt.seq),
+                            _anchor='comment-{}'.format(cmnt.id)))
+
+
+@main.route('/topic/<int:topic_id>/comment/<int:seq>')
+def topic_comment(topic_id, seq):
+    """Jump to the comment number seq of the topic."""
+    cmnt = Comment.query.filter_by(topic_id=topic_id, seq=seq, deleted=False).first_or_404()
+    return redirect(url_for('main.topic', topic_id=topic_id, page=Topic.comments_page(seq),
+                            _anchor='comment-{}'.format(cmnt.id)))
+
+
+def check_live_topic(topic_id):
+    if not db.session.query(Topic.query.filter_by(id=topic_id, deleted=False).exists()).scalar():
+        abort(404)
+    # The connection is not held while the watcher waits for new comments.
+    db.session.commit()
+
+
+@main.route('/topic/<int:topic_id>/comments')
+def new_comments(topic_id):
+    """Comments newer than ?since=<comment id>, a long poll if ?wait=<seconds> is given and workers are async."""
+    check_live_topic(topic_id)
+    since_id = request.args.get('since', 0, type=int)
+    max_wait = current_app.config['LIVE_POLL_TIMEOUT'] if current_app.config['LIVE_ASYNC'] else 0
+    wait = min(max(request.args.get('wait', 0, type=float), 0), max_wait)
+    comments = feed.wait(topic_id, since_id, wait)
+    response = jsonify(comments=comments, last_id=comments[-1]['id'] if comments else since_id)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@main.route('/topic/<int:topic_id>/comments/stream')
+def new_comments_stream(topic_id):
+    """Server-Sent Events of comments newer than ?since=<comment id> or Last-Event-ID of the reconnect."""
+    if not current_app.config['LIVE_ASYNC']:
+        abort(404)
+    check_live_topic(topic_id)
+    since_id = request.args.get('since', 0, type=int)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        since_id = int(last_event_id)
+    timeout, lifetime = current_app.config['LIVE_POLL_TIMEOUT'], current_app.config['LIVE_STREAM_LIFETIME']
+
+    def events(since_id):
+        # The stream ends after its lifetime and the browser reconnects with Last-Event-ID,
+        # so a worker thread is not taken forever.
+        deadline = time.time() + lifetime
+        while time.time() < deadline:
+            comments = feed.wait(topic_id, since_id, min(timeout, max(deadline - time.time(), 0)))
+            if not comments:
+                yield ': keep-alive\n\n'
+            for comment in comments:
+                yield 'id: {}\nevent: comment\ndata: {}\n\n'.format(comment['id'], json.dumps(comment))
+                since_id = comment['id']
+
+    return Response(stream_with_context(events(since_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @main.route('/create_topic/<int:topic_group_id>', methods=['GET', 'POST'])
@@ -161,12 +322,9 @@ def edit_topic(topic_id):
         return redirect(url_for('main.topic', topic_id=tpc.id))
 
     elif form.delete.data:
-        tpc.comments.update(dict(deleted=True))
-        tpc.poll_answers.update(dict(deleted=True))
-        tpc.poll_votes.update(dict(deleted=True))
-        tpc.deleted = True
-        tpc.updated_at = datetime.utcnow()
-        db.session.add(tpc)
+        job = tpc.delete(current_user)
+        db.session.commit()
+        dispatch(cascade_topic_deletion, [job.id])
         flash(lazy_gettext('The topic has been deleted.'))
         return redirect(url_for('main.topic_group', topic_group_id=tpc.group_id))
 
@@ -272,6 +430,65 @@ def edit_topic_group(topic_group_id):
     return render_template('edit_topic_group.html', form=form, topic_group=t_group)
 
 
+@main.route('/deletions')
+@login_required
+@permission_required(Permission.MODERATE)
+def deletions():
+    page = request.args.get('page', 1, type=int)
+    pagination = DeletionJob.query.with_entities(DeletionJob, User).outerjoin(
+        User, DeletionJob.author_id == User.id).order_by(DeletionJob.id.desc()).paginate(
+        page, per_page=current_app.config['DELETION_JOBS_PER_PAGE'], error_out=True)
+    in_progress = any(job.finished_at is None for job, _ in pagination.items)
+    return render_template('deletions.html', jobs=pagination.items, pagination=pagination, in_progress=in_progress)
+
+
+@main.route('/export/topic_group/<int:topic_group_id>')
+@login_required
+@admin_required
+def export_topic_group(topic_group_id):
+    """NDJSON of the topic group subtree, ?after=<type>:<id> continues an interrupted download."""
+    TopicGroup.query.get_or_404(topic_group_id)
+    after = request.args.get('after')
+    if after:
+        try:
+            export.parse_position(after)
+        except ValueError:
+            abort(400)
+    lines = export.export_topic_group(topic_group_id, after=after)
+    filename = 'topic_group_{}.ndjson'.format(topic_group_id)
+    if request.args.get('gzip', 0, type=int):
+        body, mimetype, filename = export.gzipped(lines), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = lines, 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+
+@main.route('/image')
+def image():
+    """Remote image of a signed ?url= resized to ?size=, fetched once and served from the cache of the proxy."""
+    url, size, sig = request.args.get('url', ''), request.args.get('size', -1, type=int), request.args.get('sig', '')
+    if not current_app.config['IMAGE_PROXY'] or size not in [0] + current_app.config['IMAGE_PROXY_SIZES']:
+        abort(404)
+    if not hmac.compare_digest(str(sig), str(images.signature(url, size))):
+        abort(403)
+    try:
+        data, content_type, digest = images.get_image(url, size)
+    except images.ImageError as e:
+        current_app.logger.warning(u'Image proxy: %s', e.args[0])
+        response = Response(status=404)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['IMAGE_PROXY_ERROR_MAX_AGE']
+        return response
+    response = Response(data, mimetype=content_type)
+    # Links are signed and content of an URL changes rarely, so browsers and proxies keep images for long.
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['IMAGE_PROXY_MAX_AGE']
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.set_etag(digest)
+    return response.make_conditional(request)
+
+
 @main.route('/user/<username>')
 @login_required
 def user(username):
@@ -279,7 +496,7 @@ def user(username):
 
     page = request.args.get('page', 1, type=int)
     pagination = Topic.query.with_entities(
-        Topic, User,
+        topic_columns, author_columns,
         func.sum(case([(Comment.deleted == False, 1)], else_=0)),
         func.max(case([(Comment.deleted == False, Comment.created_at)], else_=None))
         ).join(User, Topic.author_id == User.id).outerjoin(
@@ -363,7 +580,7 @@ def latest():
 
     if target_arg == 'topics':
         pagination = Topic.query.with_entities(
-            Topic, User,
+            topic_columns, author_columns,
             func.sum(case([(Comment.deleted == False, 1)], else_=0)),
             func.max(case([(Comment.deleted == False, Comment.created_at)], else_=None))
             ).join(User, Topic.author_id == User.id).outerjoin(
@@ -372,14 +589,15 @@ def latest():
             page_arg, per_page=current_app.config['TOPICS_PER_PAGE'], error_out=True)
     elif target_arg == 'comments':
         pagination = Comment.query.with_entities(
-            Comment, User, Topic).join(User, Comment.author_id == User.id).join(
+            Comment, User, Bundle('topic', Topic.title)).options(*comment_list_options()).join(
+            User, Comment.author_id == User.id).join(
             Topic, Comment.topic_id == Topic.id).filter(Comment.deleted == False).order_by(
             Comment.created_at.desc()).paginate(
             page_arg, per_page=current_app.config['COMMENTS_PER_PAGE'], error_out=True)
     else:
         abort(400)
 
-    return render_template('latest.html', target=target_arg, items=pagination.items, pagination=pagination)
+    return render_page('latest.html', target=target_arg, items=pagination.items, pagination=pagination)
 
 
 @main.route('/edit_comment/<int:comment_id>', methods=['GET', 'POST'])
@@ -423,11 +641,12 @@ def vote(topic_id, answer_id):
     form = FlaskForm()
     if form.validate_on_submit():
         answer = PollAnswer.query.filter_by(id=answer_id, topic_id=topic_id, deleted=False).first_or_404()
-        if current_user.get_vote(answer.topic):
-            flash(lazy_gettext('You have already voted for this poll.'))
-        else:
-            answer.topic.add_vote(current_user, answer)
+        if answer.topic.add_vote(current_user, answer):
+            db.session.commit()
+            schedule_interest_refresh(topic_id)
             flash(lazy_gettext('Your vote has been taken.'))
+        else:
+            flash(lazy_gettext('You have already voted for this poll.'))
     return redirect(request.args.get('next') or url_for('main.topic', topic_id=topic_id))
 
 
@@ -445,7 +664,7 @@ def hot():
     }
 
     pagination = Topic.query.with_entities(
-        Topic, User,
+        topic_columns, author_columns,
         func.sum(case([(Comment.deleted == False, 1)], else_=0)),
         func.max(case([(Comment.deleted == False, Comment.created_at)], else_=None))
         ).join(User, Topic.author_id == User.id).outerjoin(
@@ -461,9 +680,16 @@ def hot():
 @login_required
 def messages():
     page = request.args.get('page', 1, type=int)
-    direction = request.args.get('direction', 'received', type=str)
-
-    if direction == 'received':
+    direction = request.args.get('direction', 'conversations', type=str)
+
+    if direction == 'conversations':
+        pagination = ConversationMember.query.with_entities(ConversationMember, User, Message).join(
+            User, ConversationMember.interlocutor_id == User.id).outerjoin(
+            Message, ConversationMember.last_message_id == Message.id).filter(
+            and_(ConversationMember.user_id == current_user.id, ConversationMember.messages_count > 0)).order_by(
+            ConversationMember.last_message_at.desc()).paginate(
+            page, per_page=current_app.config['MESSAGES_PER_PAGE'], error_out=True)
+    elif direction == 'received':
         pagination = Message.query.with_entities(Message, User).join(
             User, Message.author_id == User.id).filter(
             and_(Message.receiver_id == current_user.id, Message.receiver_deleted == False)).order_by(
@@ -476,46 +702,64 @@ def messages():
     else:
         abort(400)
 
-    return render_template('messages.html', messages=pagination.items, pagination=pagination, direction=direction)
+    return render_page('messages.html', messages=pagination.items, pagination=pagination, direction=direction)
+
+
+@main.route('/messages/bulk', methods=['POST'])
+@login_required
+def messages_bulk():
+    direction = request.args.get('direction', 'received', type=str)
+    if direction not in ('received', 'sent'):
+        abort(400)
+
+    form = FlaskForm()
+    if form.validate_on_submit():
+        action = request.form.get('action', '', type=str)
+        message_ids = request.form.getlist('message_id', type=int)
+        if action in ('read', 'delete') and not message_ids:
+            flash(lazy_gettext('No messages were selected.'))
+        elif action in ('read', 'read_all'):
+            Message.mark_read_bulk(current_user, message_ids if action == 'read' else None)
+            flash(lazy_gettext('The messages have been marked as read.'))
+        elif action in ('delete', 'delete_all'):
+            Message.delete_bulk(current_user, direction, message_ids if action == 'delete' else None)
+            flash(lazy_gettext('The messages have been deleted.'))
+        else:
+            abort(400)
+
+    return redirect(request.args.get('next') or url_for('main.messages', direction=direction))
 
 
 @main.route('/message/<int:message_id>', methods=['GET', 'POST'])
 @login_required
 def message(message_id):
-    msg = Message.query.filter_by(id=message_id).filter(or_(
-        and_(Message.author_id == current_user.id, Message.author_deleted == False),
-        and_(Message.receiver_id == current_user.id, Message.receiver_deleted == False)
-    )).first_or_404()
+    msg = Message.query.filter_by(id=message_id).filter(Message.visible_to(current_user)).first_or_404()
 
     form = MessageReplyForm() if current_user.can(Permission.PARTICIPATE) else None
 
     if form:
         if form.send.data and form.validate_on_submit():
             receiver_id = msg.author_id if msg.author_id != current_user.id else msg.receiver_id
-            new_message = Message(title=form.title.data, body=form.body.data, author_id=current_user.id,
-                                  receiver_id=receiver_id)
+            Conversation.send_message(current_user.id, receiver_id, form.title.data, form.body.data)
             flash(lazy_gettext('Your message has been sent.'))
-            db.session.add(new_message)
             return redirect(request.args.get('next') or url_for('main.messages'))
         elif form.delete.data:
-            if msg.receiver_id == current_user.id:
-                msg.receiver_deleted = True
-            if msg.author_id == current_user.id:
-                msg.author_deleted = True
+            msg.delete_for(current_user)
             flash(lazy_gettext('The message has been deleted.'))
-            db.session.add(msg)
             return redirect(request.args.get('next') or url_for('main.messages'))
         elif form.close.data:
             return redirect(request.args.get('next') or url_for('main.messages'))
 
+    # Marked read after the response, the navbar shows the message as read already.
+    context = {}
     if msg.receiver_id == current_user.id and msg.unread:
-        msg.unread = False
-        db.session.add(msg)
+        if defer_write(msg.mark_read, current_user._get_current_object()):
+            context['unread_messages'] = unread_messages_count() - 1
 
     if form:
         form.title.data = msg.title
 
-    return render_template('message.html', message=msg, form=form)
+    return render_template('message.html', message=msg, form=form, **context)
 
 
 @main.route('/send_message/<username>', methods=['GET', 'POST'])
@@ -529,10 +773,8 @@ def send_message(username):
     form = MessageSendForm()
 
     if form.send.data and form.validate_on_submit():
-        new_message = Message(title=form.title.data, body=form.body.data, author_id=current_user.id,
-                              receiver_id=receiver.id)
+        Conversation.send_message(current_user.id, receiver.id, form.title.data, form.body.data)
         flash(lazy_gettext('Your message has been sent.'))
-        db.session.add(new_message)
         return redirect(request.args.get('next') or url_for('main.messages'))
     elif form.cancel.data:
         flash(lazy_gettext('The message was cancelled.'))
@@ -541,6 +783,46 @@ def send_message(username):
     return render_template('send_message.html', form=form, receiver=receiver)
 
 
+@main.route('/conversation/<int:conversation_id>', methods=['GET', 'POST'])
+@login_required
+def conversation(conversation_id):
+    member = ConversationMember.query.filter_by(conversation_id=conversation_id,
+                                                user_id=current_user.id).first_or_404()
+    interlocutor = User.query.get_or_404(member.interlocutor_id)
+    before = request.args.get('before', None, type=int)
+    per_page = current_app.config['MESSAGES_PER_PAGE']
+
+    form = MessageSendForm() if current_user.can(Permission.PARTICIPATE) else None
+
+    if form:
+        if form.send.data and form.validate_on_submit():
+            Conversation.send_message(current_user.id, interlocutor.id, form.title.data, form.body.data)
+            flash(lazy_gettext('Your message has been sent.'))
+            return redirect(url_for('main.conversation', conversation_id=conversation_id))
+        elif form.cancel.data:
+            return redirect(url_for('main.messages'))
+
+    # Keyset pagination by the (conversation_id, id) index: pages of older messages start before the given id.
+    query = Message.query.with_entities(Message, User).join(User, Message.author_id == User.id).filter(
+        and_(Message.conversation_id == conversation_id, Message.visible_to(current_user)))
+    if before:
+        query = query.filter(Message.id < before)
+    messages = query.order_by(Message.id.desc()).limit(per_page + 1).all()
+    older = messages[per_page - 1][0].id if len(messages) > per_page else None
+    messages = messages[:per_page]
+    messages.reverse()
+
+    context = {}
+    if member.unread_count and defer_write(member.conversation.mark_read, current_user._get_current_object()):
+        context['unread_messages'] = unread_messages_count() - member.unread_count
+
+    if form and messages and not form.title.data:
+        form.title.data = messages[-1][0].title
+
+    return render_template('conversation.html', conversation_id=conversation_id, interlocutor=interlocutor,
+                           messages=messages, older=older, before=before, form=form, **context)
+
+
 @main.route('/community', methods=['GET', 'POST'])
 @login_required
 def community():
@@ -584,7 +866,7 @@ def participation():
     last_commented = func.max(case([(Comment.deleted == False, Comment.created_at)], else_=Topic.created_at))
 
     pagination = Topic.query.with_entities(
-        Topic, User, comments_count, last_commented
+        topic_columns, author_columns, comments_count, last_commented
         ).join(User, Topic.author_id == User.id).outerjoin(
         Comment, Topic.id == Comment.topic_id).filter(Topic.deleted == False).filter(
         or_(Topic.author_id == current_user.id, Comment.author_id == current_user.id)).group_by(
@@ -603,7 +885,7 @@ def view_favorites():
     last_commented = func.max(case([(Comment.deleted == False, Comment.created_at)], else_=Topic.created_at))
 
     pagination = Topic.query.with_entities(
-        Topic, User, comments_count, last_commented
+        topic_columns, author_columns, comments_count, last_commented
         ).join(User, Topic.author_id == User.id).join(
         Favorite, and_(Favorite.topic_id == Topic.id, Favorite.user_id == current_user.id)
         ).outerjoin(Comment, Topic.id == Comment.topic_id).filter(Topic.deleted == False).group_by(
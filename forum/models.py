@@ -1,29 +1,66 @@
 import hashlib
 from datetime import datetime
 
-import bleach
 from flask import current_app
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, or_, and_, case, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from .app import db, login_manager
 from .config import config
 
 
+MARKDOWN_EXTENSIONS = [
+    'markdown.extensions.tables',
+    'markdown.extensions.nl2br',
+    'markdown.extensions.sane_lists',
+    'markdown.extensions.attr_list',
+]
+
+
+def render_body_html(value, tags=config.ALLOWED_TAGS, attributes=config.ALLOWED_ATTRIBUTES):
+    # Doesn't need application context, so it can be used in a pool of processes.
+    # Markdown and bleach are imported on first use, only processes changing bodies need them.
+    import bleach
+    from markdown import markdown
+    html = markdown(value, extensions=MARKDOWN_EXTENSIONS, output_format='html')
+    clean_html = bleach.clean(html, tags=tags, attributes=attributes, strip=True)
+    return bleach.linkify(clean_html)
+
+
 def on_changed_body_set_body_html(target, value, oldvalue, initiator):
-    extensions = [
-        'markdown.extensions.tables',
-        'markdown.extensions.nl2br',
-        'markdown.extensions.sane_lists',
-        'markdown.extensions.attr_list',
-    ]
-    html = markdown(value, extensions=extensions, output_format='html')
-    clean_html = bleach.clean(html, tags=current_app.config['ALLOWED_TAGS'],
-                              attributes=current_app.config['ALLOWED_ATTRIBUTES'], strip=True)
-    target.body_html = bleach.linkify(clean_html)
+    target.body_html = render_body_html(value, tags=current_app.config['ALLOWED_TAGS'],
+                                        attributes=current_app.config['ALLOWED_ATTRIBUTES'])
+
+
+def on_insert_comment_set_seq(mapper, connection, target):
+    if target.seq is None and target.topic_id is not None:
+        target.seq = Topic.next_comment_seq(connection, target.topic_id)
+
+
+def gravatar_url(email, size=256, default='identicon', rating='g', base_url=config.BASE_GRAVATAR_URL):
+    hash = hashlib.md5(email.encode('utf-8')).hexdigest()
+    return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+        url=base_url, hash=hash, size=size, default=default, rating=rating)
+
+
+def insert_or_ignore(table, **values):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return db.session.execute(pg_insert(table).values(**values).on_conflict_do_nothing()).rowcount == 1
+    if dialect == 'sqlite':
+        return db.session.execute(table.insert().prefix_with('OR IGNORE').values(**values)).rowcount == 1
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute(table.insert().values(**values))
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+    savepoint.commit()
+    return True
 
 
 class Permission:
@@ -64,8 +101,95 @@ class Role(db.Model):
         return '<Role %r>' % self.name
 
 
+class Conversation(db.Model):
+    __tablename__ = 'conversations'
+    __table_args__ = (db.UniqueConstraint('user1_id', 'user2_id', name='uq_conversations_user1_id_user2_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    # user1_id is always less than user2_id, so there is only one conversation between two users.
+    user1_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    user2_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    created_at = db.Column(db.DateTime, default=func.now())
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic')
+    members = db.relationship('ConversationMember', backref='conversation', lazy='dynamic')
+
+    @staticmethod
+    def get_or_create(user_id, interlocutor_id):
+        user1_id, user2_id = sorted((user_id, interlocutor_id))
+        if insert_or_ignore(Conversation.__table__, user1_id=user1_id, user2_id=user2_id,
+                            created_at=datetime.utcnow()):
+            conversation = Conversation.query.filter_by(user1_id=user1_id, user2_id=user2_id).one()
+            for member_id, other_id in ((user1_id, user2_id), (user2_id, user1_id)):
+                insert_or_ignore(ConversationMember.__table__, conversation_id=conversation.id, user_id=member_id,
+                                 interlocutor_id=other_id, messages_count=0, unread_count=0)
+            return conversation
+        return Conversation.query.filter_by(user1_id=user1_id, user2_id=user2_id).one()
+
+    @staticmethod
+    def send_message(author_id, receiver_id, title, body):
+        conversation = Conversation.get_or_create(author_id, receiver_id)
+        message = Message(title=title, body=body, author_id=author_id, receiver_id=receiver_id,
+                          conversation_id=conversation.id, created_at=datetime.utcnow())
+        db.session.add(message)
+        db.session.flush()
+        ConversationMember.query.filter_by(conversation_id=conversation.id).update({
+            ConversationMember.messages_count: ConversationMember.messages_count + 1,
+            ConversationMember.unread_count: ConversationMember.unread_count + case(
+                [(ConversationMember.user_id == receiver_id, 1)], else_=0),
+            ConversationMember.last_message_id: message.id,
+            ConversationMember.last_message_at: message.created_at,
+        }, synchronize_session=False)
+        return message
+
+    def mark_read(self, user):
+        if Message.query.filter_by(conversation_id=self.id, receiver_id=user.id, unread=True).update(
+                {Message.unread: False}, synchronize_session=False):
+            ConversationMember.query.filter_by(conversation_id=self.id, user_id=user.id).update(
+                {ConversationMember.unread_count: 0}, synchronize_session=False)
+
+
+class ConversationMember(db.Model):
+    __tablename__ = 'conversations_members'
+    __table_args__ = (db.Index('ix_conversations_members_user_id_last_message_at', 'user_id', 'last_message_at'),)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    interlocutor_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id'))
+    last_message_at = db.Column(db.DateTime)
+    # Maintained on every change of messages: not deleted by the user messages and unread by the user messages.
+    messages_count = db.Column(db.Integer, default=0)
+    unread_count = db.Column(db.Integer, default=0)
+
+    @staticmethod
+    def refresh_counters(user, conversation_ids=None):
+        """Recalculates counters of the user in the given conversations (a list or a subquery) or in all of them."""
+        in_conversation = Message.conversation_id == ConversationMember.conversation_id
+        messages_count = select([func.count(Message.id)]).where(
+            and_(in_conversation, Message.visible_to(user))).as_scalar()
+        unread_count = select([func.count(Message.id)]).where(
+            and_(in_conversation, Message.receiver_id == user.id, Message.receiver_deleted == False,
+                 Message.unread == True)).as_scalar()
+        query = ConversationMember.query.filter(ConversationMember.user_id == user.id)
+        if conversation_ids is not None:
+            query = query.filter(ConversationMember.conversation_id.in_(conversation_ids))
+        query.update({ConversationMember.messages_count: messages_count,
+                      ConversationMember.unread_count: unread_count}, synchronize_session=False)
+
+    @staticmethod
+    def refresh_last_message(user, conversation_ids):
+        """Sets the last message of the user in the given conversations to the last not deleted one with one UPDATE."""
+        last_message = select([Message.id, Message.created_at]).where(and_(
+            Message.conversation_id == ConversationMember.conversation_id, Message.visible_to(user))).order_by(
+            Message.id.desc()).limit(1)
+        ConversationMember.query.filter(and_(ConversationMember.user_id == user.id,
+                                             ConversationMember.conversation_id.in_(conversation_ids))).update({
+            ConversationMember.last_message_id: last_message.with_only_columns([Message.id]).as_scalar(),
+            ConversationMember.last_message_at: last_message.with_only_columns([Message.created_at]).as_scalar(),
+        }, synchronize_session=False)
+
+
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (db.Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(128))
     body = db.Column(db.Text)
@@ -73,10 +197,103 @@ class Message(db.Model):
     created_at = db.Column(db.DateTime, index=True, default=func.now())
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'))
     author_deleted = db.Column(db.Boolean, index=True, default=False)
     receiver_deleted = db.Column(db.Boolean, index=True, default=False)
     unread = db.Column(db.Boolean, index=True, default=True)
 
+    def mark_read(self, user):
+        if self.receiver_id == user.id and self.unread:
+            self.unread = False
+            db.session.add(self)
+            ConversationMember.query.filter_by(conversation_id=self.conversation_id, user_id=user.id).update(
+                {ConversationMember.unread_count: ConversationMember.unread_count - 1}, synchronize_session=False)
+
+    def delete_for(self, user):
+        unread = 0
+        if self.receiver_id == user.id and not self.receiver_deleted:
+            self.receiver_deleted = True
+            unread = 1 if self.unread else 0
+        elif self.author_id == user.id and not self.author_deleted:
+            self.author_deleted = True
+        else:
+            return
+        db.session.add(self)
+        member = ConversationMember.query.filter_by(conversation_id=self.conversation_id, user_id=user.id)
+        member.update({
+            ConversationMember.messages_count: ConversationMember.messages_count - 1,
+            ConversationMember.unread_count: ConversationMember.unread_count - unread,
+        }, synchronize_session=False)
+        if member.with_entities(ConversationMember.last_message_id).scalar() == self.id:
+            last_message = Message.query.filter(and_(Message.conversation_id == self.conversation_id,
+                                                     Message.visible_to(user))).order_by(Message.id.desc()).first()
+            member.update({
+                ConversationMember.last_message_id: last_message.id if last_message else None,
+                ConversationMember.last_message_at: last_message.created_at if last_message else None,
+            }, synchronize_session=False)
+
+    @staticmethod
+    def visible_to(user):
+        return or_(and_(Message.author_id == user.id, Message.author_deleted == False),
+                   and_(Message.receiver_id == user.id, Message.receiver_deleted == False))
+
+    @staticmethod
+    def _update_bulk(user, query, values, deleted):
+        """Updates messages of the query with one UPDATE and subtracts changes from counters of conversations.
+
+        Changes are counted per conversation by the same query just before the update, so the cost is linear in
+        the number of changed messages instead of recounting whole conversations.
+        """
+        unread = case([(and_(Message.receiver_id == user.id, Message.receiver_deleted == False,
+                             Message.unread == True), 1)], else_=0)
+        changes = query.with_entities(Message.conversation_id, func.count(Message.id), func.sum(unread)).group_by(
+            Message.conversation_id).all()
+        count = query.update(values, synchronize_session=False)
+        if changes:
+            members = ConversationMember.__table__
+            db.session.execute(members.update().where(and_(
+                members.c.conversation_id == db.bindparam('member_conversation_id'),
+                members.c.user_id == user.id)).values(
+                messages_count=members.c.messages_count - db.bindparam('deleted_count'),
+                unread_count=members.c.unread_count - db.bindparam('read_count')),
+                [dict(member_conversation_id=conversation_id, deleted_count=messages_count if deleted else 0,
+                      read_count=unread_count or 0) for conversation_id, messages_count, unread_count in changes])
+            if deleted:
+                ConversationMember.refresh_last_message(user, [conversation_id for conversation_id, _, _ in changes])
+        return count
+
+    @staticmethod
+    def mark_read_bulk(user, message_ids=None):
+        """Marks the given or all received messages as read with one UPDATE, returns the number of messages."""
+        query = Message.query.filter(
+            and_(Message.receiver_id == user.id, Message.receiver_deleted == False, Message.unread == True))
+        if message_ids is not None:
+            return Message._update_bulk(user, query.filter(Message.id.in_(message_ids)), {Message.unread: False},
+                                        deleted=False)
+        count = query.update({Message.unread: False}, synchronize_session=False)
+        if count:
+            ConversationMember.query.filter(and_(ConversationMember.user_id == user.id,
+                                                 ConversationMember.unread_count > 0)).update(
+                {ConversationMember.unread_count: 0}, synchronize_session=False)
+        return count
+
+    @staticmethod
+    def delete_bulk(user, direction, message_ids=None):
+        """Deletes the given or all received or sent messages for the user with one UPDATE.
+
+        Returns the number of messages.
+        """
+        if direction == 'received':
+            user_id, deleted = Message.receiver_id, Message.receiver_deleted
+        elif direction == 'sent':
+            user_id, deleted = Message.author_id, Message.author_deleted
+        else:
+            raise ValueError('Unknown direction: {}'.format(direction))
+        query = Message.query.filter(and_(user_id == user.id, deleted == False))
+        if message_ids is not None:
+            query = query.filter(Message.id.in_(message_ids))
+        return Message._update_bulk(user, query, {deleted: True}, deleted=True)
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -130,7 +347,7 @@ class User(UserMixin, db.Model):
         s = Serializer(current_app.secret_key, expiration)
         data = {'user_id': self.id}
         data.update(kwargs)
-        return s.dumps(data)
+        return s.dumps(data).decode('utf-8')
 
     def confirm_token(self, token):
         s = Serializer(current_app.secret_key)
@@ -185,9 +402,8 @@ class User(UserMixin, db.Model):
         db.session.add(self)
 
     def gravatar(self, size=256, default='identicon', rating='g'):
-        hash = hashlib.md5(self.email.encode('utf-8')).hexdigest()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-            url=current_app.config['BASE_GRAVATAR_URL'], hash=hash, size=size, default=default, rating=rating)
+        return gravatar_url(self.email, size=size, default=default, rating=rating,
+                            base_url=current_app.config['BASE_GRAVATAR_URL'])
 
     def get_vote(self, topic):
         vote = PollAnswer.query.with_entities(PollAnswer.body, PollVote.id).join(
@@ -196,8 +412,8 @@ class User(UserMixin, db.Model):
         return vote
 
     def get_unread_messages_count(self):
-        return db.session.query(func.count(Message.id)).filter(
-            and_(Message.receiver_id == self.id, Message.unread == True, Message.receiver_deleted == False,)).scalar()
+        return db.session.query(func.coalesce(func.sum(ConversationMember.unread_count), 0)).filter(
+            ConversationMember.user_id == self.id).scalar()
 
     def __repr__(self):
         return '<User %r>' % self.username
@@ -241,6 +457,8 @@ class Topic(db.Model):
     poll_answers = db.relationship('PollAnswer', backref='topic', lazy='dynamic')
     poll_votes = db.relationship('PollVote', backref='topic', lazy='dynamic')
     interest = db.Column(db.Integer, default=0)
+    # Sequence number of the last comment, comments are numbered 1, 2, ... in the order of creation.
+    last_comment_seq = db.Column(db.Integer, default=0)
 
     @property
     def comments_count(self):
@@ -267,16 +485,54 @@ class Topic(db.Model):
             db.session.add(PollAnswer(topic_id=self.id, body=answer))
 
     def add_vote(self, user, answer):
-        new_vote = PollVote(topic_id=self.id, poll_answer_id=answer.id, author_id=user.id)
-        db.session.add(new_vote)
-        self.interest += 1
+        # Interest is not touched here, it is recalculated by refresh_topics_interest task.
+        return insert_or_ignore(PollVote.__table__, topic_id=self.id, poll_answer_id=answer.id, author_id=user.id,
+                                deleted=False)
+
+    @staticmethod
+    def refresh_interest(topic_ids=None):
+        comments_count = select([func.count(Comment.id)]).where(Comment.topic_id == Topic.id).as_scalar()
+        votes_count = select([func.count(PollVote.id)]).where(PollVote.topic_id == Topic.id).as_scalar()
+        query = Topic.query if topic_ids is None else Topic.query.filter(Topic.id.in_(topic_ids))
+        query.update({Topic.interest: comments_count + votes_count}, synchronize_session=False)
+
+    @staticmethod
+    def next_comment_seq(connection, topic_id):
+        """Increments the sequence of comments of the topic, the row of the topic is locked until the commit."""
+        topics = Topic.__table__
+        connection.execute(topics.update().where(topics.c.id == topic_id).values(
+            last_comment_seq=func.coalesce(topics.c.last_comment_seq, 0) + 1))
+        return connection.execute(select([topics.c.last_comment_seq]).where(topics.c.id == topic_id)).scalar()
+
+    @staticmethod
+    def refresh_comments_seq(topic_ids=None):
+        """Sets sequences of comments of topics after comments are inserted with seq in bulk."""
+        last_seq = select([func.coalesce(func.max(Comment.seq), 0)]).where(Comment.topic_id == Topic.id).as_scalar()
+        query = Topic.query if topic_ids is None else Topic.query.filter(Topic.id.in_(topic_ids))
+        query.update({Topic.last_comment_seq: last_seq}, synchronize_session=False)
+
+    @staticmethod
+    def comments_page(seq):
+        """Page of the comment with the sequence number, pages are ranges of numbers of comments."""
+        return max((seq - 1) // current_app.config['COMMENTS_PER_PAGE'] + 1, 1)
+
+    @property
+    def last_comments_page(self):
+        return Topic.comments_page(self.last_comment_seq or 0)
+
+    def delete(self, user):
+        """Marks the topic as deleted, rows of the topic are deleted by the returned job of a Celery task."""
+        self.deleted = True
+        self.updated_at = datetime.utcnow()
         db.session.add(self)
+        job = DeletionJob(target='topic', target_id=self.id, title=self.title, author_id=user.id,
+                          created_at=datetime.utcnow())
+        db.session.add(job)
+        return job
 
     def add_comment(self, user, comment):
         new_comment = Comment(body=comment, author_id=user.id, topic_id=self.id)
         db.session.add(new_comment)
-        self.interest += 1
-        db.session.add(self)
 
 
 class TopicGroup(db.Model):
@@ -313,14 +569,19 @@ class TopicGroup(db.Model):
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    # New comments of a topic are read by a range of ids and pages of a topic by a range of seq.
+    __table_args__ = (db.Index('ix_comments_topic_id_id', 'topic_id', 'id'),
+                      db.Index('ix_comments_topic_id_seq', 'topic_id', 'seq', unique=True))
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     created_at = db.Column(db.DateTime, index=True, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now())
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), index=True)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'))
     deleted = db.Column(db.Boolean, index=True, default=False)
+    # Number of the comment in the topic, kept when comments are deleted, so links to pages don't move.
+    seq = db.Column(db.Integer)
 
 
 class PollAnswer(db.Model):
@@ -334,6 +595,7 @@ class PollAnswer(db.Model):
 
 class PollVote(db.Model):
     __tablename__ = 'polls_votes'
+    __table_args__ = (db.UniqueConstraint('topic_id', 'author_id', name='uq_polls_votes_topic_id_author_id'),)
     id = db.Column(db.Integer, primary_key=True)
     topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), index=True)
     poll_answer_id = db.Column(db.Integer, db.ForeignKey('polls_answers.id'), index=True)
@@ -348,6 +610,48 @@ class Favorite(db.Model):
     topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), primary_key=True, index=True)
 
 
+class DeletionJob(db.Model):
+    """Soft deletion of rows which depend on a deleted object, done by a Celery task in batches."""
+    __tablename__ = 'deletion_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    target = db.Column(db.String(16))
+    target_id = db.Column(db.Integer)
+    title = db.Column(db.String(128))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    total = db.Column(db.Integer)
+    processed = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, index=True, default=func.now())
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def percent(self):
+        if self.finished_at or self.total == 0:
+            return 100
+        if not self.total:
+            return 0
+        return min(self.processed * 100 // self.total, 100)
+
+
+class Watermark(db.Model):
+    """The last id processed by a periodic task."""
+    __tablename__ = 'watermarks'
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+
+    @staticmethod
+    def create(name, value):
+        """Creates the watermark unless it exists."""
+        insert_or_ignore(Watermark.__table__, name=name, value=value, updated_at=datetime.utcnow())
+
+    @staticmethod
+    def acquire(name, default=0):
+        """Returns the watermark locked until the end of the transaction, creates it with the default value."""
+        Watermark.create(name, default)
+        return Watermark.query.filter_by(name=name).with_for_update().one()
+
+
 db.event.listen(Message.body, 'set', on_changed_body_set_body_html)
 db.event.listen(Topic.body, 'set', on_changed_body_set_body_html)
 db.event.listen(Comment.body, 'set', on_changed_body_set_body_html)
+db.event.listen(Comment, 'before_insert', on_insert_comment_set_seq)
@@ -0,0 +1,47 @@
+"""Startup of processes: phases of create_app and preloading of the web app before gunicorn forks workers.
+
+Modules used by few requests (Markdown and bleach render bodies only when they change) are imported on first use,
+so Celery workers and commands don't pay for them. gunicorn --preload (see gunicorn.conf.py) creates the app once in
+the master, preload imports those modules and loads templates there, then forked workers share them through
+copy-on-write instead of paying for them on first requests. Connections of the SQLAlchemy pool can't be shared by
+processes, so the engine is disposed in the master before forking and in every worker after it.
+"""
+import gc
+import importlib
+import time
+from collections import OrderedDict
+
+LAZY_MODULES = ['bleach', 'markdown', 'markdown.extensions.tables', 'markdown.extensions.nl2br',
+                'markdown.extensions.sane_lists', 'markdown.extensions.attr_list']
+
+
+class PhaseTimer(object):
+    """Milliseconds spent in phases, every call ends the phase started by the previous one."""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.started = time.time()
+
+    def __call__(self, name):
+        now = time.time()
+        self.phases[name] = round((now - self.started) * 1000, 2)
+        self.started = now
+
+
+def preload(app):
+    """Imports lazily imported modules and loads templates, to be called before forking workers."""
+    from .templating import load_templates
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+    load_templates(app)
+    dispose_engine(app)
+    # Objects created so far are shared by workers, collections in a worker would copy pages with them.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def dispose_engine(app):
+    """Closes connections of the pool of the app, a forked process opens its own ones."""
+    from .app import db
+    db.get_engine(app).dispose()
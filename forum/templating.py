@@ -0,0 +1,31 @@
+"""Compiled templates reused by processes.
+
+Jinja compiles a template to Python code on its first render in every process. With TEMPLATE_CACHE_DIR the
+compiled code is stored there (`python manage.py compile_templates` fills it at build time) and new processes
+only unmarshal it. With PRELOAD_TEMPLATES every template is loaded when the app is created, so workers forked by
+gunicorn --preload share the compiled templates of the master instead of compiling them on first requests.
+"""
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_app(app, preload=True):
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by another process
+                pass
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if preload and app.config['PRELOAD_TEMPLATES']:
+        load_templates(app)
+
+
+def load_templates(app):
+    """Loads every template of the app and its blueprints into the environment, returns their names."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
@@ -0,0 +1,114 @@
+"""Read-only transactions of requests of safe methods.
+
+GET, HEAD and OPTIONS requests only read, so with READ_ONLY_SAFE_REQUESTS their transaction is read-only. A
+statement writing to DB or changes left in the session are logged and the transaction is rolled back; in tests and
+with READ_ONLY_STRICT the statement raises ReadOnlyError and PostgreSQL begins the transaction with SET TRANSACTION
+READ ONLY, so such views fail instead of losing writes quietly. Writes such requests make on the side, like
+last_seen of the user or messages marked read by viewing them, are queued by defer_write and run in a transaction
+of their own after the response is rendered. Views whose purpose is the write, like confirmations of emails by
+links, are marked with read_write.
+"""
+import logging
+import re
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .app import db
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+WRITE_STATEMENT_RE = re.compile(r'\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+
+
+class ReadOnlyError(Exception):
+    pass
+
+
+def read_write(f):
+    """Marks the view to run in a writable transaction even for requests of safe methods."""
+    f.read_write = True
+    return f
+
+
+def is_read_only():
+    return has_request_context() and g.get('read_only', False)
+
+
+def is_strict():
+    return current_app.testing or current_app.config['READ_ONLY_STRICT']
+
+
+def has_changes(session):
+    return bool(session.new or session.deleted or any(session.is_modified(obj) for obj in session.dirty))
+
+
+def defer_write(func, *args, **kwargs):
+    """Calls func now, or after the read-only transaction of the current request ends and returns True."""
+    if is_read_only():
+        g.deferred_writes.append((func, args, kwargs))
+        return True
+    func(*args, **kwargs)
+    return False
+
+
+def begin_request():
+    view = current_app.view_functions.get(request.endpoint)
+    g.read_only = (current_app.config['READ_ONLY_SAFE_REQUESTS'] and request.method in SAFE_METHODS and
+                   not getattr(view, 'read_write', False))
+    g.deferred_writes = []
+    g.read_only_violated = False
+
+
+def end_request(exc):
+    if not g.get('read_only', False):
+        return
+    writes = g.pop('deferred_writes', [])
+    try:
+        if exc is None and not is_strict() and (g.pop('read_only_violated', False) or has_changes(db.session)):
+            logger.error('%s %s writes in a read-only transaction, it is rolled back', request.method, request.path)
+            db.session.rollback()
+        elif exc is None:
+            # In the strict mode changes left in the session are flushed while the transaction is still read-only,
+            # so they raise too.
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        g.read_only = False
+    if exc is not None or not writes:
+        return
+    try:
+        for func, args, kwargs in writes:
+            func(*args, **kwargs)
+        db.session.commit()
+    except Exception:
+        # The response is ready, writes on the side don't fail it.
+        logger.exception('Deferred writes of %s %s failed', request.method, request.path)
+        db.session.rollback()
+
+
+@event.listens_for(Session, 'after_begin')
+def set_transaction_read_only(session, transaction, connection):
+    if connection.dialect.name == 'postgresql' and is_read_only() and is_strict():
+        connection.execute('SET TRANSACTION READ ONLY')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def check_read_only(conn, cursor, statement, parameters, context, executemany):
+    if WRITE_STATEMENT_RE.match(statement) and is_read_only():
+        message = '{} {} writes in a read-only transaction: {}'.format(
+            request.method, request.endpoint, statement.split('\n', 1)[0])
+        if is_strict():
+            raise ReadOnlyError(message)
+        logger.error(message)
+        g.read_only_violated = True
+
+
+def init_app(app):
+    app.before_request(begin_request)
+    app.teardown_request(end_request)
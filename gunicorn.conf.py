@@ -0,0 +1,25 @@
+"""Settings of gunicorn for the web process, see forum/startup.py.
+
+The app is created once in the master and shared by workers, WEB_PRELOAD=0 creates it in every worker.
+WEB_WORKER_CLASS=gevent or eventlet (installed separately) serves new comments of topics by streams and long polls
+instead of periodic polls, see LIVE_ASYNC of forum/config.py.
+"""
+import os
+
+preload_app = os.environ.get('WEB_PRELOAD', '1') != '0'
+if os.environ.get('WEB_WORKER_CLASS'):
+    worker_class = os.environ['WEB_WORKER_CLASS']
+
+
+def when_ready(server):
+    app = server.app.callable
+    if app is not None:
+        from forum.startup import preload
+        preload(app)
+
+
+def post_fork(server, worker):
+    app = server.app.callable
+    if app is not None:
+        from forum.startup import dispose_engine
+        dispose_engine(app)
@@ -1,20 +1,32 @@
 #!/usr/bin/env python
+import sys
 
-from flask_dbshell import DbShell
+from flask import current_app
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager, Shell
 
 from forum.app import create_app, db
-from forum.models import User, Role, Permission, Topic, TopicGroup, Comment, PollVote, PollAnswer, Message
 
-app = create_app()
-manager = Manager(app)
-migrate = Migrate(app, db)
+# Commands run by the app of the web process, others get it without parts serving only HTTP requests.
+WEB_COMMANDS = ['runserver', 'shell', 'compile_templates']
+migrate = Migrate(db=db)
+
+
+def make_app():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    app = create_app(web=command in WEB_COMMANDS)
+    migrate.init_app(app, db)
+    return app
+
+
+manager = Manager(make_app)
 
 
 def make_shell_context():
-    return dict(app=app, db=db, User=User, Role=Role, Permission=Permission, Topic=Topic, TopicGroup=TopicGroup,
-                Comment=Comment, PollVote=PollVote, PollAnswer=PollAnswer, Message=Message)
+    from forum.models import User, Role, Permission, Topic, TopicGroup, Comment, PollVote, PollAnswer, Message
+    return dict(app=current_app._get_current_object(), db=db, User=User, Role=Role, Permission=Permission,
+                Topic=Topic, TopicGroup=TopicGroup, Comment=Comment, PollVote=PollVote, PollAnswer=PollAnswer,
+                Message=Message)
 
 
 manager.add_command('shell', Shell(make_context=make_shell_context))
@@ -24,8 +36,9 @@ manager.add_command('db', MigrateCommand)
 @manager.command
 def dbshell():
     """Run DB shell."""
+    from flask_dbshell import DbShell
     # ~/.pgpass should exist
-    shell = DbShell(url=app.config['SQLALCHEMY_DATABASE_URI'])
+    shell = DbShell(url=current_app.config['SQLALCHEMY_DATABASE_URI'])
     shell.run_shell()
 
 
@@ -40,21 +53,93 @@ def test():
 @manager.command
 def insert_initial_data():
     """Adds initial data to database."""
+    from forum.models import Role, TopicGroup
     Role.insert_roles()
     TopicGroup.insert_root_topic_group()
 
 
+@manager.option('topic_group_id', type=int, help='Id of the topic group, 0 for the whole forum')
+@manager.option('-o', '--output', default=None, help='File to write, standard output by default')
+@manager.option('-z', '--gzip', action='store_true', default=False, help='Compress with gzip')
+@manager.option('-a', '--after', default=None, help='Position <type>:<id> of the last exported row to continue after')
+@manager.option('-b', '--batch-size', type=int, default=1000, help='Rows fetched from DB at once')
+def export(topic_group_id, output, gzip, after, batch_size):
+    """Exports a topic group with its subgroups, topics, comments and polls as NDJSON."""
+    import time
+    from gzip import GzipFile
+    from forum.export import export_topic_group
+    # Continuing an interrupted export appends to the file, a gzip file of several members is read as one.
+    out = open(output, 'ab' if after else 'wb') if output else getattr(sys.stdout, 'buffer', sys.stdout)
+    f = GzipFile(fileobj=out, mode='wb') if gzip else out
+    started, count = time.time(), 0
+    try:
+        for line in export_topic_group(topic_group_id, after=after, batch_size=batch_size):
+            f.write(line.encode('utf-8'))
+            count += 1
+    finally:
+        if gzip:
+            f.close()
+        if output:
+            out.close()
+        elapsed = time.time() - started
+        sys.stderr.write('{} rows in {:.1f} s, {:.0f} rows/s\n'.format(count, elapsed, count / max(elapsed, 1e-6)))
+
+
+@manager.option('path', help='NDJSON file (.gz is gunzipped) or directory of CSV files <type>.csv')
+@manager.option('-g', '--topic-group-id', type=int, default=None, help='Topic group to import into, root by default')
+@manager.option('-p', '--processes', type=int, default=None, help='Processes to render body_html')
+@manager.option('-b', '--batch-size', type=int, default=5000, help='Rows written to DB at once')
+@manager.option('--trust-html', action='store_true', default=False,
+                help='Keep body_html of the dump, only for dumps exported by this forum')
+def import_dump(path, topic_group_id, processes, batch_size, trust_html):
+    """Imports users, topic groups, topics, polls, comments and messages of a dump."""
+    from utils.importer import import_dump
+    import_dump(path, topic_group_id=topic_group_id, processes=processes, batch_size=batch_size,
+                trust_html=trust_html)
+
+
+@manager.option('-t', '--theme', default=None, help='Theme to collect, THEME by default, "all" for every theme')
+def collect_static(theme):
+    """Writes fingerprinted and precompressed static files of the theme to ASSETS_DIR."""
+    from forum.assets import collect, theme_names
+    app = current_app
+    themes = theme_names(app.static_folder) if theme == 'all' else [theme or app.config['THEME']]
+    for theme in themes:
+        manifest, sizes = collect(app.static_folder, app.config['ASSETS_DIR'], theme)
+        for path in sorted(sizes):
+            print('{:<50} {}'.format(manifest[path], '  '.join(
+                '{} {}'.format(variant, size) for variant, size in sizes[path])))
+        print('{} files of theme {} collected to {}'.format(len(manifest), theme, app.config['ASSETS_DIR']))
+
+
 @manager.command
-def insert_fake_data():
+def compile_templates():
+    """Compiles all templates to TEMPLATE_CACHE_DIR."""
+    import time
+    from forum.templating import load_templates
+    if not current_app.config['TEMPLATE_CACHE_DIR']:
+        raise SystemExit('TEMPLATE_CACHE_DIR is not set')
+    started = time.time()
+    names = load_templates(current_app)
+    print('{} templates compiled to {} in {:.2f} s'.format(len(names), current_app.config['TEMPLATE_CACHE_DIR'],
+                                                          time.time() - started))
+
+
+@manager.option('-l', '--limit', type=int, default=None, help='Maximum number of tasks to dispatch')
+def replay_spooled_tasks(limit):
+    """Dispatches background tasks spooled to TASK_SPOOL_DIR."""
+    from forum.dispatch import replay_spool
+    print('{} tasks dispatched'.format(replay_spool(limit)))
+
+
+@manager.option('-s', '--scale', type=float, default=1.0, help='Scale factor, 1 gives 100 users and 1000 comments')
+@manager.option('--seed', type=int, default=0, help='Seed of random generator')
+@manager.option('--skew', type=float, default=1.1, help='Zipf skew of users activity and topics popularity')
+@manager.option('-p', '--processes', type=int, default=None, help='Processes to render body_html')
+def insert_fake_data(scale, seed, skew, processes):
     """Adds fake data to database."""
     from utils import data_generator
-    data_generator.generate_fake_users()
-    data_generator.generate_fake_topic_groups()
-    data_generator.generate_fake_topics()
-    data_generator.generate_fake_comments()
-    data_generator.generate_fake_messages()
-    data_generator.generate_fake_polls()
-    data_generator.generate_fake_votes()
+    data_generator.generate_fake_data(scale=scale, seed=seed, skew=skew, processes=processes)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+import json
+import unittest
+
+from forum.api_1_0.views import encode_cursor
+from forum.app import create_app, db
+from forum.models import User, Role, Topic, TopicGroup, Comment, PollAnswer
+
+
+class APITestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        self.client = self.app.test_client()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True, about='secret')
+        topics = [Topic(title='topic {}'.format(i), body='body', author=u, group_id=0) for i in range(5)]
+        db.session.add_all([u] + topics)
+        db.session.commit()
+        db.session.add_all([Comment(body='comment', body_html='<p>comment</p>', topic=topics[0], author=u)
+                            for _ in range(3)])
+        topics[1].poll = 'question?'
+        db.session.add_all([PollAnswer(topic_id=topics[1].id, body=body) for body in ('yes', 'no')])
+        db.session.commit()
+        self.topic_ids = [t.id for t in topics]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_json(self, url, status=200):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.get_data(as_text=True))
+
+    def test_cursor_pagination(self):
+        data = self.get_json('/api/v1.0/topics?limit=2')
+        ids = [t['id'] for t in data['items']]
+        while data['next']:
+            data = self.get_json(data['next'])
+            ids.extend(t['id'] for t in data['items'])
+        self.assertEqual(ids, sorted(self.topic_ids, reverse=True))
+        self.get_json('/api/v1.0/topics?cursor=garbage', status=400)
+        for values in (['x', 1], [True, 1], [1.5, 1], [1]):
+            self.get_json('/api/v1.0/topics?order=hot&cursor=' + encode_cursor(values), status=400)
+
+    def test_cursor_pagination_by_two_keys(self):
+        for topic_id in self.topic_ids:
+            Topic.query.filter_by(id=topic_id).update({Topic.interest: topic_id % 2})
+        db.session.commit()
+        data = self.get_json('/api/v1.0/topics?order=hot&limit=2')
+        ids = [t['id'] for t in data['items']]
+        while data['next']:
+            data = self.get_json(data['next'])
+            ids.extend(t['id'] for t in data['items'])
+        self.assertEqual(ids, sorted(self.topic_ids, key=lambda topic_id: (topic_id % 2, topic_id), reverse=True))
+
+    def test_field_selection(self):
+        data = self.get_json('/api/v1.0/topics/{}?fields=title,comments_count'.format(self.topic_ids[0]))
+        self.assertEqual(data, dict(title='topic 0', comments_count=3))
+        data = self.get_json('/api/v1.0/topics/{}/comments'.format(self.topic_ids[0]))
+        self.assertEqual(len(data['items']), 3)
+        self.assertNotIn('about', data['items'][0])
+        self.get_json('/api/v1.0/topics?fields=password_hash', status=400)
+
+    def test_cache_headers(self):
+        response = self.client.get('/api/v1.0/topic_groups/0')
+        self.assertIn('public', response.headers['Cache-Control'])
+        self.assertEqual(len(json.loads(response.get_data(as_text=True))['topic_groups']), 0)
+        response = self.client.get('/api/v1.0/topic_groups/0', headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_permissions(self):
+        Topic.query.filter_by(id=self.topic_ids[2]).update({Topic.deleted: True})
+        db.session.commit()
+        self.get_json('/api/v1.0/topics/{}'.format(self.topic_ids[2]), status=404)
+        # Anonymous readers see answers like on the topic page.
+        data = self.get_json('/api/v1.0/topics/{}/poll'.format(self.topic_ids[1]))
+        self.assertEqual([a['answer'] for a in data['answers']], ['yes', 'no'])
+
+        self.client.post('/auth/login', data=dict(email='john@example.com', password='cat'))
+        data = self.get_json('/api/v1.0/topics/{}/poll'.format(self.topic_ids[1]))
+        self.assertEqual([a['answer'] for a in data['answers']], ['yes', 'no'])
+        self.assertIsNone(data['vote'])
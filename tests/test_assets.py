@@ -0,0 +1,50 @@
+import gzip
+import io
+import re
+import shutil
+import tempfile
+import unittest
+
+from forum import assets
+from forum.app import create_app
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.directory = tempfile.mkdtemp()
+        self.app.config['ASSETS_DIR'] = self.directory
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_collect(self):
+        theme = self.app.config['THEME']
+        manifest, _ = assets.collect(self.app.static_folder, self.directory, theme)
+        self.assertNotIn('css/{}/styles.css'.format('violet' if theme == 'gray' else 'gray'), manifest)
+        bootstrap = manifest['css/{}/bootstrap.css'.format(theme)]
+        with open('{}/{}'.format(self.directory, bootstrap), 'rb') as f:
+            css = f.read().decode('utf-8')
+        self.assertIn('url(../fonts/glyphicons-halflings-regular.', css)
+        self.assertNotIn('/*', css)
+        for font in re.findall(r'url\(\.\./(fonts/[^?#)]+)', css):
+            self.assertIn('css/' + font, manifest.values())
+
+    def test_serve(self):
+        assets.collect(self.app.static_folder, self.directory, self.app.config['THEME'])
+        assets.load_manifest(self.app)
+        html = self.client.get('/auth/login').get_data(as_text=True)
+        url = re.search(r'href="(/static/build/css/[^"]+/bootstrap\.[0-9a-f]{12}\.css)"', html).group(1)
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        css = gzip.GzipFile(fileobj=io.BytesIO(response.data)).read()
+
+        response = self.client.get(url)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, css)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code, 304)
@@ -0,0 +1,71 @@
+import unittest
+import zlib
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse, Response
+
+from forum.app import create_app
+from forum.compression import CompressionMiddleware
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = create_app().config
+
+    def client(self, response):
+        return Client(CompressionMiddleware(response, self.config), BaseResponse)
+
+    def test_negotiation(self):
+        body = b'<p>comment</p>' * 200
+        client = self.client(Response(body, mimetype='text/html', headers={'ETag': '"abc"', 'Vary': 'Cookie'}))
+        response = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Cookie, Accept-Encoding')
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+        self.assertNotIn('Content-Length', response.headers)
+        self.assertEqual(gunzip(response.data), body)
+
+        response = client.get('/', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['Vary'], 'Cookie, Accept-Encoding')
+        self.assertEqual(response.data, body)
+
+    def test_skipped(self):
+        for response in (Response(b'<p>short</p>', mimetype='text/html'),
+                         Response(b'\x89PNG' * 1000, mimetype='image/png'),
+                         Response(b'x' * 2000, mimetype='text/html', headers={'Cache-Control': 'no-transform'})):
+            data = response.get_data()
+            response = self.client(response).get('/', headers={'Accept-Encoding': 'gzip'})
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.data, data)
+
+    def test_streamed(self):
+        chunks_seen = []
+
+        def generate():
+            for i in range(5):
+                chunks_seen.append(i)
+                yield ('<p>chunk {}</p>'.format(i) * 100).encode()
+
+        client = self.client(Response(generate(), mimetype='text/html'))
+        response = client.get('/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        pieces = iter(response.response)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Every chunk of the application is decompressible as soon as it is sent.
+        first = decompressor.decompress(next(pieces))
+        self.assertTrue(first.startswith(b'<p>chunk 0</p>'))
+        self.assertEqual(chunks_seen, [0])
+        rest = b''.join(decompressor.decompress(piece) for piece in pieces)
+        self.assertEqual(first + rest, b''.join(('<p>chunk {}</p>'.format(i) * 100).encode() for i in range(5)))
+        response.close()
+
+    def test_pages(self):
+        client = create_app().test_client()
+        response = client.get('/auth/login', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'</html>', gunzip(response.data))
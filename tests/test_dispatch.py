@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from forum.app import celery, create_app
+from forum.dispatch import LocalExecutor, dispatch, queue_of, replay_spool, shutdown_executors
+
+calls = []
+release = threading.Event()
+
+
+@celery.task()
+def record(value):
+    calls.append(value)
+
+
+@celery.task()
+def wait_for_release():
+    release.wait(5)
+
+
+@celery.task()
+def fail():
+    raise ValueError('failure')
+
+
+class DispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(TASK_DISPATCH='local', TASK_EXECUTOR_THREADS={'default': 1}, TASK_QUEUE_SIZE=1,
+                               TASK_QUEUE_TIMEOUT=0.1, TASK_SPOOL_DIR=tempfile.mkdtemp())
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.executor = LocalExecutor(self.app)
+        del calls[:]
+        release.clear()
+
+    def tearDown(self):
+        release.set()
+        self.executor.shutdown(timeout=1)
+        shutil.rmtree(self.app.config['TASK_SPOOL_DIR'])
+        self.app_context.pop()
+
+    def spooled(self):
+        return os.listdir(self.app.config['TASK_SPOOL_DIR'])
+
+    def test_tasks_are_drained_on_shutdown(self):
+        self.executor.submit(record.name, [1], {})
+        self.executor.submit(record.name, [2], {}, countdown=60)
+        self.executor.shutdown(timeout=1)
+        self.assertEqual(sorted(calls), [1, 2])
+        self.assertEqual(self.spooled(), [])
+
+    def test_full_queue_spools_tasks(self):
+        self.executor.submit(wait_for_release.name, [], {})
+        self.executor.submit(wait_for_release.name, [], {})
+        self.executor.submit(record.name, [1], {})
+        self.assertEqual(len(self.spooled()), 1)
+        release.set()
+        self.executor.shutdown(timeout=1)
+        self.assertEqual(calls, [])
+        self.assertEqual(replay_spool(), 1)
+        self.assertEqual(self.spooled(), [])
+
+    def test_failed_task_is_spooled(self):
+        self.executor.submit(fail.name, [], {})
+        self.executor.shutdown(timeout=1)
+        self.assertEqual(len(self.spooled()), 1)
+
+    def test_broker_is_down_in_fallback_mode(self):
+        self.app.config['TASK_DISPATCH'] = 'fallback'
+        eager, url = celery.conf.task_always_eager, celery.conf.broker_url
+        celery.conf.task_always_eager, celery.conf.broker_url = False, 'amqp://guest@127.0.0.1:1//'
+        try:
+            dispatch(record, [1])
+        finally:
+            celery.conf.task_always_eager, celery.conf.broker_url = eager, url
+        shutdown_executors(timeout=1)
+        self.assertEqual(calls, [1])
+
+    def test_mail_is_routed_apart_from_bulk_work(self):
+        self.assertEqual(queue_of('forum.celery_tasks.send_user_email'), 'mail')
+        self.assertEqual(queue_of('forum.celery_tasks.cascade_topic_deletion'), 'bulk')
+        self.assertEqual(queue_of(record.name), 'default')
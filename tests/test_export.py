@@ -0,0 +1,60 @@
+import json
+import unittest
+import zlib
+
+from forum.app import create_app, db
+from forum.export import export_topic_group, gzipped
+from forum.models import User, Role, Topic, TopicGroup, Comment, PollAnswer, PollVote
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.com', username='susan', password='dog')
+        group = TopicGroup(title='group', group_id=0, author=u1)
+        other = TopicGroup(title='other', group_id=0, author=u1)
+        db.session.add_all([u1, u2, group, other])
+        db.session.commit()
+        subgroup = TopicGroup(title='subgroup', group_id=group.id, author=u1)
+        db.session.add(subgroup)
+        db.session.commit()
+        topics = [Topic(title='topic', body='body', group_id=group_id, author=u1, poll='question?')
+                  for group_id in (group.id, subgroup.id, other.id)]
+        db.session.add_all(topics)
+        db.session.commit()
+        for topic in topics:
+            answer = PollAnswer(topic_id=topic.id, body='yes')
+            db.session.add(answer)
+            db.session.commit()
+            db.session.add(PollVote(topic_id=topic.id, poll_answer_id=answer.id, author_id=u1.id))
+            db.session.add_all([Comment(body='comment', topic=topic, author=u2) for _ in range(3)])
+        db.session.commit()
+        self.group_id, self.other_topic_id = group.id, topics[2].id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_export_subtree(self):
+        rows = [json.loads(line) for line in export_topic_group(self.group_id, batch_size=2)]
+        counts = {}
+        for row in rows:
+            counts[row['type']] = counts.get(row['type'], 0) + 1
+        self.assertEqual(counts, dict(user=2, topic_group=2, topic=2, poll_answer=2, poll_vote=2, comment=6))
+        self.assertNotIn(self.other_topic_id, [row['id'] for row in rows if row['type'] == 'topic'])
+        self.assertNotIn('password_hash', rows[0])
+
+    def test_resume_and_gzip(self):
+        lines = list(export_topic_group(self.group_id))
+        last = json.loads(lines[9])
+        resumed = list(export_topic_group(self.group_id, after='{}:{}'.format(last['type'], last['id'])))
+        self.assertEqual(resumed, lines[10:])
+        data = zlib.decompress(b''.join(gzipped(iter(lines))), zlib.MAX_WBITS | 16)
+        self.assertEqual(data.decode('utf-8'), ''.join(lines))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from six.moves.urllib.parse import urlparse
+
+from forum import images
+from forum.app import create_app
+from utils.http_server import LocalHTTPServer, PNG
+
+
+class ImageProxyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.directory = tempfile.mkdtemp()
+        self.app.config.update(IMAGE_PROXY=True, IMAGE_CACHE_DIR=self.directory, IMAGE_PROXY_ALLOW_PRIVATE=True)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client()
+        self.server = LocalHTTPServer({'/avatar.png': ('image/png', PNG), '/page': ('text/html', b'<p>page</p>')})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.server.close()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def proxied(self, path, size):
+        with self.app.test_request_context():
+            url = images.proxied_url(self.server.url(path), size)
+        parsed = urlparse(url)
+        return parsed.path + '?' + parsed.query
+
+    def test_fetched_once(self):
+        url = self.proxied('/avatar.png', 80)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIn('max-age=2592000', response.headers['Cache-Control'])
+        etag = response.headers['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.proxied('/avatar.png', 36)).status_code, 200)
+        self.assertEqual(self.server.requests['/avatar.png'], 2)
+        # Both sizes of the 1x1 image are the same file.
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'objects'))), 1)
+
+    def test_rejected(self):
+        url = self.proxied('/avatar.png', 80)
+        self.assertEqual(self.client.get(url.replace('size=80', 'size=81')).status_code, 404)
+        self.assertEqual(self.client.get(url.replace('sig=', 'sig=0')).status_code, 403)
+        self.assertEqual(self.client.get(self.proxied('/page', 80)).status_code, 404)
+        self.assertEqual(self.client.get(self.proxied('/missing.png', 80)).status_code, 404)
+        self.app.config['IMAGE_PROXY_ALLOW_PRIVATE'] = False
+        self.assertEqual(self.client.get(self.proxied('/avatar.png', 64)).status_code, 404)
+        self.assertEqual(self.server.requests['/avatar.png'], 0)
+
+    def test_non_ascii_url(self):
+        self.server.files['/%D0%B0%D0%B2%D0%B0.png'] = ('image/png', PNG)
+        self.assertEqual(self.client.get(self.proxied(u'/ава.png', 80)).status_code, 200)
+        self.assertEqual(self.client.get(self.proxied(u'/нет.png', 80)).status_code, 404)
+        with self.app.test_request_context():
+            self.assertIn('sig=', images.proxy_images(u'<img src="http://example.com/ава.png">'))
+
+    def test_proxy_images(self):
+        with self.app.test_request_context():
+            html = images.proxy_images('<p><img alt="a" src="http://example.com/a.png?x=1&amp;y=2"></p>')
+            self.assertIn('src="/image?', html)
+            self.assertIn('&amp;sig=', html)
+            self.assertEqual(images.proxied_url('/static/a.png', 80), '/static/a.png')
+
+    def test_eviction(self):
+        cache = images.ImageCache(self.directory, 4000)
+        for i in range(3):
+            key = 'key{}'.format(i)
+            digest = cache.put(key, os.urandom(1000), 'image/png')
+            for path in cache._path('refs', key), cache._path('objects', digest):
+                os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        self.assertIsNotNone(cache.get('key0'))
+        cache.put('key3', os.urandom(1000), 'image/png')
+        self.assertIsNotNone(cache.get('key0'))
+        self.assertIsNone(cache.get('key1'))
+        self.assertIsNotNone(cache.get('key3'))
+        self.assertIsNotNone(cache.get('key2'))
+        self.assertLessEqual(cache.size, 4000)
+
+    @unittest.skipIf(images.Image is None, 'Pillow is not installed')
+    def test_resize(self):
+        import io
+        output = io.BytesIO()
+        images.Image.new('RGB', (400, 200)).save(output, 'JPEG')
+        self.server.files['/photo.jpg'] = ('image/jpeg', output.getvalue())
+        response = self.client.get(self.proxied('/photo.jpg', 80))
+        self.assertEqual(images.Image.open(io.BytesIO(response.data)).size, (80, 40))
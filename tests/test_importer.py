@@ -0,0 +1,99 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from forum.app import create_app, db
+from forum.export import export_topic_group
+from forum.models import User, Role, Topic, TopicGroup, Comment, PollAnswer, PollVote, ConversationMember, Message
+from utils.importer import import_dump
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_import_export(self):
+        u1 = User(email='john@example.com', username='john', password='cat')
+        u2 = User(email='susan@example.com', username='susan', password='dog')
+        group = TopicGroup(title='group', group_id=0, author=u1)
+        target = TopicGroup(title='target', group_id=0, author=u1)
+        db.session.add_all([u1, u2, group, target])
+        db.session.commit()
+        db.session.add(TopicGroup(title='subgroup', group_id=group.id, author=u1))
+        topic = Topic(title='topic', body='body', group_id=group.id, author=u1, poll='question?')
+        db.session.add(topic)
+        db.session.commit()
+        answer = PollAnswer(topic_id=topic.id, body='yes')
+        db.session.add_all([answer] + [Comment(body='*comment*', topic=topic, author=u2) for _ in range(3)])
+        db.session.commit()
+        db.session.add(PollVote(topic_id=topic.id, poll_answer_id=answer.id, author_id=u2.id))
+        db.session.commit()
+        path = self.write('dump.ndjson', u''.join(export_topic_group(group.id)))
+        topic_id, target_id = topic.id, target.id
+
+        import_dump(path, topic_group_id=target_id, processes=2, batch_size=2)
+        self.assertEqual(User.query.count(), 2)
+        imported_group = TopicGroup.query.filter_by(group_id=target_id).one()
+        self.assertEqual(TopicGroup.query.filter_by(group_id=imported_group.id, title='subgroup').count(), 1)
+        imported_topic = Topic.query.filter_by(group_id=imported_group.id).one()
+        self.assertEqual(imported_topic.interest, 4)
+        comments = Comment.query.filter_by(topic_id=imported_topic.id).all()
+        self.assertEqual([c.body_html for c in comments], ['<p><em>comment</em></p>'] * 3)
+        self.assertEqual(PollVote.query.filter_by(topic_id=imported_topic.id).one().poll_answer.topic_id,
+                         imported_topic.id)
+        self.assertNotEqual(imported_topic.id, topic_id)
+
+    def test_import_csv(self):
+        self.write('user.csv', u'id,username,email,created_at\n'
+                               u'7,john,john@example.com,2020-01-02T03:04:05\n'
+                               u'8,susan,susan@example.com,2020-01-02 03:04:05\n')
+        self.write('topic.csv', u'id,title,body,group_id,author_id,deleted\n'
+                                u'1,topic,<script>x</script>body,,7,false\n')
+        self.write('comment.csv', u'id,body,topic_id,author_id\n1,comment,1,8\n2,orphan,5,8\n')
+        self.write('message.csv', u'id,title,body,author_id,receiver_id,unread\n'
+                                  u'1,hi,hello,7,8,true\n2,re,hi,8,7,false\n3,hi,again,7,8,true\n')
+        import_dump(self.directory, processes=1, trust_html=True)
+
+        john = User.query.filter_by(username='john').one()
+        self.assertEqual(john.role, Role.query.filter_by(default=True).one())
+        self.assertTrue(john.avatar)
+        self.assertEqual(john.created_at.year, 2020)
+        topic = Topic.query.filter_by(title='topic').one()
+        self.assertEqual(topic.group_id, 0)
+        self.assertNotIn('<script>', topic.body_html)
+        self.assertEqual(Comment.query.count(), 1)
+        self.assertEqual(Message.query.count(), 3)
+        susan = User.query.filter_by(username='susan').one()
+        member = ConversationMember.query.filter_by(user_id=susan.id).one()
+        self.assertEqual((member.messages_count, member.unread_count), (3, 2))
+        self.assertEqual(member.last_message_id, Message.query.filter_by(body='again').one().id)
+
+    def test_types_out_of_order(self):
+        rows = [dict(type='user', id=1, username='john', email='john@example.com'),
+                dict(type='topic', id=1, title='topic', body='body', author_id=1),
+                dict(type='user', id=2, username='susan', email='susan@example.com')]
+        path = self.write('dump.ndjson', u''.join(u'{}\n'.format(json.dumps(row)) for row in rows))
+        with self.assertRaises(ValueError):
+            import_dump(path, processes=1)
+        self.assertEqual(User.query.count(), 0)
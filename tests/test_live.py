@@ -0,0 +1,78 @@
+import json
+import threading
+import time
+import unittest
+
+from forum.app import create_app, db
+from forum.live import feed
+from forum.models import User, Role, Topic, TopicGroup, Comment
+
+
+class LiveCommentsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        self.client = self.app.test_client()
+        u = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        self.topic = Topic(title='title', body='body', group_id=0, author=u)
+        db.session.add_all([u, self.topic])
+        db.session.commit()
+        self.comments = [Comment(body=str(i), body_html='<p>{}</p>'.format(i), topic=self.topic, author=u)
+                         for i in range(3)]
+        db.session.add_all(self.comments)
+        db.session.commit()
+        self.topic_id, self.comment_ids = self.topic.id, [c.id for c in self.comments]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_comments_since_id(self):
+        response = self.client.get('/topic/{}/comments?since={}'.format(self.topic_id, self.comment_ids[0]))
+        data = json.loads(response.get_data(as_text=True))
+        self.assertEqual([c['id'] for c in data['comments']], self.comment_ids[1:])
+        self.assertEqual(data['last_id'], self.comment_ids[-1])
+        self.assertEqual(data['comments'][0]['author'], 'john')
+
+        Topic.query.filter_by(id=self.topic_id).update({Topic.deleted: True})
+        db.session.commit()
+        response = self.client.get('/topic/{}/comments'.format(self.topic_id))
+        self.assertEqual(response.status_code, 404)
+
+    def test_watchers_share_poll(self):
+        self.app.config['LIVE_POLL_INTERVAL'] = 0.5
+        polls, results = feed.polls, []
+
+        def watch():
+            with self.app.test_request_context():
+                results.append(feed.wait(self.topic_id, self.comment_ids[-1], 1.2))
+
+        threads = [threading.Thread(target=watch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [[]] * 8)
+        # One poll per interval, not one per watcher.
+        self.assertLessEqual(feed.polls - polls, 4)
+
+    def test_polls_without_async_workers(self):
+        Comment.query.update({Comment.deleted: True})
+        db.session.commit()
+        html = self.client.get('/topic/{}'.format(self.topic_id)).get_data(as_text=True)
+        self.assertIn('data-since="{}"'.format(self.comment_ids[-1]), html)
+        self.assertNotIn('data-stream-url="', html)
+        self.assertEqual(self.client.get('/topic/{}/comments/stream'.format(self.topic_id)).status_code, 404)
+        started = time.time()
+        response = self.client.get('/topic/{}/comments?since={}&wait=5'.format(self.topic_id, self.comment_ids[-1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.time() - started, 1)
+
+        self.app.config['LIVE_ASYNC'] = True
+        html = self.client.get('/topic/{}'.format(self.topic_id)).get_data(as_text=True)
+        self.assertIn('data-stream-url="', html)
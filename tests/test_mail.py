@@ -0,0 +1,165 @@
+import smtplib
+import unittest
+
+from forum.app import create_app, db
+from forum.celery_tasks import (notify_admin_about_new_user, send_email, send_favorites_digest, send_favorites_digests,
+                                send_new_users_notice, send_user_email, smtp_connection)
+from forum.mailer import PooledConnection
+from forum.models import Role, User, Topic, Favorite
+from utils.smtp_server import LocalSMTPServer
+
+
+class MailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.server = LocalSMTPServer().__enter__()
+        state = self.app.extensions['mail']
+        state.server, state.port, state.use_tls, state.use_ssl, state.suppress = (
+            self.server.host, self.server.port, False, False, False)
+        state.username = state.password = None
+
+    def tearDown(self):
+        smtp_connection.close()
+        self.server.close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_emails_share_session(self):
+        send_email.apply(args=[['john@example.com'], 'subject', 'body', '<p>body</p>'])
+        for _ in range(3):
+            send_email.apply(args=[['susan@example.com'], 'subject', 'body', None])
+        self.assertTrue(self.server.wait_for(4))
+        self.assertEqual(self.server.sessions, 1)
+
+    def test_reconnect_after_disconnect(self):
+        send_email.apply(args=[['john@example.com'], 'subject', 'body', None])
+        smtp_connection.connection.host.sock.close()
+        send_email.apply(args=[['john@example.com'], 'subject', 'body', None])
+        self.assertTrue(self.server.wait_for(2))
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_transient_error_is_retried(self):
+        self.app.config['MAIL_RETRY_BACKOFF'] = 0
+        self.server.close()
+        self.app.config['MAIL_MAX_RETRIES'] = 2
+        result = send_email.apply(args=[['john@example.com'], 'subject', 'body', None])
+        self.assertTrue(result.failed())
+        self.assertIsInstance(result.result, (smtplib.SMTPException, IOError))
+
+    def test_failed_resend_closes_session(self):
+        closed = []
+
+        class Host(object):
+            def quit(self):
+                closed.append(True)
+
+        class Connection(object):
+            host = Host()
+
+            def send(self, message):
+                raise smtplib.SMTPServerDisconnected()
+
+        class Mail(object):
+            def connect(self):
+                return self
+
+            def __enter__(self):
+                return Connection()
+
+        connection = PooledConnection(Mail())
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            connection.send(None)
+        self.assertEqual(len(closed), 2)
+        self.assertIsNone(connection.connection)
+
+    def test_user_email_is_rendered_by_task(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_token()
+        send_user_email.apply(args=['confirm', u.id], kwargs=dict(token=token, locale='en'))
+        self.assertTrue(self.server.wait_for(1))
+        mailfrom, recipients, data = self.server.messages[0]
+        self.assertEqual(recipients, ['john@example.com'])
+        self.assertIn('/auth/confirm/' + token, data)
+
+    def register(self, email, username):
+        user = User(email=email, username=username, password='cat')
+        db.session.add(user)
+        db.session.commit()
+        notify_admin_about_new_user(user.id)
+        db.session.commit()
+
+    def test_new_users_are_coalesced(self):
+        self.app.config['NEW_USERS_NOTICE_INTERVAL'] = 3600
+        send_new_users_notice.apply()
+        self.register('john@example.com', 'john')
+        self.register('susan@example.com', 'susan')
+        send_new_users_notice.apply()
+        send_new_users_notice.apply()
+        self.assertTrue(self.server.wait_for(1))
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn('john@example.com', self.server.messages[0][2])
+        self.assertIn('susan@example.com', self.server.messages[0][2])
+
+    def test_users_registered_before_first_notice(self):
+        self.app.config['NEW_USERS_NOTICE_INTERVAL'] = 3600
+        db.session.add(User(email='early@example.com', username='early', password='cat'))
+        db.session.commit()
+        self.register('john@example.com', 'john')
+        send_new_users_notice.apply()
+        self.assertTrue(self.server.wait_for(1))
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn('john@example.com', self.server.messages[0][2])
+        self.assertNotIn('early@example.com', self.server.messages[0][2])
+
+    def test_favorites_digest(self):
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        u2 = User(email='susan@example.com', username='susan', password='dog', confirmed=True)
+        t = Topic(title='Favorite topic', body='body', author=u1)
+        db.session.add_all([u1, u2, t])
+        db.session.commit()
+        db.session.add(Favorite(user_id=u2.id, topic_id=t.id))
+        t.add_comment(u1, 'old comment')
+        db.session.commit()
+        send_favorites_digests.apply()
+        t.add_comment(u1, 'first')
+        t.add_comment(u1, 'second')
+        t.add_comment(u2, 'own comment')
+        db.session.commit()
+        self.assertEqual(send_favorites_digests.apply().result, 1)
+        self.assertEqual(send_favorites_digests.apply().result, 0)
+        self.assertTrue(self.server.wait_for(1))
+        mailfrom, recipients, data = self.server.messages[0]
+        self.assertEqual(recipients, ['susan@example.com'])
+        self.assertIn('Favorite topic: 2', data)
+
+    def test_digests_are_sent_in_batches(self):
+        self.app.config['MAIL_RETRY_BACKOFF'] = 0
+        users = [User(email='user{}@example.com'.format(i), username='user{}'.format(i), password='cat',
+                      confirmed=True) for i in range(3)]
+        t = Topic(title='Favorite topic', body='body', author=users[0])
+        db.session.add_all(users + [t])
+        db.session.commit()
+        send, sent = smtp_connection.send, []
+
+        def send_with_failure(message):
+            sent.append(message.recipients[0])
+            if len(sent) == 2:
+                raise smtplib.SMTPServerDisconnected()
+            send(message)
+
+        smtp_connection.send = send_with_failure
+        try:
+            send_favorites_digest.apply(args=[[[u.id, [[t.id, 2]]] for u in users]])
+        finally:
+            del smtp_connection.send
+        self.assertTrue(self.server.wait_for(3))
+        # The retry sends the digests which are not delivered yet.
+        self.assertEqual(sent, ['user0@example.com', 'user1@example.com', 'user1@example.com', 'user2@example.com'])
+        self.assertEqual(self.server.sessions, 1)
@@ -0,0 +1,95 @@
+import unittest
+
+from forum.app import create_app, db
+from forum.models import User, Role, Conversation, ConversationMember, Message
+
+
+class MessageModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u1 = User(email='john@example.com', username='john', password='cat')
+        self.u2 = User(email='susan@example.com', username='susan', password='dog')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def member(self, user):
+        return ConversationMember.query.filter_by(user_id=user.id).one()
+
+    def test_messages_share_conversation(self):
+        m1 = Conversation.send_message(self.u1.id, self.u2.id, 'hello', 'body')
+        m2 = Conversation.send_message(self.u2.id, self.u1.id, 're: hello', 'body')
+        db.session.commit()
+        self.assertEqual(Conversation.query.count(), 1)
+        self.assertEqual(m1.conversation_id, m2.conversation_id)
+        self.assertEqual(self.member(self.u1).interlocutor_id, self.u2.id)
+        self.assertEqual(self.member(self.u1).last_message_id, m2.id)
+        self.assertEqual(self.member(self.u1).messages_count, 2)
+        self.assertEqual(self.u1.get_unread_messages_count(), 1)
+        self.assertEqual(self.u2.get_unread_messages_count(), 1)
+
+    def test_counters_are_maintained(self):
+        m1 = Conversation.send_message(self.u1.id, self.u2.id, 'first', 'body')
+        m2 = Conversation.send_message(self.u1.id, self.u2.id, 'second', 'body')
+        Conversation.send_message(self.u1.id, self.u2.id, 'third', 'body')
+        db.session.commit()
+        self.assertEqual(self.u2.get_unread_messages_count(), 3)
+        m1.mark_read(self.u2)
+        m1.mark_read(self.u2)
+        m2.delete_for(self.u2)
+        m2.delete_for(self.u2)
+        db.session.commit()
+        self.assertEqual(self.u2.get_unread_messages_count(), 1)
+        self.assertEqual(self.member(self.u2).messages_count, 2)
+        self.assertEqual(self.member(self.u1).messages_count, 3)
+        m1.conversation.mark_read(self.u2)
+        db.session.commit()
+        self.assertEqual(self.u2.get_unread_messages_count(), 0)
+        self.assertEqual(Message.query.filter_by(unread=True).count(), 0)
+
+    def test_delete_last_message(self):
+        m1 = Conversation.send_message(self.u1.id, self.u2.id, 'first', 'body')
+        m2 = Conversation.send_message(self.u1.id, self.u2.id, 'second', 'body')
+        db.session.commit()
+        m1.delete_for(self.u2)
+        db.session.commit()
+        self.assertEqual(self.member(self.u2).last_message_id, m2.id)
+        m2.delete_for(self.u2)
+        db.session.commit()
+        self.assertEqual(self.member(self.u2).last_message_id, None)
+        self.assertEqual(self.member(self.u2).last_message_at, None)
+        m2.delete_for(self.u1)
+        db.session.commit()
+        self.assertEqual(self.member(self.u1).last_message_id, m1.id)
+        self.assertEqual(self.member(self.u1).last_message_at, m1.created_at)
+
+    def test_bulk_operations(self):
+        messages = [Conversation.send_message(self.u1.id, self.u2.id, 'title', 'body') for _ in range(4)]
+        reply = Conversation.send_message(self.u2.id, self.u1.id, 'reply', 'body')
+        db.session.commit()
+        self.assertEqual(Message.mark_read_bulk(self.u2, [messages[0].id, messages[1].id]), 2)
+        self.assertEqual(self.u2.get_unread_messages_count(), 2)
+        self.assertEqual(Message.delete_bulk(self.u2, 'received', [messages[1].id, messages[2].id]), 2)
+        self.assertEqual(self.u2.get_unread_messages_count(), 1)
+        self.assertEqual(self.member(self.u2).messages_count, 3)
+        self.assertEqual(Message.delete_bulk(self.u2, 'sent'), 1)
+        db.session.commit()
+        self.assertEqual(self.member(self.u2).last_message_id, messages[3].id)
+        self.assertEqual(self.member(self.u2).last_message_at, messages[3].created_at)
+        self.assertEqual(self.member(self.u1).last_message_id, reply.id)
+        self.assertEqual(Message.mark_read_bulk(self.u2), 1)
+        self.assertEqual(self.u2.get_unread_messages_count(), 0)
+        self.assertEqual(Message.delete_bulk(self.u2, 'received'), 2)
+        db.session.commit()
+        self.assertEqual(self.member(self.u2).messages_count, 0)
+        self.assertEqual(self.member(self.u2).last_message_id, None)
+        self.assertEqual(self.member(self.u1).messages_count, 5)
+        self.assertEqual(self.u1.get_unread_messages_count(), 1)
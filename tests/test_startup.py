@@ -0,0 +1,39 @@
+import sys
+import unittest
+
+from flask import url_for
+
+from forum.app import create_app
+from forum.startup import LAZY_MODULES, preload
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_phases(self):
+        app = create_app()
+        self.assertEqual(list(app.extensions['startup']), ['config', 'extensions', 'web', 'blueprints', 'templates'])
+        self.assertIsNot(getattr(app.wsgi_app, '__self__', None), app)
+
+        app = create_app(web=False)
+        self.assertEqual(list(app.extensions['startup']), ['config', 'extensions', 'blueprints', 'templates'])
+        self.assertIs(app.wsgi_app.__self__, app)  # without middlewares
+        with app.test_request_context():
+            self.assertEqual(url_for('main.topic', topic_id=1), '/topic/1')
+
+    def test_preload(self):
+        app = create_app()
+        app.jinja_env.cache.clear()
+        preload(app)
+        for name in LAZY_MODULES:
+            self.assertIn(name, sys.modules)
+        self.assertIn('base.html', [template.name for template in app.jinja_env.cache.values()])
+        self.assertEqual(app.test_client().get('/auth/login').status_code, 200)
+
+    def test_manage_app(self):
+        import manage
+        argv, sys.argv = sys.argv, ['manage.py', 'db', 'upgrade']
+        try:
+            app = manage.make_app()
+        finally:
+            sys.argv = argv
+        self.assertNotIn('web', app.extensions['startup'])
+        self.assertIs(app.extensions['migrate'].db, manage.db)
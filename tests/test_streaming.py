@@ -0,0 +1,61 @@
+import unittest
+
+from sqlalchemy import event
+
+from forum.app import create_app, db
+from forum.models import User, Role, Topic, TopicGroup, Comment, Conversation
+
+
+class StreamedPagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(STREAM_TEMPLATES=True, STREAM_TEMPLATES_CHUNK_SIZE=1024, WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        self.client = self.app.test_client()
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        u2 = User(email='susan@example.com', username='susan', password='dog', confirmed=True, name='Susan')
+        topic = Topic(title='title', body='body', group_id=0, author=u1, poll='question?')
+        db.session.add_all([u1, u2, topic])
+        db.session.commit()
+        db.session.add_all([Comment(body='comment {}'.format(i), topic=topic, author=u2) for i in range(3)])
+        Conversation.send_message(u2.id, u1.id, 'hello', 'body')
+        db.session.commit()
+        self.topic_id = topic.id
+        self.client.post('/auth/login', data=dict(email='john@example.com', password='cat'))
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.before_cursor_execute)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def before_cursor_execute(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_no_queries_while_streaming(self):
+        for url, text in (('/topic/{}'.format(self.topic_id), 'comment 2'),
+                          ('/latest?target=comments', 'Susan'),
+                          ('/messages', 'hello')):
+            response = self.client.get(url, buffered=False)
+            self.assertEqual(response.status_code, 200)
+            del self.statements[:]
+            chunks = []
+            for chunk in response.response:
+                # Deferred writes of the request run after the last chunk.
+                self.assertEqual(self.statements, [], url)
+                chunks.append(chunk)
+            response.close()
+            html = b''.join(chunks).decode('utf-8')
+            self.assertGreater(len(chunks), 1)
+            self.assertIn(text, html)
+            self.assertIn('<span class="badge gray-badge">1</span>', html)
+
+    def test_errors_before_streaming(self):
+        self.assertEqual(self.client.get('/topic/{}?page=5'.format(self.topic_id)).status_code, 404)
+        self.assertEqual(self.client.get('/messages?direction=other').status_code, 400)
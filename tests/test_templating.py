@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from forum.app import create_app
+from forum.templating import load_templates
+
+
+class TemplatingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_app(self, **config):
+        app = create_app()
+        app.config.update(config)
+        from forum import templating
+        templating.init_app(app)
+        return app
+
+    def test_bytecode_cache(self):
+        names = load_templates(self.create_app(TEMPLATE_CACHE_DIR=self.directory))
+        self.assertIn('base.html', names)
+        self.assertIn('bootstrap/base.html', names)
+        self.assertEqual(len(os.listdir(self.directory)), len(names))
+
+        app = self.create_app(TEMPLATE_CACHE_DIR=self.directory, PRELOAD_TEMPLATES=True)
+        compiled = []
+        compile_ = app.jinja_env.compile
+        app.jinja_env.compile = lambda *args, **kwargs: compiled.append(args) or compile_(*args, **kwargs)
+        app.jinja_env.cache.clear()
+        load_templates(app)
+        self.assertEqual(compiled, [])
+        self.assertEqual(app.test_client().get('/auth/login').status_code, 200)
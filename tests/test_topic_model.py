@@ -0,0 +1,108 @@
+import unittest
+
+from forum.app import create_app, db
+from forum.celery_tasks import cascade_topic_deletion
+from forum.models import User, Role, Topic, TopicGroup, Comment, PollAnswer, PollVote, DeletionJob
+
+
+class TopicModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_poll(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        t = Topic(title='title', body='body', poll='question?', author=u)
+        db.session.add_all([u, t])
+        db.session.commit()
+        a1 = PollAnswer(topic_id=t.id, body='yes')
+        a2 = PollAnswer(topic_id=t.id, body='no')
+        db.session.add_all([a1, a2])
+        db.session.commit()
+        return u, t, a1, a2
+
+    def test_vote_is_taken_once(self):
+        u, t, a1, a2 = self.create_poll()
+        self.assertTrue(t.add_vote(u, a1))
+        self.assertFalse(t.add_vote(u, a1))
+        self.assertFalse(t.add_vote(u, a2))
+        db.session.commit()
+        self.assertEqual(PollVote.query.filter_by(topic_id=t.id, author_id=u.id).count(), 1)
+        self.assertEqual(u.get_vote(t)[0], 'yes')
+
+    def test_refresh_interest(self):
+        u, t, a1, a2 = self.create_poll()
+        t.add_vote(u, a1)
+        t.add_comment(u, 'comment')
+        db.session.commit()
+        self.assertEqual(t.interest, 0)
+        Topic.refresh_interest([t.id])
+        db.session.commit()
+        db.session.refresh(t)
+        self.assertEqual(t.interest, 2)
+
+    def test_delete_in_batches(self):
+        u, t, a1, a2 = self.create_poll()
+        for i in range(5):
+            t.add_comment(u, 'comment {}'.format(i))
+        t.add_vote(u, a1)
+        db.session.commit()
+        self.app.config['DELETION_BATCH_SIZE'] = 2
+        job = t.delete(u)
+        db.session.commit()
+        cascade_topic_deletion(job.id)
+        job = DeletionJob.query.get(job.id)
+        self.assertTrue(t.deleted)
+        self.assertEqual((job.total, job.processed, job.percent), (8, 8, 100))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(Comment.query.filter_by(topic_id=t.id, deleted=False).count(), 0)
+        self.assertEqual(PollAnswer.query.filter_by(topic_id=t.id, deleted=False).count(), 0)
+        self.assertEqual(PollVote.query.filter_by(topic_id=t.id, deleted=False).count(), 0)
+
+    def test_comment_seq(self):
+        u, t, a1, a2 = self.create_poll()
+        for i in range(3):
+            t.add_comment(u, 'comment {}'.format(i))
+            db.session.commit()
+        Comment.query.filter_by(topic_id=t.id, seq=2).update({Comment.deleted: True})
+        t.add_comment(u, 'comment 3')
+        db.session.commit()
+        self.assertEqual([c.seq for c in Comment.query.filter_by(topic_id=t.id).order_by(Comment.id)], [1, 2, 3, 4])
+        db.session.refresh(t)
+        self.assertEqual(t.last_comment_seq, 4)
+        Topic.query.filter_by(id=t.id).update({Topic.last_comment_seq: 0})
+        Topic.refresh_comments_seq([t.id])
+        db.session.refresh(t)
+        self.assertEqual(t.last_comment_seq, 4)
+
+    def test_comment_pages(self):
+        TopicGroup.insert_root_topic_group()
+        self.app.config['COMMENTS_PER_PAGE'] = 2
+        u, t, a1, a2 = self.create_poll()
+        t.group_id = 0
+        for i in range(5):
+            t.add_comment(u, 'comment {}'.format(i))
+        db.session.commit()
+        comment_ids = [c.id for c in Comment.query.filter_by(topic_id=t.id).order_by(Comment.seq)]
+        Comment.query.filter_by(id=comment_ids[2]).update({Comment.deleted: True})
+        db.session.commit()
+        client = self.app.test_client()
+        response = client.get('/topic/{}?page=-1'.format(t.id))
+        self.assertIn('comment 4', response.get_data(as_text=True))
+        response = client.get('/topic/{}?page=2'.format(t.id))
+        self.assertIn('comment 3', response.get_data(as_text=True))
+        self.assertNotIn('comment 2', response.get_data(as_text=True))
+        self.assertEqual(client.get('/topic/{}?page=4'.format(t.id)).status_code, 404)
+        response = client.get('/comment/{}'.format(comment_ids[3]))
+        self.assertTrue(response.location.endswith('/topic/{}?page=2#comment-{}'.format(t.id, comment_ids[3])))
+        response = client.get('/topic/{}/comment/5'.format(t.id))
+        self.assertTrue(response.location.endswith('/topic/{}?page=3#comment-{}'.format(t.id, comment_ids[4])))
+        self.assertEqual(client.get('/comment/{}'.format(comment_ids[2])).status_code, 404)
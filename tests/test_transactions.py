@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from forum.app import create_app, db
+from forum.models import User, Role, Topic, TopicGroup, Comment, Conversation, ConversationMember, Message
+from forum.transactions import ReadOnlyError, read_write
+
+
+class ReadOnlyRequestsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        TopicGroup.insert_root_topic_group()
+        self.client = self.app.test_client()
+        u1 = User(email='john@example.com', username='john', password='cat', confirmed=True)
+        u2 = User(email='susan@example.com', username='susan', username_normalized='susan', password='dog',
+                  confirmed=True)
+        topic = Topic(title='title', body='body', group_id=0, author=u2)
+        db.session.add_all([u1, u2, topic])
+        db.session.commit()
+        db.session.add(Comment(body='comment', topic=topic, author=u2))
+        message = Conversation.send_message(u2.id, u1.id, 'hello', 'body')
+        Conversation.send_message(u2.id, u1.id, 'hello again', 'body')
+        u1.last_seen = datetime.utcnow() - timedelta(days=1)
+        db.session.commit()
+        self.user_id, self.topic_id, self.message_id = u1.id, topic.id, message.id
+        self.conversation_id = message.conversation_id
+        self.client.post('/auth/login', data=dict(email='john@example.com', password='cat'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def unread_count(self):
+        db.session.commit()
+        return ConversationMember.query.filter_by(user_id=self.user_id).one().unread_count
+
+    def test_get_handlers_dont_write(self):
+        urls = ['/', '/hot', '/latest', '/latest?target=comments', '/participation', '/favorites', '/messages',
+                '/community', '/topic/{}'.format(self.topic_id), '/user/susan', '/edit_profile',
+                '/topic/{}/comments'.format(self.topic_id), '/send_message/susan',
+                '/message/{}'.format(self.message_id), '/conversation/{}'.format(self.conversation_id),
+                '/auth/change_password', '/auth/change_email', '/api/v1.0/topics']
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_deferred_writes(self):
+        response = self.client.get('/message/{}'.format(self.message_id))
+        self.assertIn('<span class="badge gray-badge">1</span>', response.get_data(as_text=True))
+        self.assertEqual(self.unread_count(), 1)
+        self.assertFalse(Message.query.get(self.message_id).unread)
+        self.assertGreater(User.query.get(self.user_id).last_seen, datetime.utcnow() - timedelta(minutes=1))
+
+        response = self.client.get('/conversation/{}'.format(self.conversation_id))
+        self.assertNotIn('<span class="badge gray-badge">1</span>', response.get_data(as_text=True))
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_unread_messages_are_counted_once(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for url in ('/message/{}'.format(self.message_id), '/conversation/{}'.format(self.conversation_id),
+                        '/messages'):
+                del statements[:]
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+                self.assertEqual(len([s for s in statements if 'sum(conversations_members.unread_count)' in s]), 1,
+                                 url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def test_direct_writes_fail(self):
+        def write():
+            User.query.get(self.user_id).name = 'John'
+            return 'written'
+
+        self.app.add_url_rule('/write', 'write', write, methods=['GET', 'POST'])
+        self.app.add_url_rule('/read_write', 'read_write', read_write(lambda: write()))
+        with self.assertRaises(ReadOnlyError):
+            self.client.get('/write')
+        self.assertIsNone(User.query.get(self.user_id).name)
+        self.assertEqual(self.client.post('/write').status_code, 200)
+        self.assertEqual(self.client.get('/read_write').status_code, 200)
+
+        # Outside tests the write is logged and rolled back.
+        self.app.testing = False
+        self.assertEqual(self.client.get('/write').status_code, 200)
+        self.assertIsNone(User.query.get(self.user_id).name)
+        self.assertEqual(self.client.get('/read_write').status_code, 200)
+        self.assertEqual(User.query.get(self.user_id).name, 'John')
+
+        self.app.config['READ_ONLY_SAFE_REQUESTS'] = False
+        self.assertEqual(self.client.get('/write').status_code, 200)
@@ -0,0 +1,73 @@
+import csv
+from datetime import datetime
+from itertools import islice
+
+import six
+from sqlalchemy import func
+
+from forum.app import db
+
+COPY_NULL = r'\N'
+
+
+def batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def next_id(table, column='id'):
+    return (db.session.query(func.max(table.c[column])).scalar() or 0) + 1
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _copy_rows(connection, table, columns, rows):
+    buf = six.BytesIO() if six.PY2 else six.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in columns])
+    buf.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert("COPY {table} ({columns}) FROM STDIN WITH CSV NULL '{null}'".format(
+        table=table.name, columns=', '.join(columns), null=COPY_NULL), buf)
+    cursor.close()
+
+
+def bulk_insert(table, rows, batch_size=10000):
+    """Inserts rows (dicts with the same keys) with COPY on PostgreSQL and executemany on other databases.
+
+    Returns the number of inserted rows. Rows are written in batches, so the rows iterable can be a generator.
+    """
+    connection = db.session.connection()
+    is_postgresql = connection.dialect.name == 'postgresql'
+    count = 0
+    for batch in batches(rows, batch_size):
+        if is_postgresql:
+            _copy_rows(connection, table, list(batch[0].keys()), batch)
+        else:
+            connection.execute(table.insert(), batch)
+        count += len(batch)
+    return count
+
+
+def reset_sequence(table, column='id'):
+    # Rows inserted with explicit ids don't move PostgreSQL sequences.
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute("SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                           "coalesce(max({column}), 0) + 1, false) FROM {table}".format(table=table.name,
+                                                                                      column=column))
@@ -1,126 +1,306 @@
-from random import seed, randint, choice
+"""Generator of a fake but realistic dataset.
+
+Amounts of rows are proportional to the scale factor, activity of users and popularity of topics are
+Zipf-distributed and the same seed gives the same dataset. Rows are written with bulk inserts and body_html
+is composed of paragraphs pre-rendered in a pool of processes, so millions of rows are generated in minutes.
+"""
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from multiprocessing import Pool, cpu_count
 
 import forgery_py
-from sqlalchemy import func
-from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
 
-from forum.config import config
 from forum.app import db
-from forum.models import User, Topic, TopicGroup, Comment, Message, PollAnswer, PollVote
-
-
-def generate_fake_messages(count=1000):
-    seed()
-    for i in range(count):
-        u1, u2 = User.query.order_by(func.random()).limit(2).all()
-        m = Message(title=forgery_py.lorem_ipsum.title()[:128],
-                    body=forgery_py.lorem_ipsum.sentences(randint(10, 20)),
-                    created_at=forgery_py.date.date(True),
-                    author=u1,
-                    receiver=u2)
-        db.session.add(m)
-    db.session.commit()
-
-
-def generate_fake_users(count=100):
-    seed()
-    for i in range(count):
-        user_name = forgery_py.internet.user_name(True)[:32]
-        u = User(email=forgery_py.internet.email_address(),
-                 username=user_name,
-                 username_normalized=user_name.lower(),
-                 password=forgery_py.lorem_ipsum.word(),
-                 confirmed=True,
-                 name=forgery_py.name.full_name()[:64],
-                 homeland=forgery_py.address.city()[:64],
-                 about=forgery_py.lorem_ipsum.sentence(),
-                 created_at=forgery_py.date.date(True))
-        db.session.add(u)
+from forum.config import config
+from forum.models import (Role, User, Topic, TopicGroup, Comment, Message, PollAnswer, PollVote, Favorite, Conversation,
+                          ConversationMember, render_body_html, gravatar_url)
+from utils.bulk import bulk_insert, next_id, reset_sequence
+
+# Amounts of rows for the scale factor 1.
+BASE_COUNTS = dict(
+    users=100,
+    topic_groups=10,
+    topics=100,
+    comments=1000,
+    polls=40,
+    votes=1000,
+    messages=1000,
+    favorites=500,
+)
+ANSWERS_PER_POLL = 4
+FAKE_USER_PASSWORD = 'password'
+PERIOD = timedelta(days=365)
+
+
+class ZipfChoice(object):
+    """Chooses items with probabilities proportional to 1 / rank ** skew, ranks are shuffled."""
+
+    def __init__(self, items, skew, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.rng = rng
+        self.cum_weights = []
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += 1.0 / rank ** skew
+            self.cum_weights.append(total)
+        self.total = total
+
+    def __call__(self):
+        return self.items[bisect(self.cum_weights, self.rng.random() * self.total)]
+
+
+class TextPool(object):
+    """Random texts composed from a pool of paragraphs.
+
+    Markdown of plain text paragraphs separated by blank lines is rendered paragraph by paragraph, so every
+    paragraph is rendered to HTML only once and body_html of a text is a join of rendered paragraphs.
+    """
+
+    def __init__(self, rng, pool=None, size=5000):
+        self.rng = rng
+        sentences = [forgery_py.lorem_ipsum.sentence() for _ in range(size)]
+        self.sentences = sentences
+        self.titles = [forgery_py.lorem_ipsum.title() for _ in range(size)]
+        self.paragraphs = [' '.join(rng.choice(sentences) for _ in range(rng.randint(1, 5))) for _ in range(size)]
+        if pool:
+            self.paragraphs_html = pool.map(render_body_html, self.paragraphs, chunksize=64)
+        else:
+            self.paragraphs_html = [render_body_html(paragraph) for paragraph in self.paragraphs]
+
+    def title(self, max_length):
+        return self.rng.choice(self.titles)[:max_length]
+
+    def text(self, min_paragraphs, max_paragraphs):
+        indexes = [self.rng.randrange(len(self.paragraphs))
+                   for _ in range(self.rng.randint(min_paragraphs, max_paragraphs))]
+        return dict(body='\n\n'.join(self.paragraphs[i] for i in indexes),
+                    body_html='\n'.join(self.paragraphs_html[i] for i in indexes))
+
+
+class FakeDataGenerator(object):
+    def __init__(self, scale=1.0, seed=0, skew=1.1, processes=None, batch_size=5000):
+        self.scale = scale
+        self.skew = skew
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        random.seed(seed)  # forgery_py uses the global random generator
+        self.processes = processes or cpu_count()
+        self.pool = None
+        self.poll_topics = set()
+        self.texts = None
+        self.now = datetime.utcnow()
+        self.stats = []
+
+    def count(self, name):
+        return max(int(round(BASE_COUNTS[name] * self.scale)), 1)
+
+    def random_date(self, since=None):
+        since = since or self.now - PERIOD
+        return since + timedelta(seconds=self.rng.random() * (self.now - since).total_seconds())
+
+    def insert(self, model, rows):
+        table = model.__table__
+        started = time.time()
+        count = bulk_insert(table, rows, self.batch_size)
+        if 'id' in table.c:
+            reset_sequence(table)
+        db.session.commit()
+        elapsed = time.time() - started
+        self.stats.append((table.name, count, elapsed))
+        print('{:<22} {:>10} rows {:>8.1f} s {:>10.0f} rows/s'.format(
+            table.name, count, elapsed, count / elapsed if elapsed else 0))
+
+    def generate(self):
+        if self.processes > 1:
+            self.pool = Pool(self.processes)
         try:
+            self.texts = TextPool(self.rng, self.pool)
+            user_ids = self.generate_users()
+            choose_user = ZipfChoice(user_ids, self.skew, self.rng)
+            group_ids = self.generate_topic_groups(choose_user)
+            topics = self.generate_topics(choose_user, group_ids)
+            choose_topic = ZipfChoice(range(len(topics)), self.skew, self.rng)
+            self.generate_comments(choose_user, choose_topic, topics)
+            self.generate_votes(choose_user, topics)
+            if len(user_ids) > 1:  # a message needs another user as the receiver
+                self.generate_messages(choose_user)
+            self.generate_favorites(choose_user, choose_topic, topics)
+            Topic.refresh_interest()
             db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
-
-def generate_fake_topics(count=100):
-    seed()
-    user_count = db.session.query(func.count(User.id)).scalar()
-    group_count = db.session.query(func.count(TopicGroup.id)).scalar()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        if group_count:
-            g = TopicGroup.query.offset(randint(0, group_count - 1)).first()
-        else:
-            g = None
-        now = forgery_py.date.date(True)
-        p = Topic(title=forgery_py.lorem_ipsum.title()[:128],
-                  body=forgery_py.lorem_ipsum.sentences(randint(20, 40)),
-                  created_at=now,
-                  updated_at=now,
-                  author=u,
-                  group=g)
-        db.session.add(p)
-    db.session.commit()
-
-
-def generate_fake_topic_groups(count=10, parent_group_id=0):
-    seed()
-    user_count = db.session.query(func.count(User.id)).scalar()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        g = TopicGroup(title=forgery_py.lorem_ipsum.title()[:64],
-                       priority=choice(config.TOPIC_GROUP_PRIORITY),
-                       created_at=forgery_py.date.date(True),
-                       author=u,
-                       group_id=parent_group_id)
-        db.session.add(g)
-    db.session.commit()
-
-
-def generate_fake_comments(count=1000):
-    seed()
-    user_count = db.session.query(func.count(User.id)).scalar()
-    topic_count = db.session.query(func.count(Topic.id)).scalar()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        t = Topic.query.offset(randint(0, topic_count - 1)).first()
-        now = forgery_py.date.date(True)
-        c = Comment(body=forgery_py.lorem_ipsum.sentences(randint(10, 20)),
-                    created_at=now,
-                    updated_at=now,
-                    author=u,
-                    topic=t)
-        db.session.add(c)
-        t.interest += 1
-        db.session.add(t)
-    db.session.commit()
-
-
-def generate_fake_polls(polls_count=40, answers_per_poll=4):
-    seed()
-    for i in range(polls_count):
-        t = Topic.query.filter_by(poll=None).order_by(func.random()).first()
-        t.poll = forgery_py.lorem_ipsum.sentence()[:256][:-1] + '?'
-        for j in range(answers_per_poll):
-            pa = PollAnswer(topic_id=t.id,
-                            body=forgery_py.lorem_ipsum.sentence())
-            db.session.add(pa)
-    db.session.commit()
-
-
-def generate_fake_votes(count=1000):
-    seed()
-    user_count = db.session.query(func.count(User.id)).scalar()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        voted = [v.topic_id for v in u.poll_votes]
-        pa = PollAnswer.query.filter(~PollAnswer.topic_id.in_(voted)).order_by(func.random()).first()
-        t = pa.topic
-        pv = PollVote(topic_id=t.id,
-                      poll_answer_id=pa.id,
-                      author_id=u.id,
-                      created_at=forgery_py.date.date(True))
-        db.session.add(pv)
-        t.interest += 1
-        db.session.add(t)
-    db.session.commit()
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+        return self.stats
+
+    def generate_users(self):
+        first_id = next_id(User.__table__)
+        role_id = Role.query.filter_by(default=True).first().id
+        password_hash = generate_password_hash(FAKE_USER_PASSWORD)
+        user_ids = range(first_id, first_id + self.count('users'))
+
+        def rows():
+            for user_id in user_ids:
+                username = '{}_{}'.format(forgery_py.internet.user_name()[:20], user_id)
+                email = '{}@{}'.format(username.lower(), forgery_py.internet.domain_name())
+                created_at = self.random_date()
+                yield dict(id=user_id, email=email[:64], username=username, username_normalized=username.lower(),
+                           role_id=role_id, password_hash=password_hash, confirmed=True,
+                           name=forgery_py.name.full_name()[:64], homeland=forgery_py.address.city()[:64],
+                           about=self.rng.choice(self.texts.sentences), created_at=created_at, updated_at=created_at,
+                           last_seen=self.random_date(created_at),
+                           avatar=gravatar_url(email[:64]))
+
+        self.insert(User, rows())
+        return list(user_ids)
+
+    def generate_topic_groups(self, choose_user):
+        first_id = next_id(TopicGroup.__table__)
+        group_ids = range(first_id, first_id + self.count('topic_groups'))
+
+        def rows():
+            for group_id in group_ids:
+                # Some groups are nested into one of the previous groups.
+                parent_id = config.ROOT_TOPIC_GROUP
+                if group_id > first_id and self.rng.random() < 0.3:
+                    parent_id = self.rng.randint(first_id, group_id - 1)
+                created_at = self.random_date()
+                yield dict(id=group_id, title=self.texts.title(64),
+                           priority=self.rng.choice(config.TOPIC_GROUP_PRIORITY), protected=False,
+                           created_at=created_at, updated_at=created_at, author_id=choose_user(), group_id=parent_id,
+                           deleted=False)
+
+        self.insert(TopicGroup, rows())
+        return [config.ROOT_TOPIC_GROUP] + list(group_ids)
+
+    def generate_topics(self, choose_user, group_ids):
+        first_id = next_id(Topic.__table__)
+        choose_group = ZipfChoice(group_ids, self.skew, self.rng)
+        topics = [(first_id + i, self.random_date()) for i in range(self.count('topics'))]
+        self.poll_topics = set(self.rng.sample(range(len(topics)), min(self.count('polls'), len(topics))))
+
+        def rows():
+            for i, (topic_id, created_at) in enumerate(topics):
+                poll = self.rng.choice(self.texts.sentences)[:255].rstrip('.') + '?' if i in self.poll_topics else None
+                row = dict(id=topic_id, title=self.texts.title(128), created_at=created_at, updated_at=created_at,
+                           author_id=choose_user(), group_id=choose_group(), deleted=False, poll=poll, interest=0)
+                row.update(self.texts.text(5, 15))
+                yield row
+
+        self.insert(Topic, rows())
+        return topics
+
+    def generate_comments(self, choose_user, choose_topic, topics):
+        first_id = next_id(Comment.__table__)
+        # Ids and numbers of comments in topics grow with time like in comments written one by one.
+        comments = sorted((self.random_date(topic_created_at), topic_id) for topic_id, topic_created_at in
+                          (topics[choose_topic()] for _ in range(self.count('comments'))))
+
+        def rows():
+            seqs = {}
+            for comment_id, (created_at, topic_id) in enumerate(comments, first_id):
+                seqs[topic_id] = seqs.get(topic_id, 0) + 1
+                row = dict(id=comment_id, created_at=created_at, updated_at=created_at, author_id=choose_user(),
+                           topic_id=topic_id, deleted=False, seq=seqs[topic_id])
+                row.update(self.texts.text(1, 3))
+                yield row
+
+        self.insert(Comment, rows())
+        Topic.refresh_comments_seq()
+
+    def generate_votes(self, choose_user, topics):
+        first_answer_id = next_id(PollAnswer.__table__)
+        poll_topics = sorted(self.poll_topics)
+        answers = {}
+
+        def answer_rows():
+            answer_id = first_answer_id
+            for i in poll_topics:
+                answers[i] = range(answer_id, answer_id + ANSWERS_PER_POLL)
+                for _ in range(ANSWERS_PER_POLL):
+                    yield dict(id=answer_id, topic_id=topics[i][0], body=self.rng.choice(self.texts.sentences),
+                               deleted=False)
+                    answer_id += 1
+
+        self.insert(PollAnswer, answer_rows())
+        if not poll_topics:
+            return
+        choose_poll = ZipfChoice(poll_topics, self.skew, self.rng)
+        first_id = next_id(PollVote.__table__)
+        max_votes = min(self.count('votes'), len(poll_topics) * self.count('users'))
+
+        def vote_rows():
+            voted = set()
+            vote_id = first_id
+            while len(voted) < max_votes:
+                i = choose_poll()
+                author_id = choose_user()
+                if (i, author_id) in voted:
+                    continue
+                voted.add((i, author_id))
+                yield dict(id=vote_id, topic_id=topics[i][0], poll_answer_id=self.rng.choice(answers[i]),
+                           author_id=author_id, created_at=self.random_date(topics[i][1]), deleted=False)
+                vote_id += 1
+
+        self.insert(PollVote, vote_rows())
+
+    def generate_messages(self, choose_user):
+        first_id = next_id(Message.__table__)
+        first_conversation_id = next_id(Conversation.__table__)
+        conversations = {}  # (user1_id, user2_id) -> (conversation_id, created_at)
+        members = {}  # (conversation_id, user_id) -> member row
+        messages = []
+        for message_id in range(first_id, first_id + self.count('messages')):
+            author_id, receiver_id = choose_user(), choose_user()
+            while receiver_id == author_id:
+                receiver_id = choose_user()
+            created_at = self.random_date()
+            unread = self.rng.random() < 0.3
+            pair = tuple(sorted((author_id, receiver_id)))
+            conversation_id, conversation_created_at = conversations.get(
+                pair, (first_conversation_id + len(conversations), created_at))
+            conversations[pair] = (conversation_id, min(created_at, conversation_created_at))
+            messages.append((message_id, conversation_id, author_id, receiver_id, created_at, unread))
+            for user_id, interlocutor_id in ((author_id, receiver_id), (receiver_id, author_id)):
+                member = members.setdefault((conversation_id, user_id), dict(
+                    conversation_id=conversation_id, user_id=user_id, interlocutor_id=interlocutor_id,
+                    last_message_id=None, last_message_at=None, messages_count=0, unread_count=0))
+                member['messages_count'] += 1
+                member['unread_count'] += 1 if unread and user_id == receiver_id else 0
+                if member['last_message_at'] is None or created_at > member['last_message_at']:
+                    member['last_message_id'], member['last_message_at'] = message_id, created_at
+
+        self.insert(Conversation, (dict(id=conversation_id, user1_id=pair[0], user2_id=pair[1], created_at=created_at)
+                                   for pair, (conversation_id, created_at) in conversations.items()))
+
+        def rows():
+            for message_id, conversation_id, author_id, receiver_id, created_at, unread in messages:
+                row = dict(id=message_id, title=self.texts.title(128), created_at=created_at, author_id=author_id,
+                           receiver_id=receiver_id, conversation_id=conversation_id, author_deleted=False,
+                           receiver_deleted=False, unread=unread)
+                row.update(self.texts.text(1, 3))
+                yield row
+
+        self.insert(Message, rows())
+        self.insert(ConversationMember, members.values())
+
+    def generate_favorites(self, choose_user, choose_topic, topics):
+        max_favorites = min(self.count('favorites'), len(topics) * self.count('users'))
+
+        def rows():
+            favorites = set()
+            while len(favorites) < max_favorites:
+                favorite = (choose_user(), topics[choose_topic()][0])
+                if favorite not in favorites:
+                    favorites.add(favorite)
+                    yield dict(user_id=favorite[0], topic_id=favorite[1])
+
+        self.insert(Favorite, rows())
+
+
+def generate_fake_data(scale=1.0, seed=0, skew=1.1, processes=None):
+    return FakeDataGenerator(scale=scale, seed=seed, skew=skew, processes=processes).generate()
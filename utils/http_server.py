@@ -0,0 +1,70 @@
+"""Local stand-in HTTP server for tests and benchmarks of the image proxy.
+
+Serves files given as {path: (content type, body)} in a thread and counts requests of every path:
+
+    with LocalHTTPServer({'/avatar.png': ('image/png', PNG)}) as server:
+        url = server.url('/avatar.png')
+        ...
+        assert server.requests['/avatar.png'] == 1
+"""
+import collections
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+# 1x1 transparent PNG.
+PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+       b'\x00\x00\x00\x0bIDATx\x9cc`\x00\x02\x00\x00\x05\x00\x01z^\xab?\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        owner = self.server.owner
+        path = self.path.split('?')[0]
+        owner.requests[path] += 1
+        if owner.latency:
+            time.sleep(owner.latency)
+        if path not in owner.files:
+            self.send_error(404)
+            return
+        content_type, body = owner.files[path]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LocalHTTPServer(object):
+    def __init__(self, files=None, host='127.0.0.1', latency=0.0):
+        self.files = dict(files or {})
+        self.requests = collections.Counter()
+        self.latency = latency
+        self.server = _Server((host, 0), _Handler)
+        self.server.owner = self
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs=dict(poll_interval=0.05))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def url(self, path):
+        return u'http://{}:{}{}'.format(self.host, self.port, path)
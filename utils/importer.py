@@ -0,0 +1,467 @@
+"""Bulk import of a forum dump.
+
+A dump is an NDJSON file (optionally gzipped) of rows with the "type" of the row, like the one written by
+"manage.py export", or a directory of CSV files <type>.csv with a header. Rows of a type are imported as they
+are read, so rows of every type should follow each other in the order of TYPES (exports and directories of CSV
+files are such) and a dump in another order is rejected. A row can only refer to rows of preceding types or
+preceding rows of its type, a row referring to a row which is not imported, like a comment of a missing topic,
+is skipped.
+
+Rows are not created through the models: ids of the dump are mapped to new ids in memory, users are matched
+to existing ones by email, body_html is rendered from body (HTML of a foreign dump is not trusted) in a pool
+of processes while the previous batch is written and rows are written with COPY on PostgreSQL and executemany on
+other databases. Everything is imported in one transaction, which is committed only if references of imported
+rows pass integrity checks. Ids are allocated after the maximal ones in the database, so don't import while
+the forum is writing.
+"""
+from __future__ import print_function
+
+import csv
+import gzip
+import io
+import json
+import os
+import time
+from datetime import datetime
+from itertools import groupby
+from multiprocessing import Pool, cpu_count
+from operator import itemgetter
+
+import six
+from flask import current_app
+from sqlalchemy import and_, case, func, select
+
+from forum.app import db
+from forum.models import (Role, User, Topic, TopicGroup, Comment, Message, PollAnswer, PollVote, Conversation,
+                          ConversationMember, render_body_html, gravatar_url)
+from utils.bulk import batches, bulk_insert, next_id, reset_sequence
+
+TYPES = ('user', 'topic_group', 'topic', 'poll_answer', 'poll_vote', 'comment', 'message')
+MODELS = dict(user=User, topic_group=TopicGroup, topic=Topic, poll_answer=PollAnswer, poll_vote=PollVote,
+              comment=Comment, message=Message)
+INTEGER_COLUMNS = {'id', 'group_id', 'author_id', 'topic_id', 'poll_answer_id', 'receiver_id', 'priority'}
+BOOLEAN_COLUMNS = {'confirmed', 'protected', 'deleted', 'author_deleted', 'receiver_deleted', 'unread'}
+DATETIME_COLUMNS = {'created_at', 'updated_at', 'last_seen'}
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+class IntegrityCheckError(Exception):
+    pass
+
+
+def parse_datetime(value):
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, datetime_format)
+        except ValueError:
+            pass
+    raise ValueError('Unknown date format: {}'.format(value))
+
+
+def convert(row):
+    """Values of a row of JSON or CSV strings converted to the types of columns, empty strings are nulls."""
+    for name, value in row.items():
+        if value == '':
+            row[name] = value = None
+        if value is None:
+            continue
+        if name in INTEGER_COLUMNS:
+            row[name] = int(value)
+        elif name in BOOLEAN_COLUMNS and isinstance(value, six.string_types):
+            row[name] = value.lower() in ('1', 't', 'true', 'y', 'yes')
+        elif name in DATETIME_COLUMNS and isinstance(value, six.string_types):
+            row[name] = parse_datetime(value)
+    return row
+
+
+def read_ndjson(path):
+    opener = gzip.open if path.endswith('.gz') else io.open
+    with opener(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line.decode('utf-8'))
+                yield row.pop('type'), convert(row)
+
+
+def read_csv(directory):
+    for row_type in TYPES:
+        path = os.path.join(directory, row_type + '.csv')
+        if not os.path.exists(path):
+            continue
+        if six.PY2:
+            with open(path, 'rb') as f:
+                for row in csv.DictReader(f):
+                    yield row_type, convert(dict((k.decode('utf-8'), v.decode('utf-8')) for k, v in row.items()))
+        else:
+            with io.open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    yield row_type, convert(row)
+
+
+def read_dump(path):
+    """(type, row) pairs of a dump, a directory is read as CSV files and a file as NDJSON."""
+    return read_csv(path) if os.path.isdir(path) else read_ndjson(path)
+
+
+def _render(body):
+    return render_body_html(body) if body else body
+
+
+class Importer(object):
+    def __init__(self, topic_group_id=None, processes=None, batch_size=5000, trust_html=False):
+        self.topic_group_id = (current_app.config['ROOT_TOPIC_GROUP'] if topic_group_id is None
+                               else topic_group_id)
+        self.processes = processes or cpu_count()
+        self.batch_size = batch_size
+        # body_html of a dump of this forum is already sanitized and is kept instead of rendering it again.
+        self.trust_html = trust_html
+        self.pool = None
+        self.ids = dict((row_type, {}) for row_type in TYPES)  # type -> {id in the dump: new id}
+        self.first_ids = {}  # type -> the first allocated id
+        self.next_ids = {}
+        self.counts = dict((row_type, 0) for row_type in TYPES)
+        self.skipped = dict((row_type, 0) for row_type in TYPES)
+        self.merged_users = 0
+        self.votes = set()
+        self.comment_seqs = {}  # topic id -> the last seq of comments
+        self.conversations = None  # (user1_id, user2_id) -> conversation id
+        self.new_conversations = {}  # conversation id -> (user1_id, user2_id)
+        self.next_conversation_id = None
+        self.members = {}  # (conversation_id, user_id) -> changes of the member
+        self.stats = []
+
+    def allocate_id(self, row_type):
+        if row_type not in self.next_ids:
+            self.first_ids[row_type] = self.next_ids[row_type] = next_id(MODELS[row_type].__table__)
+        new_id = self.next_ids[row_type]
+        self.next_ids[row_type] += 1
+        return new_id
+
+    def insert(self, table, rows, row_type=None):
+        started = time.time()
+        count = bulk_insert(table, rows, self.batch_size)
+        elapsed = time.time() - started
+        if row_type:
+            self.counts[row_type] += count
+        self.stats.append((table.name, count, elapsed))
+        print('{:<22} {:>10} rows {:>8.1f} s {:>10.0f} rows/s'.format(
+            table.name, count, elapsed, count / elapsed if elapsed else 0))
+
+    def rendered(self, rows):
+        """Rows with body_html, a batch is rendered by the pool while the previous one is written."""
+        pending = None
+        for batch in batches(rows, self.batch_size):
+            bodies = [row['body'] for row in batch if row['body_html'] is None]
+            result = self.pool.map_async(_render, bodies, chunksize=64) if self.pool else None
+            if pending:
+                for row in self.finish_batch(*pending):
+                    yield row
+            pending = (batch, result)
+        if pending:
+            for row in self.finish_batch(*pending):
+                yield row
+
+    @staticmethod
+    def finish_batch(batch, result):
+        unrendered = [row for row in batch if row['body_html'] is None]
+        htmls = result.get() if result else [_render(row['body']) for row in unrendered]
+        for row, html in zip(unrendered, htmls):
+            row['body_html'] = html
+        return batch
+
+    def body_html(self, row):
+        return row.get('body_html') if self.trust_html else None
+
+    def resolve(self, row_type, row, **references):
+        """New ids of references of the row or None if some of them are not imported."""
+        resolved = {}
+        for name, referenced_type in references.items():
+            new_id = self.ids[referenced_type].get(row.get(name))
+            if new_id is None:
+                self.skipped[row_type] += 1
+                return None
+            resolved[name] = new_id
+        return resolved
+
+    def run(self, rows):
+        """Imports (type, row) pairs, returns stats of tables."""
+        if self.processes > 1:
+            self.pool = Pool(self.processes)
+        started = time.time()
+        try:
+            previous = None
+            for row_type, group in groupby(rows, key=itemgetter(0)):
+                if row_type not in TYPES:
+                    raise ValueError('Unknown type of rows: {}'.format(row_type))
+                if previous is not None and TYPES.index(row_type) <= TYPES.index(previous):
+                    raise ValueError('Rows of type {} follow rows of type {}, types should be in the order: {}'.format(
+                        row_type, previous, ', '.join(TYPES)))
+                previous = row_type
+                getattr(self, 'import_' + row_type + 's')(row for _, row in group)
+            self.import_conversation_members()
+            self.check()
+            for row_type in self.first_ids:
+                reset_sequence(MODELS[row_type].__table__)
+            if self.new_conversations:
+                reset_sequence(Conversation.__table__)
+            if 'topic' in self.first_ids:
+                topic_ids = select([Topic.id]).where(Topic.id >= self.first_ids['topic'])
+                Topic.refresh_interest(topic_ids)
+                Topic.refresh_comments_seq(topic_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+        elapsed = time.time() - started
+        total = sum(count for _, count, _ in self.stats)
+        print('{} rows in {:.1f} s, {:.0f} rows/s, {} users merged by email, skipped rows without references: {}'
+              .format(total, elapsed, total / elapsed if elapsed else 0, self.merged_users,
+                      dict((k, v) for k, v in self.skipped.items() if v) or 'none'))
+        return self.stats
+
+    def import_users(self, rows):
+        default_role_id = Role.query.filter_by(default=True).first().id
+        admin_role = Role.query.filter_by(permissions=0xff).first()
+        admin_email = (current_app.config['APP_ADMIN'] or '').lower()
+        emails = dict(db.session.query(func.lower(User.email), User.id).filter(User.email.isnot(None)))
+        usernames = set(username for username, in db.session.query(User.username_normalized))
+        ids = self.ids['user']
+
+        def new_rows():
+            for row in rows:
+                email = (row.get('email') or '').strip()[:64] or None
+                if email and email.lower() in emails:
+                    ids[row['id']] = emails[email.lower()]
+                    self.merged_users += 1
+                    continue
+                user_id = ids[row['id']] = self.allocate_id('user')
+                username = (row.get('username') or 'user')[:32]
+                if username.lower() in usernames:
+                    suffix = '_{}'.format(user_id)
+                    username = username[:32 - len(suffix)] + suffix
+                usernames.add(username.lower())
+                if email:
+                    emails[email.lower()] = user_id
+                is_admin = email and admin_role and email.lower() == admin_email
+                created_at = row.get('created_at') or datetime.utcnow()
+                # Users of a dump have no passwords here, they log in after resetting the password.
+                yield dict(id=user_id, email=email, username=username, username_normalized=username.lower(),
+                           role_id=admin_role.id if is_admin else default_role_id, password_hash=None,
+                           confirmed=True, name=(row.get('name') or '')[:64] or None,
+                           homeland=(row.get('homeland') or '')[:64] or None, about=row.get('about'),
+                           created_at=created_at, updated_at=row.get('updated_at') or created_at,
+                           last_seen=row.get('last_seen') or created_at,
+                           avatar=gravatar_url(email) if email else None)
+
+        self.insert(User.__table__, new_rows(), 'user')
+
+    def import_topic_groups(self, rows):
+        # Groups are few, so they are ordered parents first to map parents before children. A group without
+        # a parent in the dump is a child of the target group and the root of the dump is the target group.
+        ids = self.ids['topic_group']
+        rows = list(rows)
+        for row in rows:
+            if row.get('group_id') is None or row['group_id'] == row['id']:
+                ids[row['id']] = self.topic_group_id
+        rows = [row for row in rows if row['id'] not in ids]
+        row_ids = set(row['id'] for row in rows)
+        children = {}
+        for row in rows:
+            children.setdefault(row['group_id'], []).append(row)
+        ordered, pending = [], [row for row in rows if row['group_id'] not in row_ids]
+        while pending:
+            row = pending.pop()
+            ordered.append(row)
+            pending.extend(children.get(row['id'], []))
+        self.skipped['topic_group'] += len(rows) - len(ordered)  # cycles of groups
+
+        def new_rows():
+            for row in ordered:
+                group_id = ids.get(row['group_id'], self.topic_group_id)
+                topic_group_id = ids[row['id']] = self.allocate_id('topic_group')
+                created_at = row.get('created_at') or datetime.utcnow()
+                yield dict(id=topic_group_id, title=(row.get('title') or '')[:64], group_id=group_id,
+                           priority=row.get('priority') or current_app.config['TOPIC_GROUP_PRIORITY'][-1],
+                           protected=bool(row.get('protected')), author_id=self.ids['user'].get(row.get('author_id')),
+                           created_at=created_at, updated_at=row.get('updated_at') or created_at,
+                           deleted=bool(row.get('deleted')))
+
+        self.insert(TopicGroup.__table__, new_rows(), 'topic_group')
+
+    def import_topics(self, rows):
+        def new_rows():
+            for row in rows:
+                resolved = self.resolve('topic', row, author_id='user')
+                if resolved is None:
+                    continue
+                # Topics of a dump without groups are topics of the target group.
+                if row.get('group_id') is None:
+                    resolved['group_id'] = self.topic_group_id
+                elif row['group_id'] in self.ids['topic_group']:
+                    resolved['group_id'] = self.ids['topic_group'][row['group_id']]
+                else:
+                    self.skipped['topic'] += 1
+                    continue
+                topic_id = self.ids['topic'][row['id']] = self.allocate_id('topic')
+                created_at = row.get('created_at') or datetime.utcnow()
+                yield dict(resolved, id=topic_id, title=(row.get('title') or '')[:128], body=row.get('body'),
+                           body_html=self.body_html(row), poll=(row.get('poll') or '')[:256] or None,
+                           created_at=created_at,
+                           updated_at=row.get('updated_at') or created_at, deleted=bool(row.get('deleted')),
+                           interest=0)
+
+        self.insert(Topic.__table__, self.rendered(new_rows()), 'topic')
+
+    def import_poll_answers(self, rows):
+        def new_rows():
+            for row in rows:
+                resolved = self.resolve('poll_answer', row, topic_id='topic')
+                if resolved is None:
+                    continue
+                answer_id = self.ids['poll_answer'][row['id']] = self.allocate_id('poll_answer')
+                yield dict(resolved, id=answer_id, body=row.get('body'), deleted=bool(row.get('deleted')))
+
+        self.insert(PollAnswer.__table__, new_rows(), 'poll_answer')
+
+    def import_poll_votes(self, rows):
+        def new_rows():
+            for row in rows:
+                resolved = self.resolve('poll_vote', row, topic_id='topic', poll_answer_id='poll_answer',
+                                        author_id='user')
+                if resolved is None or (resolved['topic_id'], resolved['author_id']) in self.votes:
+                    continue
+                self.votes.add((resolved['topic_id'], resolved['author_id']))
+                vote_id = self.ids['poll_vote'][row['id']] = self.allocate_id('poll_vote')
+                yield dict(resolved, id=vote_id, created_at=row.get('created_at') or datetime.utcnow(),
+                           deleted=bool(row.get('deleted')))
+
+        self.insert(PollVote.__table__, new_rows(), 'poll_vote')
+
+    def import_comments(self, rows):
+        def new_rows():
+            for row in rows:
+                resolved = self.resolve('comment', row, topic_id='topic', author_id='user')
+                if resolved is None:
+                    continue
+                comment_id = self.ids['comment'][row['id']] = self.allocate_id('comment')
+                created_at = row.get('created_at') or datetime.utcnow()
+                seq = self.comment_seqs[resolved['topic_id']] = self.comment_seqs.get(resolved['topic_id'], 0) + 1
+                yield dict(resolved, id=comment_id, body=row.get('body'), body_html=self.body_html(row),
+                           created_at=created_at, updated_at=row.get('updated_at') or created_at,
+                           deleted=bool(row.get('deleted')), seq=seq)
+
+        self.insert(Comment.__table__, self.rendered(new_rows()), 'comment')
+
+    def import_messages(self, rows):
+        # Conversations of messages are inserted before messages, so messages of a run are read at once.
+        if self.conversations is None:
+            self.conversations = dict(((user1_id, user2_id), conversation_id) for conversation_id, user1_id, user2_id
+                                      in db.session.query(Conversation.id, Conversation.user1_id,
+                                                          Conversation.user2_id))
+        messages, new_conversations = [], []
+        for row in rows:
+            resolved = self.resolve('message', row, author_id='user', receiver_id='user')
+            if resolved is None or resolved['author_id'] == resolved['receiver_id']:
+                continue
+            author_id, receiver_id = resolved['author_id'], resolved['receiver_id']
+            created_at = row.get('created_at') or datetime.utcnow()
+            pair = tuple(sorted((author_id, receiver_id)))
+            conversation_id = self.conversations.get(pair)
+            if conversation_id is None:
+                if self.next_conversation_id is None:
+                    self.next_conversation_id = next_id(Conversation.__table__)
+                conversation_id = self.conversations[pair] = self.next_conversation_id
+                self.next_conversation_id += 1
+                self.new_conversations[conversation_id] = pair
+                new_conversations.append(dict(id=conversation_id, user1_id=pair[0], user2_id=pair[1],
+                                              created_at=created_at))
+            message_id = self.ids['message'][row['id']] = self.allocate_id('message')
+            message = dict(resolved, id=message_id, title=(row.get('title') or '')[:128], body=row.get('body'),
+                           body_html=self.body_html(row), created_at=created_at, conversation_id=conversation_id,
+                           author_deleted=bool(row.get('author_deleted')),
+                           receiver_deleted=bool(row.get('receiver_deleted')),
+                           unread=row.get('unread') is not False)
+            messages.append(message)
+            for user_id, interlocutor_id, deleted in ((author_id, receiver_id, message['author_deleted']),
+                                                      (receiver_id, author_id, message['receiver_deleted'])):
+                member = self.members.setdefault((conversation_id, user_id), dict(
+                    conversation_id=conversation_id, user_id=user_id, interlocutor_id=interlocutor_id,
+                    last_message_id=None, last_message_at=None, messages_count=0, unread_count=0))
+                if deleted:
+                    continue
+                member['messages_count'] += 1
+                member['unread_count'] += 1 if message['unread'] and user_id == receiver_id else 0
+                if member['last_message_at'] is None or created_at > member['last_message_at']:
+                    member['last_message_id'], member['last_message_at'] = message_id, created_at
+
+        if new_conversations:
+            self.insert(Conversation.__table__, new_conversations)
+        self.insert(Message.__table__, self.rendered(messages), 'message')
+
+    def import_conversation_members(self):
+        """Members of new conversations with counters and changes of counters of existing conversations."""
+        if not self.members:
+            return
+        self.insert(ConversationMember.__table__, (member for key, member in self.members.items()
+                                                   if key[0] in self.new_conversations))
+        changes = [member for key, member in self.members.items()
+                   if key[0] not in self.new_conversations and member['messages_count']]
+        if changes:
+            members = ConversationMember.__table__
+            is_last = db.or_(members.c.last_message_at.is_(None),
+                             members.c.last_message_at < db.bindparam('member_last_message_at'))
+            db.session.execute(members.update().where(and_(
+                members.c.conversation_id == db.bindparam('member_conversation_id'),
+                members.c.user_id == db.bindparam('member_user_id'))).values(
+                messages_count=members.c.messages_count + db.bindparam('member_messages_count'),
+                unread_count=members.c.unread_count + db.bindparam('member_unread_count'),
+                last_message_id=case([(is_last, db.bindparam('member_last_message_id'))],
+                                     else_=members.c.last_message_id),
+                last_message_at=case([(is_last, db.bindparam('member_last_message_at'))],
+                                     else_=members.c.last_message_at)),
+                [dict(member_conversation_id=member['conversation_id'], member_user_id=member['user_id'],
+                      member_messages_count=member['messages_count'], member_unread_count=member['unread_count'],
+                      member_last_message_id=member['last_message_id'],
+                      member_last_message_at=member['last_message_at']) for member in changes])
+
+    def check(self):
+        """Raises IntegrityCheckError if imported rows are missing or refer to missing rows."""
+        errors = []
+        for row_type, first_id in sorted(self.first_ids.items()):
+            table = MODELS[row_type].__table__
+            imported = db.session.query(func.count(table.c.id)).filter(table.c.id >= first_id).scalar()
+            if imported != self.counts[row_type]:
+                errors.append('{}: {} rows imported, {} rows found'.format(table.name, self.counts[row_type],
+                                                                          imported))
+            for fk in sorted(table.foreign_keys, key=lambda fk: fk.parent.name):
+                referenced = fk.column.table.alias()
+                referenced_column = referenced.c[fk.column.name]
+                missing = db.session.query(func.count(table.c.id)).select_from(
+                    table.outerjoin(referenced, fk.parent == referenced_column)).filter(and_(
+                        table.c.id >= first_id, fk.parent.isnot(None), referenced_column.is_(None))).scalar()
+                if missing:
+                    errors.append('{}.{}: {} rows refer to missing rows'.format(table.name, fk.parent.name, missing))
+        if 'poll_vote' in self.first_ids:
+            votes, answers = PollVote.__table__, PollAnswer.__table__
+            mismatched = db.session.query(func.count(votes.c.id)).select_from(
+                votes.join(answers, votes.c.poll_answer_id == answers.c.id)).filter(and_(
+                    votes.c.id >= self.first_ids['poll_vote'], votes.c.topic_id != answers.c.topic_id)).scalar()
+            if mismatched:
+                errors.append('polls_votes: {} votes for answers of other topics'.format(mismatched))
+        if self.new_conversations:
+            members = db.session.query(func.count(ConversationMember.user_id)).filter(
+                ConversationMember.conversation_id >= min(self.new_conversations)).scalar()
+            if members != 2 * len(self.new_conversations):
+                errors.append('conversations_members: {} members of {} new conversations'.format(
+                    members, len(self.new_conversations)))
+        if errors:
+            raise IntegrityCheckError('Import is rolled back:\n' + '\n'.join(errors))
+
+
+def import_dump(path, topic_group_id=None, processes=None, batch_size=5000, trust_html=False):
+    return Importer(topic_group_id=topic_group_id, processes=processes, batch_size=batch_size,
+                    trust_html=trust_html).run(read_dump(path))
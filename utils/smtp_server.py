@@ -0,0 +1,74 @@
+"""Local stand-in SMTP server for tests and benchmarks of the mail delivery.
+
+Runs the standard library smtpd server in a thread, collects received messages and counts SMTP sessions:
+
+    with LocalSMTPServer() as server:
+        app.extensions['mail'].server, app.extensions['mail'].port = server.host, server.port
+        ...
+        assert len(server.messages) == 1
+"""
+import asyncore
+import smtpd
+import threading
+import time
+
+
+class _Server(smtpd.SMTPServer):
+    def __init__(self, owner, host):
+        smtpd.SMTPServer.__init__(self, (host, 0), None)
+        self.owner = owner
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.handle_accepted(*pair)
+
+    def handle_accepted(self, conn, addr):
+        self.owner.sessions += 1
+        _Channel(self.owner, self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.owner.messages.append((mailfrom, rcpttos, data))
+        self.owner.received_at.append(time.time())
+
+
+class _Channel(smtpd.SMTPChannel):
+    def __init__(self, owner, server, conn, addr):
+        smtpd.SMTPChannel.__init__(self, server, conn, addr)
+        self.owner = owner
+
+    def found_terminator(self):
+        # Latency of the network and the server on every SMTP command.
+        if self.owner.latency:
+            time.sleep(self.owner.latency)
+        smtpd.SMTPChannel.found_terminator(self)
+
+
+class LocalSMTPServer(object):
+    def __init__(self, host='127.0.0.1', latency=0.0):
+        self.messages = []
+        self.received_at = []
+        self.sessions = 0
+        self.latency = latency
+        self.server = _Server(self, host)
+        self.host, self.port = self.server.socket.getsockname()[:2]
+        self.thread = threading.Thread(target=asyncore.loop, kwargs=dict(timeout=0.05, map=self.server._map))
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for channel in list(self.server._map.values()):
+            channel.close()
+        self.thread.join()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self.messages) >= count